@@ -0,0 +1,18 @@
+"""
+asyncio entry point for the service-area lookup hot path (see geoapi/aio.py).
+
+It exposes the aiohttp application as a module-level variable named
+``application``, for gunicorn with the
+``aiohttp.worker.GunicornWebWorker`` worker class.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "_project_.settings")
+django.setup()
+
+from geoapi.aio import create_app  # noqa
+
+application = create_app()
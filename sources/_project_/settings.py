@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import tempfile
 from os.path import join, abspath, normpath, dirname
 import warnings
 
@@ -19,13 +20,25 @@ BASE_DIR = dirname(dirname(abspath(__file__)))
 PROJECT_ROOT = dirname(abspath(__file__))
 DATA_DIR = normpath(os.environ.get('DATA_DIR', join(BASE_DIR, '__data__')))
 
-REDIS_HOST = 'redis'
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', '6379'))
+REDIS_DB = int(os.environ.get('REDIS_DB', '0'))
+REDIS_TIMEOUT = float(os.environ.get('REDIS_TIMEOUT', '0.5'))
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST', '127.0.0.1')
 
 POSTGRES_DB_NAME = os.environ.get('POSTGRES_DB_NAME', 'geodjango')
 POSTGRES_USER = os.environ.get('POSTGRES_USER', 'pahaz')
 POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
 POSTGRES_PORT = int(os.environ.get('POSTGRES_PORT', '5432'))
+# comma separated `host[:port]` of streaming replicas (see utils/db.py)
+POSTGRES_REPLICA_HOSTS = [
+    x.strip() for x in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')
+    if x.strip()]
+POSTGRES_REPLICA_STICKY_SECONDS = int(
+    os.environ.get('POSTGRES_REPLICA_STICKY_SECONDS', '10'))
+POSTGRES_CONN_MAX_AGE = int(os.environ.get('POSTGRES_CONN_MAX_AGE', '60'))
+POSTGRES_CONN_HEALTH_CHECK = int(
+    os.environ.get('POSTGRES_CONN_HEALTH_CHECK', '30'))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.8/howto/deployment/checklist/
@@ -54,14 +67,18 @@ INSTALLED_APPS = (
 
     'rest_framework',
     'rest_framework_gis',
+    'django_filters',
     'djmoney',
     'phonenumber_field',
 
     # apps
     'geoapi',
+    'benchmarks',
 )
 
 MIDDLEWARE_CLASSES = (
+    'utils.middleware.RequestTimingMiddleware',
+    'utils.middleware.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -99,14 +116,26 @@ WSGI_APPLICATION = '_project_.wsgi.application'
 # https://docs.djangoproject.com/en/1.8/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        # PostGIS with timed cursors, see utils/metrics.py
+        'ENGINE': 'utils.postgis',
         'NAME': POSTGRES_DB_NAME,
         'USER': POSTGRES_USER,
         'PASSWORD': POSTGRES_PASSWORD,
         'HOST': POSTGRES_HOST,
         'PORT': POSTGRES_PORT,
+        'CONN_MAX_AGE': POSTGRES_CONN_MAX_AGE,
     }
 }
+DATABASE_REPLICAS = []
+for i, host in enumerate(POSTGRES_REPLICA_HOSTS, 1):
+    host, _, port = host.partition(':')
+    alias = 'replica%d' % i
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host,
+        PORT=int(port) if port else POSTGRES_PORT,
+        TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['utils.db.ReplicaRouter']
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -139,3 +168,95 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     )
 }
+
+# GEOAPI
+# `poly__contains` lookup engine: `sql` (PostGIS ST_Contains),
+# `index` (in-process STR-tree, see geoapi/index.py), `subdivided`
+# (ST_Contains against the ST_Subdivide pieces, see ServiceAreaPiece) or
+# `grid` (cells inside an area match without ST_Contains, see AreaCell);
+# the pieces and cells are only kept up to date for their engine, run
+# `manage.py build_area_pieces` or `build_area_cells` when switching
+GEOAPI_LOOKUP_ENGINE = os.environ.get('GEOAPI_LOOKUP_ENGINE', 'sql')
+GEOAPI_SUBDIVIDE_MAX_VERTICES = int(
+    os.environ.get('GEOAPI_SUBDIVIDE_MAX_VERTICES', '256'))
+# written polygons are made valid and normalized, and simplified down to
+# GEOAPI_MAX_VERTICES points unless it is 0 (see geoapi/normalize.py)
+GEOAPI_NORMALIZE_POLYGONS = \
+    os.environ.get('GEOAPI_NORMALIZE_POLYGONS', 'true').lower() == 'true'
+GEOAPI_MAX_VERTICES = int(os.environ.get('GEOAPI_MAX_VERTICES', '0'))
+# AreaCell grid level, `manage.py build_area_cells` after changing it
+GEOAPI_GRID_LEVEL = int(os.environ.get('GEOAPI_GRID_LEVEL', '12'))
+GEOAPI_INDEX_NODE_CAPACITY = 16
+GEOAPI_INDEX_REPACK_SIZE = 64
+GEOAPI_INDEX_CHECK_INTERVAL = int(
+    os.environ.get('GEOAPI_INDEX_CHECK_INTERVAL', '5'))
+# `manage.py build_area_index` output, memory-mapped by the `index` engine
+GEOAPI_INDEX_SNAPSHOT = os.environ.get(
+    'GEOAPI_INDEX_SNAPSHOT', join(DATA_DIR, 'area_index.bin'))
+
+# Redis result cache for `poly__contains` lookups (see geoapi/cache.py).
+# Points are quantized to `decimal` places or to a `geohash` of the given
+# length; 6 decimal places is ~0.1 m.
+GEOAPI_LOOKUP_CACHE = \
+    os.environ.get('GEOAPI_LOOKUP_CACHE', 'false').lower() == 'true'
+GEOAPI_LOOKUP_CACHE_KEY = os.environ.get('GEOAPI_LOOKUP_CACHE_KEY', 'decimal')
+GEOAPI_LOOKUP_CACHE_PRECISION = int(
+    os.environ.get('GEOAPI_LOOKUP_CACHE_PRECISION', '6'))
+GEOAPI_LOOKUP_CACHE_TIMEOUT = int(
+    os.environ.get('GEOAPI_LOOKUP_CACHE_TIMEOUT', '300'))
+
+# POST /api/v1/service-areas/lookup/ accepts at most this many points
+GEOAPI_BATCH_LOOKUP_MAX_POINTS = int(
+    os.environ.get('GEOAPI_BATCH_LOOKUP_MAX_POINTS', '1000'))
+
+# GET /api/v1/service-areas/?near=lng,lat returns this many areas unless
+# `limit=` (at most GEOAPI_NEAR_MAX_LIMIT) is given
+GEOAPI_NEAR_LIMIT = int(os.environ.get('GEOAPI_NEAR_LIMIT', '10'))
+GEOAPI_NEAR_MAX_LIMIT = int(os.environ.get('GEOAPI_NEAR_MAX_LIMIT', '100'))
+
+# POST/PUT/PATCH/DELETE /api/v1/service-areas/bulk/ accept at most this many
+# items
+GEOAPI_BULK_MAX_ITEMS = int(os.environ.get('GEOAPI_BULK_MAX_ITEMS', '1000'))
+
+# GET /api/v1/{providers,service-areas}/changes/ (see geoapi/changes.py):
+# rows and tombstones per page, rows updated less than GEOAPI_CHANGES_LAG
+# seconds ago wait for the next call (the longest a write transaction may
+# take to commit), tombstones are kept for GEOAPI_TOMBSTONE_DAYS (see
+# `manage.py purge_tombstones`), older cursors get a 410
+GEOAPI_CHANGES_PAGE_SIZE = int(
+    os.environ.get('GEOAPI_CHANGES_PAGE_SIZE', '500'))
+GEOAPI_CHANGES_LAG = int(os.environ.get('GEOAPI_CHANGES_LAG', '10'))
+GEOAPI_TOMBSTONE_DAYS = int(os.environ.get('GEOAPI_TOMBSTONE_DAYS', '30'))
+
+# Vector tiles, /api/v1/service-areas/tiles/{z}/{x}/{y}.pbf (see
+# geoapi/tiles.py). Tiles touched by a changed area are dropped from the
+# cache, a zoom level with more such tiles than
+# GEOAPI_TILE_INVALIDATE_MAX_TILES is dropped as a whole.
+GEOAPI_TILE_CACHE = \
+    os.environ.get('GEOAPI_TILE_CACHE', 'true').lower() == 'true'
+GEOAPI_TILE_CACHE_TIMEOUT = int(
+    os.environ.get('GEOAPI_TILE_CACHE_TIMEOUT', '86400'))
+GEOAPI_TILE_INVALIDATE_MAX_TILES = 256
+GEOAPI_TILE_MAX_ZOOM = 22
+GEOAPI_TILE_EXTENT = 4096
+GEOAPI_TILE_BUFFER = 64
+
+# Let PostGIS render the geometries of service-area list/retrieve/export
+# responses (ST_AsGeoJSON, 15 decimal digits) and splice them into the JSON
+# unparsed. Same values, different bytes: integral coordinates print as
+# `0` and coordinates are rounded to 15 decimals, see geoapi/renderers.py
+GEOAPI_RAW_GEOJSON = \
+    os.environ.get('GEOAPI_RAW_GEOJSON', 'false').lower() == 'true'
+
+# asyncio lookup service (`_project_.lookup`, see geoapi/aio.py): database
+# alias it reads from and the size of its asyncpg connection pool
+GEOAPI_ASYNC_DATABASE = os.environ.get('GEOAPI_ASYNC_DATABASE', 'default')
+GEOAPI_ASYNC_POOL_SIZE = int(os.environ.get('GEOAPI_ASYNC_POOL_SIZE', '20'))
+
+# Per-request timing histograms served on /metrics (see utils/metrics.py),
+# every worker dumps its own file to GEOAPI_METRICS_DIR (scratch space
+# shared by the workers of one host, not kept across restarts)
+GEOAPI_METRICS = os.environ.get('GEOAPI_METRICS', 'true').lower() == 'true'
+GEOAPI_METRICS_DIR = os.environ.get(
+    'GEOAPI_METRICS_DIR', join(tempfile.gettempdir(), 'geoapi-metrics'))
+GEOAPI_METRICS_FLUSH_INTERVAL = 5
@@ -2,6 +2,8 @@ from django.conf.urls import include, url
 from django.contrib.gis import admin
 from django.shortcuts import redirect, render
 
+from utils.metrics import metrics_view
+
 __author__ = 'pahaz'
 
 
@@ -14,5 +16,6 @@ def index(request):
 urlpatterns = [
     url(r'^$', index, name='index'),
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^metrics$', metrics_view, name='metrics'),
     url(r'^', include('geoapi.urls')),
 ]
@@ -0,0 +1,98 @@
+"""
+Synthetic providers and service areas for the benchmarks.
+
+Polygons are star-shaped around their center (every vertex is at a random
+radius on a sorted angle), so they are always valid; a hole is a smaller
+regular polygon around the center. Centers are spread over a square sized
+so that on average `overlap` areas cover a random point inside it.
+"""
+import math
+import random
+
+from django.contrib.gis.geos import Polygon
+from django.db import transaction
+
+from geoapi.bulk import save_service_areas
+from geoapi.models import Provider, ServiceArea
+
+NAME_PREFIX = 'bench-'
+CURRENCIES = ('USD', 'EUR', 'RUB')
+
+
+class Dataset(object):
+    def __init__(self, providers=10, areas=1000, vertices=32,
+                 overlap=2.0, holes=0.1, radius=0.05, origin=(30.0, 50.0),
+                 seed=0):
+        self.providers = providers
+        self.areas = areas
+        self.vertices = vertices
+        self.overlap = overlap
+        self.holes = holes
+        self.radius = radius
+        self.origin = origin
+        self.random = random.Random(seed)
+
+    @property
+    def size(self):
+        """ Side of the square the area centers are spread over """
+        return self.radius * math.sqrt(
+            max(self.areas, 1) * math.pi / self.overlap)
+
+    @property
+    def extent(self):
+        x, y = self.origin
+        return x, y, x + self.size, y + self.size
+
+    def random_point(self):
+        minx, miny, maxx, maxy = self.extent
+        return (self.random.uniform(minx, maxx),
+                self.random.uniform(miny, maxy))
+
+    def polygon(self):
+        cx, cy = self.random_point()
+        step = 2 * math.pi / self.vertices
+        shell = []
+        for i in range(self.vertices):
+            angle = step * (i + self.random.uniform(0, 0.9))
+            r = self.radius * self.random.uniform(0.6, 1.0)
+            shell.append((cx + r * math.cos(angle), cy + r * math.sin(angle)))
+        shell.append(shell[0])
+        rings = [shell]
+        if self.random.random() < self.holes:
+            r = self.radius * 0.3
+            count = min(self.vertices, 16)
+            hole_step = 2 * math.pi / count
+            hole = [(cx + r * math.cos(hole_step * i),
+                     cy + r * math.sin(hole_step * i))
+                    for i in range(count)]
+            rings.append(hole + hole[:1])
+        return Polygon(*rings, srid=4326)
+
+    def create(self, batch_size=1000, progress=None):
+        """ Insert the providers and areas, returns the providers """
+        with transaction.atomic():
+            providers = Provider.objects.bulk_create([
+                Provider(name='%s%d' % (NAME_PREFIX, i),
+                         currency=CURRENCIES[i % len(CURRENCIES)])
+                for i in range(self.providers)])
+        created = 0
+        while created < self.areas:
+            count = min(batch_size, self.areas - created)
+            areas = []
+            for i in range(created, created + count):
+                provider = self.random.choice(providers)
+                areas.append(ServiceArea(
+                    provider=provider, name='%s%d' % (NAME_PREFIX, i),
+                    poly=self.polygon(),
+                    price=round(self.random.uniform(1, 100), 2),
+                    price_currency=provider.currency))
+            save_service_areas(areas, [], (), batch_size)
+            created += count
+            if progress:
+                progress(created)
+        return providers
+
+
+def clear():
+    """ Delete everything `Dataset.create` made """
+    Provider.objects.filter(name__startswith=NAME_PREFIX).delete()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.data import Dataset, clear
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic providers and service areas for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--providers', type=int, default=10)
+        parser.add_argument('--areas', type=int, default=1000)
+        parser.add_argument('--vertices', type=int, default=32,
+                            help='vertices per polygon (at least 8)')
+        parser.add_argument('--overlap', type=float, default=2.0,
+                            help='average number of areas covering a point')
+        parser.add_argument('--holes', type=float, default=0.1,
+                            help='share of polygons with a hole')
+        parser.add_argument('--radius', type=float, default=0.05,
+                            help='polygon radius in degrees')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--clear', action='store_true',
+                            help='delete previously generated data first')
+
+    def handle(self, *args, **options):
+        if options['vertices'] < 8:
+            raise CommandError('--vertices must be at least 8')
+        if options['providers'] < 1 or options['overlap'] <= 0:
+            raise CommandError('--providers and --overlap must be positive')
+        if options['clear']:
+            clear()
+        dataset = Dataset(
+            providers=options['providers'], areas=options['areas'],
+            vertices=options['vertices'], overlap=options['overlap'],
+            holes=options['holes'], radius=options['radius'],
+            seed=options['seed'])
+        started = time.time()
+
+        def progress(created):
+            self.stdout.write('%d areas %.0f rows/sec' % (
+                created, created / max(time.time() - started, 1e-6)))
+
+        dataset.create(options['batch_size'], progress)
+        self.stdout.write('extent: %s' % ','.join(
+            '%.6f' % x for x in dataset.extent))
@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.data import Dataset
+from benchmarks.scenarios import SCENARIOS
+from geoapi.models import Provider, ServiceArea
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request',
+           'rows_per_sec')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Run the service-area API benchmarks and save the results as JSON'
+
+    def add_arguments(self, parser):
+        names = [x.name for x in SCENARIOS]
+        parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                            help='any of %s (default: all)' % ', '.join(names))
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='random points and polygons seed')
+        parser.add_argument('--overlap', type=float, default=2.0,
+                            help='--overlap the data was generated with')
+        parser.add_argument('--radius', type=float, default=0.05,
+                            help='--radius the data was generated with')
+        parser.add_argument('-o', '--output',
+                            help='result file (default: DATA_DIR/benchmarks/'
+                                 '<time>-<revision>.json)')
+        parser.add_argument('--compare', help='earlier result file')
+
+    def handle(self, *args, **options):
+        scenarios = dict((x.name, x) for x in SCENARIOS)
+        names = options['scenarios'] or [x.name for x in SCENARIOS]
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError('unknown scenario: %s' % ', '.join(unknown))
+        areas = ServiceArea.objects.count()
+        if not areas:
+            raise CommandError('no service areas, run generate_service_areas')
+        dataset = Dataset(areas=areas, overlap=options['overlap'],
+                          radius=options['radius'], seed=options['seed'])
+        revision = git_revision()
+        result = {
+            'revision': revision,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': {
+                'GEOAPI_LOOKUP_ENGINE': settings.GEOAPI_LOOKUP_ENGINE,
+                'GEOAPI_LOOKUP_CACHE': settings.GEOAPI_LOOKUP_CACHE,
+                'GEOAPI_RAW_GEOJSON': settings.GEOAPI_RAW_GEOJSON,
+            },
+            'dataset': {
+                'providers': Provider.objects.count(),
+                'areas': areas,
+                'extent': dataset.extent,
+            },
+            'scenarios': {},
+        }
+        for name in names:
+            stats = scenarios[name](dataset).run(
+                options['requests'], options['warmup'])
+            result['scenarios'][name] = stats
+            self.stdout.write('%-16s %s' % (name, '  '.join(
+                '%s=%.2f' % (x, stats[x]) for x in METRICS)))
+
+        path = options['output']
+        if not path:
+            path = os.path.join(
+                settings.DATA_DIR, 'benchmarks', '%s-%s.json' % (
+                    time.strftime('%Y%m%d-%H%M%S'), revision or 'unknown'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump(result, fp, indent=2, sort_keys=True)
+        self.stdout.write('saved %s' % path)
+        if options['compare']:
+            self.compare(options['compare'], result)
+
+    def compare(self, path, result):
+        with open(path) as fp:
+            before = json.load(fp)
+        self.stdout.write('compared to %s (%s):' % (
+            path, before.get('revision')))
+        for name, stats in sorted(result['scenarios'].items()):
+            old = before['scenarios'].get(name)
+            if not old:
+                continue
+            self.stdout.write('%-16s %s' % (name, '  '.join(
+                '%s %.2f -> %.2f (%+.0f%%)' % (
+                    x, old[x], stats[x],
+                    (stats[x] - old[x]) / old[x] * 100 if old[x] else 0)
+                for x in ('p50_ms', 'p95_ms', 'queries_per_request'))))
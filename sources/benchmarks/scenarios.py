@@ -0,0 +1,183 @@
+"""
+Repeatable request scenarios against the service-area API.
+
+Requests go through the DRF test client, in process, so the numbers are
+view + serializer + database time without the HTTP server. Writes run in
+a transaction which is rolled back at the end of the scenario; their
+`transaction.on_commit` work (cache invalidation, area index updates) is
+run after every request and timed with it.
+"""
+import json
+import math
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from geoapi.index import area_index
+from geoapi.models import Provider, ServiceArea
+
+AREAS_URL = '/api/v1/service-areas/'
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted `values` """
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Scenario(object):
+    name = None
+    writes = False
+
+    def __init__(self, dataset, client=None):
+        self.dataset = dataset
+        self.random = dataset.random
+        self.client = client or APIClient()
+
+    def setup(self):
+        pass
+
+    def request(self):
+        """ Make one request, return the number of rows it returned """
+        raise NotImplementedError
+
+    def check(self, response):
+        if response.status_code >= 400:
+            raise RuntimeError('%s: %s %s' % (
+                self.name, response.status_code, response.content[:200]))
+        return response
+
+    def run(self, requests, warmup=5):
+        try:
+            with transaction.atomic():
+                self.setup()
+                for _ in range(warmup):
+                    self.request()
+                    self.run_commit_hooks()
+                result = self.measure(requests)
+                if self.writes:
+                    raise Rollback
+        except Rollback:
+            # the index was updated with the rows just rolled back
+            area_index.clear()
+        return result
+
+    def run_commit_hooks(self):
+        """ Run the `on_commit` work the rolled back writes registered """
+        if not self.writes:
+            return
+        hooks, connection.run_on_commit = connection.run_on_commit, []
+        for _, func in hooks:
+            func()
+
+    def measure(self, requests):
+        latencies = []
+        queries = 0
+        rows = 0
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                rows += self.request()
+                self.run_commit_hooks()
+                latencies.append(time.perf_counter() - started)
+            queries += len(captured)
+        latencies.sort()
+        total = sum(latencies)
+        return {
+            'requests': requests,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'mean_ms': total / requests * 1000,
+            'queries_per_request': queries / float(requests),
+            'rows_per_sec': rows / total if total else 0.0,
+        }
+
+
+class PointLookup(Scenario):
+    name = 'point_lookup'
+
+    def request(self):
+        point = {'type': 'Point', 'coordinates': self.dataset.random_point()}
+        r = self.check(self.client.get(AREAS_URL, {
+            'poly__contains': json.dumps(point)}))
+        return len(r.data['features'])
+
+
+class ProviderFilter(Scenario):
+    name = 'provider_filter'
+
+    def setup(self):
+        self.provider_ids = list(Provider.objects.values_list('id', flat=True))
+
+    def request(self):
+        r = self.check(self.client.get(AREAS_URL, {
+            'provider_id': self.random.choice(self.provider_ids)}))
+        return len(r.data['features'])
+
+
+class ListPage(Scenario):
+    name = 'list_page'
+
+    def setup(self):
+        self.pages = max(ServiceArea.objects.count() // 50, 1)
+
+    def request(self):
+        r = self.check(self.client.get(AREAS_URL, {
+            'page': self.random.randint(1, self.pages)}))
+        return len(r.data['features'])
+
+
+class BatchLookup(Scenario):
+    name = 'batch_lookup'
+    points = 100
+
+    def request(self):
+        r = self.check(self.client.post(AREAS_URL + 'lookup/', [
+            {'type': 'Point', 'coordinates': self.dataset.random_point()}
+            for _ in range(self.points)], format='json'))
+        return sum(len(x['areas']) for x in r.data['results'])
+
+
+class Create(Scenario):
+    name = 'create'
+    writes = True
+
+    def setup(self):
+        self.provider_ids = list(Provider.objects.values_list('id', flat=True))
+
+    def request(self):
+        self.check(self.client.post(AREAS_URL, {
+            'name': 'bench-create',
+            'provider_id': self.random.choice(self.provider_ids),
+            'price': '10.00',
+            'poly': json.loads(self.dataset.polygon().geojson),
+        }, format='json'))
+        return 1
+
+
+class Update(Scenario):
+    name = 'update'
+    writes = True
+
+    def setup(self):
+        self.area_ids = list(ServiceArea.objects.values_list('id', flat=True))
+
+    def request(self):
+        self.check(self.client.patch(
+            '%s%d/' % (AREAS_URL, self.random.choice(self.area_ids)), {
+                'price': '%.2f' % self.random.uniform(1, 100),
+                'poly': json.loads(self.dataset.polygon().geojson),
+            }, format='json'))
+        return 1
+
+
+SCENARIOS = (PointLookup, ProviderFilter, ListPage, BatchLookup, Create,
+             Update)
@@ -0,0 +1,54 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from geoapi.models import Provider, ServiceArea
+from .data import Dataset
+from .scenarios import Create, percentile
+
+
+class TestBenchmarks(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_dataset_polygons_are_valid(self):
+        dataset = Dataset(vertices=8, holes=1, seed=1)
+        for _ in range(50):
+            poly = dataset.polygon()
+            self.assertTrue(poly.valid, poly.valid_reason)
+            self.assertEqual(len(poly), 2)
+            self.assertEqual(len(poly.coords[0]), 9)
+
+    def test_generate_and_run(self):
+        call_command('generate_service_areas', '--providers', '3',
+                     '--areas', '40', '--batch-size', '15',
+                     stdout=StringIO())
+        self.assertEqual(Provider.objects.count(), 3)
+        self.assertEqual(ServiceArea.objects.count(), 40)
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as fp:
+            call_command('run_benchmarks', '--requests', '5', '--warmup',
+                         '1', '-o', fp.name, stdout=StringIO())
+            result = json.load(fp)
+        self.assertEqual(result['dataset']['areas'], 40)
+        self.assertEqual(
+            sorted(result['scenarios']),
+            ['batch_lookup', 'create', 'list_page', 'point_lookup',
+             'provider_filter', 'update'])
+        self.assertEqual(ServiceArea.objects.count(), 40)
+        for stats in result['scenarios'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries_per_request'], 0)
+
+    def test_writes_run_commit_hooks(self):
+        call_command('generate_service_areas', '--providers', '2',
+                     '--areas', '10', stdout=StringIO())
+        Create(Dataset(areas=10)).run(3, warmup=1)
+        self.assertEqual(connection.run_on_commit, [])
+        self.assertEqual(ServiceArea.objects.count(), 10)
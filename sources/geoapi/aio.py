@@ -0,0 +1,158 @@
+"""
+asyncio version of `GET /api/v1/service-areas/?poly__contains=...` for
+the lookup hot path, served by `_project_.lookup` next to the WSGI app.
+
+Only `poly__contains` (required), `provider_id` and `page` are supported;
+the response is the `ServiceAreaViewSet` page (every field, full
+geometry rendered by PostGIS with 15 digits as with `GEOAPI_RAW_GEOJSON`).
+Queries go through an asyncpg pool to the `GEOAPI_ASYNC_DATABASE`
+connection settings, so one process keeps thousands of lookups in flight
+over `GEOAPI_ASYNC_POOL_SIZE` connections. The `subdivided` engine is
+honoured, every other `GEOAPI_LOOKUP_ENGINE` uses the `ST_Contains`
+query; the Redis lookup cache is not used.
+"""
+from collections import OrderedDict
+
+import asyncpg
+from aiohttp import web
+from django.conf import settings
+from rest_framework import exceptions
+
+from .lookups import parse_point, parse_provider_id
+from .models import Provider, ServiceArea, ServiceAreaPiece
+from .renderers import RawJSON, RawJSONRenderer
+
+PATH = '/api/v1/service-areas/'
+
+LOOKUP_SQL = """
+SELECT a.id, a.name, a.price, ST_AsGeoJSON(a.poly, 15),
+       a.xmin, a.ymin, a.xmax, a.ymax,
+       p.id, p.name, p.email, p.phone, p.language, p.currency,
+       count(*) OVER ()
+FROM {area} a
+JOIN {provider} p ON p.id = a.provider_id
+CROSS JOIN
+  (SELECT ST_SetSRID(ST_MakePoint($1::float8, $2::float8), 4326) AS point) g
+WHERE {contains} {where}
+ORDER BY a.id
+LIMIT $3 OFFSET $4
+"""
+
+CONTAINS_SQL = """
+ST_Contains(a.poly, g.point)
+"""
+
+SUBDIVIDED_CONTAINS_SQL = """
+EXISTS (SELECT 1 FROM {piece} s
+        WHERE s.area_id = a.id AND ST_Intersects(s.poly, g.point)
+          AND (ST_Contains(s.poly, g.point) OR ST_Contains(a.poly, g.point)))
+"""
+
+
+def lookup_sql(provider_id=None):
+    contains = CONTAINS_SQL
+    if settings.GEOAPI_LOOKUP_ENGINE == 'subdivided':
+        contains = SUBDIVIDED_CONTAINS_SQL
+    return LOOKUP_SQL.format(
+        area=ServiceArea._meta.db_table,
+        provider=Provider._meta.db_table,
+        contains=contains.strip().format(
+            piece=ServiceAreaPiece._meta.db_table),
+        where='AND a.provider_id = $5' if provider_id is not None else '')
+
+
+def feature(row):
+    """ Row of `LOOKUP_SQL` -> `ServiceAreaSerializer` representation """
+    (pk, name, price, geojson, xmin, ymin, xmax, ymax, provider_pk,
+     provider_name, email, phone, language, currency) = row[:14]
+    return OrderedDict([
+        ('id', pk),
+        ('type', 'Feature'),
+        ('geometry', RawJSON(geojson)),
+        ('bbox', (xmin, ymin, xmax, ymax)),
+        ('properties', OrderedDict([
+            ('name', name),
+            ('provider', OrderedDict([
+                ('id', provider_pk), ('name', provider_name),
+                ('email', email), ('phone', phone),
+                ('language', language), ('currency', currency)])),
+            ('price', format(price, '.8f'))])),
+    ])
+
+
+def page_url(url, page):
+    """ `url` with its `page` param set, or dropped for the first page """
+    query = [(k, v) for k, v in url.query.items() if k != 'page']
+    if page > 1:
+        query.append(('page', str(page)))
+    return str(url.with_query(query))
+
+
+def json_response(data, status=200):
+    return web.Response(
+        body=RawJSONRenderer().render(data), status=status,
+        content_type='application/json')
+
+
+async def lookup(request):
+    params = request.rel_url.query
+    try:
+        point = parse_point(params.get('poly__contains'))
+        provider_id = parse_provider_id(params.get('provider_id'))
+    except exceptions.ValidationError as e:
+        return json_response(e.detail, status=400)
+    if point is None:
+        return json_response(['poly__contains is required'], status=400)
+    try:
+        page = int(params.get('page', '1'))
+        if page < 1:
+            raise ValueError
+    except ValueError:
+        return json_response({'detail': 'Invalid page.'}, status=404)
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    args = list(point) + [page_size, (page - 1) * page_size]
+    if provider_id is not None:
+        args.append(provider_id)
+    async with request.app['pool'].acquire() as connection:
+        rows = await connection.fetch(lookup_sql(provider_id), *args)
+    if not rows and page > 1:
+        return json_response({'detail': 'Invalid page.'}, status=404)
+    count = rows[0][14] if rows else 0
+    url = request.url
+    return json_response(OrderedDict([
+        ('type', 'FeatureCollection'),
+        ('count', count),
+        ('next', page_url(url, page + 1)
+         if page * page_size < count else None),
+        ('previous', page_url(url, page - 1) if page > 1 else None),
+        ('features', [feature(row) for row in rows]),
+    ]))
+
+
+def connection_kwargs(alias):
+    database = settings.DATABASES[alias]
+    return {
+        'host': database['HOST'],
+        'port': database['PORT'],
+        'user': database['USER'],
+        'password': database['PASSWORD'],
+        'database': database['NAME'],
+    }
+
+
+async def open_pool(app):
+    app['pool'] = await asyncpg.create_pool(
+        min_size=1, max_size=settings.GEOAPI_ASYNC_POOL_SIZE,
+        **connection_kwargs(settings.GEOAPI_ASYNC_DATABASE))
+
+
+async def close_pool(app):
+    await app['pool'].close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get(PATH, lookup)
+    app.on_startup.append(open_pool)
+    app.on_cleanup.append(close_pool)
+    return app
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class GeoapiConfig(AppConfig):
+    name = 'geoapi'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,81 @@
+from django.db import connections, transaction
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from .models import AreaCell, ServiceArea, ServiceAreaPiece
+from .signals import service_areas_changed
+
+BULK_UPDATE_SQL = 'UPDATE {table} AS t SET {assignments} ' \
+                  'FROM (VALUES %s) AS v({columns}) WHERE t.{pk} = v.{pk}'
+
+
+def bulk_update(objs, fields, batch_size=1000, using='default'):
+    """
+    Save `fields` of `objs` (instances of one model) with
+    `UPDATE ... FROM (VALUES ...)`, one statement per `batch_size` rows.
+    `auto_now` fields are refreshed.
+    """
+    if not objs:
+        return
+    meta = type(objs[0])._meta
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    now = timezone.now()
+    fields = [meta.get_field(x) for x in fields]
+    fields.extend(x for x in meta.concrete_fields
+                  if getattr(x, 'auto_now', False) and x not in fields)
+    for obj in objs:
+        for field in fields:
+            if getattr(field, 'auto_now', False):
+                setattr(obj, field.attname, now)
+    sql = BULK_UPDATE_SQL.format(
+        table=qn(meta.db_table), pk=qn(meta.pk.column),
+        columns=', '.join(qn(x.column) for x in [meta.pk] + fields),
+        assignments=', '.join('%s = v.%s::%s' % (
+            qn(x.column), qn(x.column), x.db_type(connection))
+            for x in fields))
+    rows = [
+        [obj.pk] + [x.get_db_prep_save(getattr(obj, x.attname), connection)
+                    for x in fields]
+        for obj in objs]
+    with connection.cursor() as cursor:
+        execute_values(cursor, sql, rows, page_size=batch_size)
+
+
+def save_service_areas(created, updated, fields, batch_size=1000,
+                       errors=None):
+    """
+    `bulk_create` new areas and `bulk_update` existing ones in one
+    transaction. Bulk writes do not send `post_save`, so
+    `service_areas_changed` is sent instead. Polygons are normalized and
+    the bbox and size columns (and the pieces or the cells of the engine
+    in use) are refreshed like `ServiceArea.save` does it
+    (`InvalidPolygon` is raised before anything is written). With
+    `errors` (a list) the areas normalization rejects are left out and
+    `(index in created + updated, message)` of each is appended to it.
+    """
+    rejected = [] if errors is not None else None
+    if 'poly' in fields:
+        fields = list(fields) + list(ServiceArea.POLY_FIELDS)
+        ServiceArea.prepare_polys(created + updated, rejected)
+    else:
+        ServiceArea.prepare_polys(created, rejected)
+    if rejected:
+        errors.extend(rejected)
+        skip = set(i for i, _ in rejected)
+        created, updated = (
+            [x for i, x in enumerate(created) if i not in skip],
+            [x for i, x in enumerate(updated, len(created))
+             if i not in skip])
+    with transaction.atomic():
+        if created:
+            ServiceArea.objects.bulk_create(created, batch_size=batch_size)
+        if updated:
+            bulk_update(updated, fields, batch_size=batch_size)
+        changed = [x.pk for x in created] + \
+            ([x.pk for x in updated] if 'poly' in fields else [])
+        ServiceAreaPiece.objects.sync(changed)
+        AreaCell.objects.sync(changed)
+        service_areas_changed.send(
+            sender=ServiceArea,
+            provider_ids=set(x.provider_id for x in created + updated))
@@ -0,0 +1,155 @@
+"""
+Redis result cache for `poly__contains` lookups.
+
+Entries are keyed on the quantized point, the provider filter and the
+data version they were computed from: the version of the provider for
+`provider_id` lookups, the global version for the others. Every
+ServiceArea/Provider write bumps the global version and the versions of
+the affected providers, so lookups computed before the write are never
+addressed again and simply expire, while the lookups of the other
+providers stay. Misses are computed on the primary: a replica behind the
+write would store the old answer under the new version.
+"""
+import json
+import logging
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Resolve the versioned key, read it and count the hit or miss
+# in a single round trip.
+LOOKUP_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '0'
+local key = ARGV[1] .. ':' .. version
+local value = redis.call('GET', key)
+if value then
+    redis.call('INCR', ARGV[2])
+else
+    redis.call('INCR', ARGV[3])
+end
+return {key, value}
+"""
+
+_pool = None
+
+
+def get_redis():
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+            db=settings.REDIS_DB, socket_timeout=settings.REDIS_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_TIMEOUT)
+    return redis.StrictRedis(connection_pool=_pool)
+
+
+def geohash(x, y, precision):
+    lng_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, interval = (x, lng_range) if even else (y, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def quantize(point):
+    """
+    Point -> cache cell name. `GEOAPI_LOOKUP_CACHE_PRECISION` is the number
+    of decimal places or the geohash length; every point of a cell shares
+    the cached answer, so keep cells well below the map resolution.
+    """
+    x, y = point
+    precision = settings.GEOAPI_LOOKUP_CACHE_PRECISION
+    if settings.GEOAPI_LOOKUP_CACHE_KEY == 'geohash':
+        return geohash(x, y, precision)
+    return '%.*f,%.*f' % (precision, x, precision, y)
+
+
+class LookupCache(object):
+    prefix = 'geoapi:lookup:'
+
+    def __init__(self):
+        self._script = None
+
+    @property
+    def hits_key(self):
+        return self.prefix + 'hits'
+
+    @property
+    def misses_key(self):
+        return self.prefix + 'misses'
+
+    def version_key(self, provider_id=None):
+        if provider_id is None:
+            return self.prefix + 'version'
+        return self.prefix + 'version:%d' % provider_id
+
+    def _lookup(self, client, point, provider_id):
+        if self._script is None:
+            self._script = client.register_script(LOOKUP_SCRIPT)
+        keys = [self.version_key(provider_id)]
+        name = self.prefix + 'ids:%s:%s' % (
+            quantize(point), '' if provider_id is None else provider_id)
+        result = self._script(
+            keys=keys, args=[name, self.hits_key, self.misses_key],
+            client=client)
+        # a nil value truncates the returned Lua table
+        return result[0], result[1] if len(result) > 1 else None
+
+    def get_or_set(self, point, provider_id, compute):
+        """ Cached `compute()` result for the point and provider filter """
+        try:
+            client = get_redis()
+            key, value = self._lookup(client, point, provider_id)
+        except redis.RedisError as e:
+            logger.warning('lookup cache is unavailable: %s', e)
+            return compute()
+        if value is not None:
+            return json.loads(value.decode('utf-8'))
+        ids = compute()
+        try:
+            client.setex(key, settings.GEOAPI_LOOKUP_CACHE_TIMEOUT,
+                         json.dumps(ids))
+        except redis.RedisError as e:
+            logger.warning('lookup cache is unavailable: %s', e)
+        return ids
+
+    def bump(self, provider_ids=()):
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.incr(self.version_key())
+            for provider_id in set(provider_ids):
+                pipe.incr(self.version_key(provider_id))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error('can not invalidate lookup cache: %s', e)
+
+    def stats(self):
+        hits, misses = get_redis().mget(self.hits_key, self.misses_key)
+        return {'hits': int(hits or 0), 'misses': int(misses or 0)}
+
+    def reset_stats(self):
+        get_redis().delete(self.hits_key, self.misses_key)
+
+
+lookup_cache = LookupCache()
@@ -0,0 +1,142 @@
+"""
+Incremental sync: `GET /api/v1/<resource>/changes/` returns the rows
+changed and the ids deleted since a cursor.
+
+Changed rows come in `(updated, id)` order from the index on these
+columns and deletes in `(deleted, id)` order from the `Tombstone` index,
+both as keyset pages, so a sync costs the number of changes whatever the
+size of the table. Service areas embed their provider, a provider save
+sets the `updated` of its areas as well (geoapi/signals.py) so they are
+sent again. Without `cursor` (or `updated_since`) the first pages are a
+full sync. Rows newer than `GEOAPI_CHANGES_LAG` seconds are left
+for the next call: `updated` is set before the row commits, a horizon
+in the past keeps a slow transaction from committing a row behind a
+cursor which has already passed it. The feed reads from the primary for
+the same reason.
+"""
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, status
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
+
+from .models import Tombstone
+from .snapshot import NO_UPDATED, from_microseconds, to_microseconds
+
+
+class Gone(exceptions.APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'cursor expired, sync again without a cursor'
+    default_code = 'gone'
+
+
+def encode_cursor(position):
+    """ (updated, id, deleted, tombstone id) -> opaque cursor """
+    updated, pk, deleted, tombstone = position
+    value = '%d.%d.%d.%d' % (
+        to_microseconds(updated), pk, to_microseconds(deleted), tombstone)
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        updated, pk, deleted, tombstone = map(int, base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('ascii').split('.'))
+        if deleted == NO_UPDATED:
+            raise ValueError(cursor)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise exceptions.ValidationError({'cursor': ['invalid cursor']})
+    return (from_microseconds(updated), pk, from_microseconds(deleted),
+            tombstone)
+
+
+def after(queryset, field, value, pk):
+    """ Rows after (`value`, `pk`) in (`field`, id) order """
+    return queryset.filter(**{field + '__gte': value}).filter(
+        Q(**{field + '__gt': value}) | Q(id__gt=pk))
+
+
+class ChangeFeedMixin(object):
+    """
+    `changes` action of a viewset, the rows are `get_changes_queryset`
+    (without the filters of `list`) serialized as by `list`.
+    """
+    primary_read_actions = ('changes',)
+
+    def get_changes_queryset(self):
+        return self.queryset.all()
+
+    def get_changes_position(self, horizon):
+        """
+        `cursor` or `updated_since` query params -> (updated, id, deleted,
+        tombstone id) the page starts after, `updated` is None for a full
+        sync
+        """
+        params = self.request.query_params
+        cursor = params.get('cursor', None)
+        since = params.get('updated_since', None)
+        if cursor is not None:
+            position = decode_cursor(cursor)
+        elif since is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise exceptions.ValidationError(
+                    {'updated_since': ['expected an ISO 8601 datetime']})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, timezone.utc)
+            position = (since, 0, since, 0)
+        else:
+            # deletes before the first page are not in it anyway
+            return (None, 0, horizon, 0)
+        if position[2] < timezone.now() - timedelta(
+                days=settings.GEOAPI_TOMBSTONE_DAYS):
+            raise Gone()
+        return position
+
+    @list_route()
+    def changes(self, request):
+        """
+        Rows changed and ids deleted after `cursor` (or since
+        `updated_since`, or all rows), at most `GEOAPI_CHANGES_PAGE_SIZE`
+        of each. Request again with `next` while `more` is true; keep
+        `next` for the next sync.
+        """
+        horizon = timezone.now() - timedelta(
+            seconds=settings.GEOAPI_CHANGES_LAG)
+        updated, pk, deleted, tombstone = \
+            self.get_changes_position(horizon)
+        size = settings.GEOAPI_CHANGES_PAGE_SIZE
+
+        rows = self.get_changes_queryset().filter(updated__lte=horizon)
+        if updated is not None:
+            rows = after(rows, 'updated', updated, pk)
+        rows = list(rows.order_by('updated', 'id')[:size + 1])
+        tombstones = after(Tombstone.objects.filter(
+            kind=self.queryset.model._meta.model_name,
+            deleted__lte=horizon), 'deleted', deleted, tombstone)
+        tombstones = list(tombstones.order_by('deleted', 'id').values_list(
+            'deleted', 'id', 'object_id')[:size + 1])
+        more = len(rows) > size or len(tombstones) > size
+        rows, tombstones = rows[:size], tombstones[:size]
+        if rows:
+            updated, pk = rows[-1].updated, rows[-1].id
+        if tombstones:
+            deleted, tombstone = tombstones[-1][:2]
+
+        serializer = self.get_serializer(rows, many=True)
+        return Response(OrderedDict([
+            ('changed', serializer.data),
+            ('deleted', [x[2] for x in tombstones]),
+            ('next', encode_cursor((updated, pk, deleted, tombstone))),
+            ('more', more),
+        ]))
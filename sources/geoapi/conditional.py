@@ -0,0 +1,100 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .pagination import CursorPagination
+
+
+class ConditionalGetMixin(object):
+    """
+    `ETag` for `list` and `retrieve` (and `Last-Modified` for
+    `retrieve`), a matching `If-None-Match` or `If-Modified-Since` gets a
+    304 before the page is loaded or serialized.
+
+    The version of a list is the row count and the latest of
+    `version_fields` (`updated` of the rows and of the related rows the
+    representation includes) over the filtered queryset, taken by one
+    aggregate query whose count the paginator reuses. A retrieve takes
+    them from the loaded object. Deleting a row only changes the count,
+    which a date can not express, so lists have no `Last-Modified`.
+    Cursor pages are not versioned, they would pay for a COUNT(*) they
+    avoid otherwise.
+    """
+    version_fields = ('updated',)
+
+    def get_version_fields(self):
+        return self.version_fields
+
+    def get_version_queryset(self):
+        """ The filtered rows of `list`, without any projection """
+        return self.get_queryset()
+
+    def get_etag(self, count, updated):
+        key = '%s|%d|%s' % (
+            self.request.accepted_renderer.media_type, count,
+            '|'.join(x.isoformat() if x else '' for x in updated))
+        return 'W/"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def conditional_response(self, count, updated, last_modified=True):
+        """
+        -> (304/412 response or None, headers to set on the response),
+        `Last-Modified` only with `last_modified`
+        """
+        headers = {'ETag': self.get_etag(count, updated)}
+        dates = [x for x in updated if x is not None]
+        if not last_modified:
+            dates = []
+        last_modified = None
+        if dates:
+            last_modified = timegm(max(dates).utctimetuple())
+            headers['Last-Modified'] = http_date(last_modified)
+        response = get_conditional_response(
+            self.request, etag=headers['ETag'], last_modified=last_modified)
+        return response, headers
+
+    def versioned(self, response, headers):
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if isinstance(self.paginator, CursorPagination):
+            return super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs)
+        fields = self.get_version_fields()
+        stats = self.filter_queryset(self.get_version_queryset()) \
+            .order_by().aggregate(count=Count('pk'), **dict(
+                ('updated_%d' % i, Max(x)) for i, x in enumerate(fields)))
+        updated = [stats['updated_%d' % i] for i in range(len(fields))]
+        response, headers = self.conditional_response(
+            stats['count'], updated, last_modified=False)
+        if response is not None:
+            return self.versioned(response, headers)
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset.known_count = stats['count']
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response(serializer.data)
+        return self.versioned(response, headers)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        updated = []
+        for field in self.get_version_fields():
+            value = instance
+            for name in field.split('__'):
+                value = getattr(value, name)
+            updated.append(value)
+        response, headers = self.conditional_response(1, updated)
+        if response is None:
+            serializer = self.get_serializer(instance)
+            response = Response(serializer.data)
+        return self.versioned(response, headers)
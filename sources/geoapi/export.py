@@ -0,0 +1,41 @@
+from .renderers import RawJSONEncoder
+from .serializers import ServiceAreaSerializer
+
+CHUNK_SIZE = 64 * 1024
+COLLECTION_HEAD = '{"type":"FeatureCollection","features":['
+COLLECTION_TAIL = ']}\n'
+
+
+def iter_features(queryset, context=None):
+    """
+    Serialize `queryset` feature by feature. Rows are fetched through a
+    server-side cursor (`QuerySet.iterator()`), so memory stays flat.
+    """
+    serializer = ServiceAreaSerializer(context=context or {})
+    for instance in queryset.iterator():
+        yield serializer.to_representation(instance)
+
+
+def iter_geojson(queryset, ndjson=False, context=None):
+    """
+    Yield a GeoJSON FeatureCollection (or NDJSON, one feature per line)
+    as text chunks of about `CHUNK_SIZE` characters.
+    """
+    encoder = RawJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    buffer = [] if ndjson else [COLLECTION_HEAD]
+    size = 0
+    for i, feature in enumerate(iter_features(queryset, context)):
+        text = encoder.encode(feature)
+        if ndjson:
+            buffer.append(text + '\n')
+        else:
+            buffer.append(',' + text if i else text)
+        size += len(text) + 1
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if not ndjson:
+        buffer.append(COLLECTION_TAIL)
+    if buffer:
+        yield ''.join(buffer)
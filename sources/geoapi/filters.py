@@ -0,0 +1,33 @@
+from django_filters.constants import STRICTNESS
+from django_filters.rest_framework import FilterSet
+
+from .models import Provider, ServiceArea
+
+
+class ServiceAreaFilter(FilterSet):
+    """
+    `price__gte`/`price__lte` (the `MoneyField` amount), `price_currency`,
+    `name__startswith` and `updated__gte`/`updated__lte`. `provider_id` and
+    `poly__contains` are applied by `ServiceAreaViewSet` itself, the
+    lookup engines take them together.
+
+    Every filter has an index which the planner can combine with the
+    `poly` GiST index (see `ServiceArea.Meta.indexes`).
+    """
+
+    class Meta:
+        model = ServiceArea
+        fields = {
+            'price': ['gte', 'lte'],
+            'price_currency': ['exact'],
+            'name': ['startswith'],
+            'updated': ['gte', 'lte'],
+        }
+        strict = STRICTNESS.RAISE_VALIDATION_ERROR
+
+
+class ProviderFilter(FilterSet):
+    class Meta:
+        model = Provider
+        fields = ['language', 'currency']
+        strict = STRICTNESS.RAISE_VALIDATION_ERROR
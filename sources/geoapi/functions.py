@@ -0,0 +1,51 @@
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import GeoFunc
+from django.db.models import BooleanField, FloatField, Func
+
+
+class SimplifyPreserveTopology(GeoFunc):
+    function = 'ST_SimplifyPreserveTopology'
+    output_field_class = GeometryField
+    arity = 2
+
+
+class GeographyPointFunc(Func):
+    """
+    Function of a geometry column cast to geography and of a lon/lat
+    point, in the form the `poly::geography` GiST index (migration 0005)
+    is used for. `args` fill the `%s` placeholders of `template`
+    after the point.
+    """
+
+    def __init__(self, expression, point, *args, **extra):
+        self.point_args = tuple(point) + args
+        super(GeographyPointFunc, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super(GeographyPointFunc, self).as_sql(
+            compiler, connection, **extra_context)
+        return sql, list(params) + list(self.point_args)
+
+
+class GeographyDistance(GeographyPointFunc):
+    """
+    Distance in metres on the sphere (`<->`), ordering by it is a
+    nearest first index scan
+    """
+    template = '(%(expressions)s::geography <-> ' \
+        'ST_SetSRID(ST_MakePoint(%%s, %%s), 4326)::geography)'
+
+    def __init__(self, expression, point, **extra):
+        extra.setdefault('output_field', FloatField())
+        super(GeographyDistance, self).__init__(expression, point, **extra)
+
+
+class GeographyDWithin(GeographyPointFunc):
+    """ Within `distance` metres, an index condition """
+    template = 'ST_DWithin(%(expressions)s::geography, ' \
+        'ST_SetSRID(ST_MakePoint(%%s, %%s), 4326)::geography, %%s)'
+
+    def __init__(self, expression, point, distance, **extra):
+        extra.setdefault('output_field', BooleanField())
+        super(GeographyDWithin, self).__init__(
+            expression, point, distance, **extra)
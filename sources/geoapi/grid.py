@@ -0,0 +1,69 @@
+"""
+Fixed lon/lat grid for `AreaCell`.
+
+Level `n` cuts the world into 2^n columns and 2^n rows (cell size
+360 / 2^n by 180 / 2^n degrees, level 12 is about 10 x 5 km at the
+equator). A cell id is `n << 56 | row * (2^n + 1) + column`: ids of
+different levels never collide, so a table filled at an old
+`GEOAPI_GRID_LEVEL` can not give wrong matches, only none (run
+`manage.py build_area_cells` after changing it). Points on the east
+(180) or north (90) edge fall into an extra column/row. The grid ends
+there: points outside it are in no cell and the parts of areas outside
+it are not covered, a column past the edge would be the id of a cell in
+the next row.
+"""
+import math
+
+from django.conf import settings
+
+MAX_LEVEL = 27
+
+# `interior` when the cell (borders included) is inside the area, so
+# every point of it is `ST_Contains`ed without testing
+COVER_SQL = """
+INSERT INTO {cell} (area_id, cell, interior)
+SELECT a.id, %(base)s + g.y * %(columns)s + g.x,
+       ST_ContainsProperly(a.poly, g.envelope)
+FROM {area} a
+CROSS JOIN LATERAL (
+  SELECT x, y, ST_MakeEnvelope(
+      x * %(width)s - 180, y * %(height)s - 90,
+      (x + 1) * %(width)s - 180, (y + 1) * %(height)s - 90, 4326) AS envelope
+  FROM generate_series(
+         greatest(floor((a.xmin + 180) / %(width)s)::int, 0),
+         least(floor((a.xmax + 180) / %(width)s)::int, %(last)s)) x,
+       generate_series(
+         greatest(floor((a.ymin + 90) / %(height)s)::int, 0),
+         least(floor((a.ymax + 90) / %(height)s)::int, %(last)s)) y
+) g
+WHERE a.id = ANY(%(ids)s) AND ST_Intersects(a.poly, g.envelope)
+"""
+
+
+def grid_level():
+    level = settings.GEOAPI_GRID_LEVEL
+    if not 0 <= level <= MAX_LEVEL:
+        raise ValueError('GEOAPI_GRID_LEVEL must be in 0..%d' % MAX_LEVEL)
+    return level
+
+
+def grid_params(level=None):
+    """ `COVER_SQL` params of the grid (without `ids`) """
+    level = grid_level() if level is None else level
+    return {
+        'base': level << 56,
+        'columns': 2 ** level + 1,
+        'last': 2 ** level,
+        'width': 360.0 / 2 ** level,
+        'height': 180.0 / 2 ** level,
+    }
+
+
+def grid_cell(x, y, level=None):
+    """ Id of the cell (x, y) is in, None outside the grid """
+    if not (-180 <= x <= 180 and -90 <= y <= 90):
+        return None
+    params = grid_params(level)
+    return (params['base'] +
+            int(math.floor((y + 90) / params['height'])) * params['columns'] +
+            int(math.floor((x + 180) / params['width'])))
@@ -0,0 +1,183 @@
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.gis.gdal.error import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from djmoney.settings import CURRENCY_CHOICES
+
+from .bulk import save_service_areas
+from .models import Provider, ServiceArea
+
+FEATURES_RE = re.compile(r'"features"\s*:\s*\[')
+SEPARATOR_RE = re.compile(r'[\s,]*')
+READ_SIZE = 64 * 1024
+# characters a single feature (or the text before `features`) may take
+MAX_FEATURE_SIZE = 64 * 1024 * 1024
+CURRENCIES = frozenset(code for code, _ in CURRENCY_CHOICES)
+
+
+def iter_ndjson(fp):
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_feature_collection(fp, read_size=READ_SIZE,
+                            max_size=MAX_FEATURE_SIZE):
+    """
+    Yield the members of the `features` array of a GeoJSON
+    FeatureCollection without loading the whole document.
+
+    A feature which does not decode yet is decoded again only after as
+    much text again has been read, so a large feature costs linear time;
+    one longer than `max_size` characters (or malformed) is an error.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    match = None
+    while match is None:
+        if len(buffer) > max_size:
+            raise ValueError('no "features" array found')
+        chunk = fp.read(read_size)
+        if not chunk:
+            raise ValueError('no "features" array found')
+        # `"features" : [` may straddle two chunks
+        start = max(len(buffer) - 1024, 0)
+        buffer += chunk
+        match = FEATURES_RE.search(buffer, start)
+    buffer = buffer[match.end():]
+    pos = 0
+    while True:
+        pos = SEPARATOR_RE.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            feature, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            buffer = buffer[pos:]
+            pos = 0
+            if len(buffer) > max_size:
+                raise ValueError('feature longer than %d characters' %
+                                 max_size)
+            chunk = fp.read(max(len(buffer), read_size))
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield feature
+
+
+def parse_feature(feature, provider_id=None):
+    """
+    GeoJSON Feature -> dict of ServiceArea field values.
+    Raises ValueError with a readable message.
+    """
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        raise ValueError('not a GeoJSON Feature')
+    properties = feature.get('properties') or {}
+    if not isinstance(properties, dict):
+        raise ValueError('invalid properties')
+    name = properties.get('name')
+    if not isinstance(name, str) or not name or len(name) > 255:
+        raise ValueError('invalid name')
+    if provider_id is None:
+        provider_id = properties.get('provider_id')
+        if not isinstance(provider_id, int):
+            raise ValueError('invalid provider_id')
+    try:
+        poly = GEOSGeometry(json.dumps(feature.get('geometry')))
+    except (ValueError, TypeError, GEOSException, GDALException):
+        raise ValueError('invalid geometry')
+    if poly.geom_type != 'Polygon':
+        raise ValueError('invalid geometry: only Polygon type allowed')
+    # normalization makes it valid or rejects it (see `load`), as it
+    # does for the API
+    if not poly.valid and not settings.GEOAPI_NORMALIZE_POLYGONS:
+        raise ValueError('invalid geometry: %s' % poly.valid_reason)
+    if poly.srid is None:
+        poly.srid = 4326
+    try:
+        price = Decimal(str(properties.get('price')))
+    except InvalidOperation:
+        raise ValueError('invalid price')
+    if not price.is_finite() or abs(price) >= 10 ** 11 or \
+            price.as_tuple().exponent < -8:
+        raise ValueError('invalid price')
+    currency = properties.get('price_currency')
+    if currency is not None and (not isinstance(currency, str) or
+                                 currency not in CURRENCIES):
+        raise ValueError('invalid price_currency')
+    return {'provider_id': provider_id, 'name': name, 'poly': poly,
+            'price': price, 'price_currency': currency}
+
+
+class ServiceAreaImporter(object):
+    """
+    Validate features in batches and write them with `bulk_create`
+    (and `bulk_update` when `upsert` is set: an existing area of the same
+    provider with the same name is replaced).
+    """
+    fields = ('name', 'poly', 'price', 'price_currency')
+
+    def __init__(self, provider_id=None, upsert=False, batch_size=1000):
+        self.provider_id = provider_id
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def run(self, features, progress=None):
+        batch = []
+        for i, feature in enumerate(features):
+            try:
+                batch.append((i, parse_feature(feature, self.provider_id)))
+            except ValueError as e:
+                self.errors.append((i, str(e)))
+            if len(batch) >= self.batch_size:
+                self.load(batch)
+                batch = []
+                if progress:
+                    progress(self)
+        if batch:
+            self.load(batch)
+        if progress:
+            progress(self)
+
+    def load(self, batch):
+        currencies = dict(Provider.objects.filter(
+            id__in=set(x['provider_id'] for _, x in batch)
+        ).values_list('id', 'currency'))
+        existing = {}
+        if self.upsert:
+            rows = ServiceArea.objects.filter(
+                provider_id__in=currencies,
+                name__in=set(x['name'] for _, x in batch),
+            ).order_by('-id').values_list('provider_id', 'name', 'id')
+            existing = dict(((p, n), pk) for p, n, pk in rows)
+        areas = {}
+        for i, values in batch:
+            if values['provider_id'] not in currencies:
+                self.errors.append((i, 'unknown provider_id'))
+                continue
+            if values['price_currency'] is None:
+                values['price_currency'] = currencies[values['provider_id']]
+            key = (values['provider_id'], values['name'])
+            if not self.upsert:
+                key = i
+            areas[key] = (i, ServiceArea(id=existing.get(key), **values))
+        created = [(i, x) for i, x in areas.values() if x.id is None]
+        updated = [(i, x) for i, x in areas.values() if x.id is not None]
+        rejected = []
+        save_service_areas([x for _, x in created], [x for _, x in updated],
+                           self.fields, self.batch_size, rejected)
+        indexes = [i for i, _ in created + updated]
+        self.errors.extend((indexes[j], message) for j, message in rejected)
+        skip = set(j for j, _ in rejected)
+        kept = [j for j in range(len(indexes)) if j not in skip]
+        new = sum(1 for j in kept if j < len(created))
+        self.created += new
+        self.updated += len(kept) - new
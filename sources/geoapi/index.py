@@ -0,0 +1,385 @@
+"""
+In-process spatial index for ServiceArea point lookups.
+
+`STRTree` is a static Sort-Tile-Recursive packed R-tree over area envelopes,
+`polygon_contains` is an exact point-in-polygon test with ST_Contains
+semantics (points on the exterior ring or on a hole boundary are outside).
+`AreaIndex` keeps both in sync with the `ServiceArea` table.
+"""
+import math
+import threading
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ServiceArea, Tombstone
+
+# changes are read again this long before the last check (or the build
+# of a snapshot): a transaction commits after it has set `updated`
+SNAPSHOT_OVERLAP = timedelta(minutes=1)
+
+
+def ring_position(coords, start, end, x, y):
+    """
+    Locate (x, y) against a closed ring stored in `coords[start:end]`
+    as flat x, y pairs: 1 - inside, 0 - on the ring, -1 - outside.
+    """
+    inside = False
+    x1, y1 = coords[end - 2], coords[end - 1]
+    for i in range(start, end, 2):
+        x2, y2 = coords[i], coords[i + 1]
+        if ((x1 <= x <= x2 or x2 <= x <= x1) and
+                (y1 <= y <= y2 or y2 <= y <= y1) and
+                (x2 - x1) * (y - y1) == (y2 - y1) * (x - x1)):
+            return 0
+        if (y1 > y) != (y2 > y) and \
+                x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return 1 if inside else -1
+
+
+def polygon_contains(coords, rings, x, y):
+    """
+    `rings` is a sequence of (start, end) offsets into `coords`,
+    the exterior ring goes first and holes follow it.
+    """
+    start, end = rings[0]
+    if ring_position(coords, start, end, x, y) <= 0:
+        return False
+    for start, end in rings[1:]:
+        if ring_position(coords, start, end, x, y) >= 0:
+            return False
+    return True
+
+
+def flatten_polygon(poly):
+    """ GEOS Polygon -> (coords, rings, envelope) """
+    coords = array('d')
+    rings = []
+    for ring in poly.coords:
+        start = len(coords)
+        for x, y in ring:
+            coords.append(x)
+            coords.append(y)
+        rings.append((start, len(coords)))
+    return coords, tuple(rings), poly.extent
+
+
+def str_order(boxes, node_capacity):
+    """
+    Sort-Tile-Recursive ordering of `boxes`: sort by center x, cut into
+    vertical slices and sort each slice by center y.
+    """
+    count = len(boxes)
+    if not count:
+        return []
+    leaves = int(math.ceil(count / float(node_capacity)))
+    slices = int(math.ceil(math.sqrt(leaves)))
+    slice_size = slices * node_capacity
+
+    def center_x(i):
+        return boxes[i][0] + boxes[i][2]
+
+    def center_y(i):
+        return boxes[i][1] + boxes[i][3]
+
+    by_x = sorted(range(count), key=center_x)
+    order = []
+    for start in range(0, count, slice_size):
+        order.extend(sorted(by_x[start:start + slice_size], key=center_y))
+    return order
+
+
+class STRTree(object):
+    """
+    Packed R-tree. Every level is a flat array of boxes
+    (minx, miny, maxx, maxy); node `i` of level `n` covers nodes
+    `[i * node_capacity, (i + 1) * node_capacity)` of level `n - 1`.
+    Level 0 holds the item boxes in STR order, `order` maps them back
+    to the positions of the original `boxes` sequence.
+    """
+
+    def __init__(self, boxes, node_capacity=16):
+        self.node_capacity = node_capacity
+        self.order = array('l', str_order(boxes, node_capacity))
+        level = array('d')
+        for i in self.order:
+            level.extend(boxes[i])
+        self.levels = [level]
+        while len(level) > 4 * node_capacity:
+            level = self._pack_level(level)
+            self.levels.append(level)
+
+    @classmethod
+    def from_levels(cls, levels, order, node_capacity):
+        tree = cls.__new__(cls)
+        tree.node_capacity = node_capacity
+        tree.levels = levels
+        tree.order = order
+        return tree
+
+    def _pack_level(self, boxes):
+        step = 4 * self.node_capacity
+        parent = array('d')
+        for start in range(0, len(boxes), step):
+            end = min(start + step, len(boxes))
+            parent.append(min(boxes[start:end:4]))
+            parent.append(min(boxes[start + 1:end:4]))
+            parent.append(max(boxes[start + 2:end:4]))
+            parent.append(max(boxes[start + 3:end:4]))
+        return parent
+
+    def __len__(self):
+        return len(self.order)
+
+    def query(self, x, y):
+        """ Yield positions of the boxes which contain (x, y) """
+        levels = self.levels
+        capacity = self.node_capacity
+        top = len(levels) - 1
+        stack = [(top, 0, len(levels[top]) // 4)]
+        while stack:
+            level, start, end = stack.pop()
+            boxes = levels[level]
+            for i in range(start, end):
+                j = 4 * i
+                if boxes[j] <= x <= boxes[j + 2] and \
+                        boxes[j + 1] <= y <= boxes[j + 3]:
+                    if level:
+                        size = len(levels[level - 1]) // 4
+                        stack.append((level - 1, i * capacity,
+                                      min((i + 1) * capacity, size)))
+                    else:
+                        yield self.order[i]
+
+
+class IndexedArea(object):
+    __slots__ = ('id', 'provider_id', 'coords', 'rings', 'extent')
+
+    def __init__(self, id, provider_id, poly):
+        self.id = id
+        self.provider_id = provider_id
+        self.coords, self.rings, self.extent = flatten_polygon(poly)
+
+    @classmethod
+    def from_flat(cls, id, provider_id, coords, rings, extent):
+        area = cls.__new__(cls)
+        area.id = id
+        area.provider_id = provider_id
+        area.coords = coords
+        area.rings = rings
+        area.extent = extent
+        return area
+
+    def contains(self, x, y):
+        minx, miny, maxx, maxy = self.extent
+        return (minx <= x <= maxx and miny <= y <= maxy and
+                polygon_contains(self.coords, self.rings, x, y))
+
+
+class AreaIndex(object):
+    """
+    Per-process ServiceArea index.
+
+    The packed tree is immutable: saved areas go to a small `pending` list
+    and replaced/deleted ones are masked until `GEOAPI_INDEX_REPACK_SIZE`
+    changes pile up and the tree is repacked. Writes made by other
+    processes are picked up every `GEOAPI_INDEX_CHECK_INTERVAL` seconds:
+    the areas saved and the `Tombstone`s recorded since the last check
+    (less `SNAPSHOT_OVERLAP`) are applied, both from their `updated` /
+    `deleted` indexes, so a check costs the number of changes. A change
+    committed more than `SNAPSHOT_OVERLAP` after it set its timestamp
+    is missed until the next full load.
+
+    When there is a `GEOAPI_INDEX_SNAPSHOT` (see geoapi/snapshot.py) its
+    memory-mapped tree is used instead of building one, the changes
+    since it was built are applied the same way and kept pending
+    (without repacking) until the snapshot is rebuilt. A new snapshot
+    file is picked up on the next check. A worker (or snapshot) older
+    than the tombstones (`GEOAPI_TOMBSTONE_DAYS`) loads the whole table.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._areas = {}
+            self._tree = None
+            self._tree_areas = []
+            self._pending = {}
+            self._masked = set()
+            self._snapshot = None
+            self._since = None
+            self._checked_at = None
+
+    @property
+    def loaded(self):
+        return self._tree is not None
+
+    def _tombstones_cover(self, since):
+        """ Whether every delete after `since` still has its tombstone """
+        return since > timezone.now() - timedelta(
+            days=settings.GEOAPI_TOMBSTONE_DAYS) + SNAPSHOT_OVERLAP
+
+    def load(self):
+        with self._lock:
+            snapshot = self._open_snapshot()
+            if snapshot is None or not self._load_snapshot(snapshot):
+                self._load_database()
+            self._checked_at = time.time()
+
+    def _open_snapshot(self):
+        from .snapshot import open_snapshot
+        path = settings.GEOAPI_INDEX_SNAPSHOT
+        return open_snapshot(path) if path else None
+
+    def _snapshot_replaced(self):
+        from .snapshot import snapshot_file_id
+        path = settings.GEOAPI_INDEX_SNAPSHOT
+        if not path:
+            return False
+        loaded = self._snapshot.file_id if self._snapshot else None
+        return snapshot_file_id(path) != loaded
+
+    def _load_database(self):
+        self._since = timezone.now()
+        qs = ServiceArea.objects.values_list('id', 'provider_id', 'poly')
+        areas = {}
+        for pk, provider_id, poly in qs.iterator():
+            areas[pk] = IndexedArea(pk, provider_id, poly)
+        self._areas = areas
+        self._snapshot = None
+        self._pack()
+
+    def _load_snapshot(self, snapshot):
+        """
+        Use the tree of `snapshot` plus the changes since it was built.
+        False when the tombstones of that time are purged already.
+        """
+        if snapshot.updated is not None and \
+                not self._tombstones_cover(snapshot.updated):
+            return False
+        self._snapshot = snapshot
+        self._tree = snapshot.tree
+        self._tree_areas = snapshot
+        self._areas = {}
+        self._pending = {}
+        self._masked = set()
+        self._since = snapshot.updated
+        self._apply_changes()
+        return True
+
+    def _apply_changes(self):
+        """ Apply the saves and deletes since `_since` (all without) """
+        now = timezone.now()
+        areas = ServiceArea.objects.values_list('id', 'provider_id', 'poly')
+        deleted = Tombstone.objects.filter(
+            kind=ServiceArea._meta.model_name).values_list(
+            'object_id', flat=True)
+        if self._since is not None:
+            start = self._since - SNAPSHOT_OVERLAP
+            areas = areas.filter(updated__gte=start)
+            deleted = deleted.filter(deleted__gte=start)
+        # an id deleted and saved again is in the table
+        for pk in deleted:
+            self._drop(pk)
+        for pk, provider_id, poly in areas.iterator():
+            self._put(IndexedArea(pk, provider_id, poly))
+        self._since = now
+        self._changed()
+
+    def _pack(self):
+        self._tree_areas = list(self._areas.values())
+        self._tree = STRTree(
+            [x.extent for x in self._tree_areas],
+            settings.GEOAPI_INDEX_NODE_CAPACITY)
+        self._pending = {}
+        self._masked = set()
+
+    def _ensure_fresh(self):
+        if self._tree is None:
+            self.load()
+            return
+        now = time.time()
+        if now - self._checked_at < settings.GEOAPI_INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._snapshot_replaced() or \
+                not self._tombstones_cover(self._since):
+            self.load()
+        else:
+            self._apply_changes()
+
+    def _changed(self):
+        changes = len(self._pending) + len(self._masked)
+        if self._snapshot is None and \
+                changes >= settings.GEOAPI_INDEX_REPACK_SIZE:
+            self._pack()
+
+    def _put(self, indexed):
+        pk = indexed.id
+        if pk in self._areas or self._snapshot is not None:
+            self._masked.add(pk)
+        self._areas[pk] = indexed
+        self._pending[pk] = indexed
+
+    def _drop(self, pk):
+        if pk not in self._areas and self._snapshot is None:
+            return
+        self._areas.pop(pk, None)
+        self._pending.pop(pk, None)
+        self._masked.add(pk)
+
+    def update(self, area):
+        """ Add or replace `area` (a ServiceArea instance) """
+        with self._lock:
+            if self._tree is None:
+                return
+            self._put(IndexedArea(area.pk, area.provider_id, area.poly))
+            self._changed()
+
+    def remove(self, pk):
+        with self._lock:
+            if self._tree is None:
+                return
+            self._drop(pk)
+            self._changed()
+
+    def query(self, x, y, provider_id=None):
+        """ Return a sorted list of ids of the areas containing (x, y) """
+        with self._lock:
+            self._ensure_fresh()
+            candidates = [
+                area for area in map(self._tree_areas.__getitem__,
+                                     self._tree.query(x, y))
+                if area.id not in self._masked]
+            candidates.extend(self._pending.values())
+        return sorted(
+            area.id for area in candidates
+            if (provider_id is None or area.provider_id == provider_id) and
+            area.contains(x, y))
+
+    def describe(self, ids):
+        """
+        id -> (id, provider_id, name, price, price_currency) for those of
+        `ids` the loaded snapshot has up to date
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return {}
+            described = {}
+            for pk in ids:
+                i = snapshot.position(pk)
+                if i is not None and pk not in self._masked:
+                    described[pk] = snapshot.describe(i)
+            return described
+
+
+area_index = AreaIndex()
@@ -0,0 +1,275 @@
+import json
+import math
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from rest_framework import exceptions
+
+from .cache import lookup_cache
+from .grid import grid_cell
+from .index import area_index
+from .models import AreaCell, Provider, ServiceArea, ServiceAreaPiece
+
+
+def parse_provider_id(value):
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise exceptions.ValidationError('invalid provider_id')
+    return int(value)
+
+
+def parse_fields(value, allowed):
+    """ Comma separated field names -> set, `None` when not given """
+    if value is None:
+        return None
+    fields = set(x.strip() for x in value.split(',') if x.strip())
+    unknown = fields - set(allowed)
+    if unknown:
+        raise exceptions.ValidationError(
+            'invalid fields: %s' % ', '.join(sorted(unknown)))
+    return fields
+
+
+def parse_choice(value, name, choices):
+    if value is None:
+        return choices[0]
+    if value not in choices:
+        raise exceptions.ValidationError(
+            'invalid %s: expected one of %s' % (name, ', '.join(choices)))
+    return value
+
+
+def parse_number(value, name, cast=float, minimum=None, maximum=None):
+    if value is None:
+        return None
+    try:
+        number = cast(value)
+        if not math.isfinite(number):
+            raise ValueError('must be a finite number')
+        if minimum is not None and number < minimum:
+            raise ValueError('must be >= %s' % minimum)
+        if maximum is not None and number > maximum:
+            raise ValueError('must be <= %s' % maximum)
+    except ValueError as e:
+        raise exceptions.ValidationError('invalid %s: %s' % (name, e))
+    return number
+
+
+def geojson_point(data):
+    """ Decoded GeoJSON Point -> (x, y) """
+    data_coordinates = [float(x) for x in data['coordinates']]
+    data_type = data['type']
+    if data_type != "Point":
+        raise ValueError('invalid type! only Point type allowed')
+    if len(data_coordinates) != 2:
+        raise ValueError('wrong coordinates length')
+    if not all(math.isfinite(x) for x in data_coordinates):
+        raise ValueError('coordinates must be finite numbers')
+    return tuple(data_coordinates)
+
+
+def parse_point(value, name='poly__contains'):
+    """ GeoJSON Point string -> (x, y) """
+    if value is None:
+        return None
+    try:
+        return geojson_point(json.loads(value))
+    except (ValueError, KeyError, TypeError) as e:
+        raise exceptions.ValidationError('invalid %s: %s' % (name, e))
+
+
+def parse_points(items, name='points'):
+    """ List of decoded GeoJSON Points -> [(x, y), ...] """
+    if not isinstance(items, list):
+        raise exceptions.ValidationError(
+            'invalid %s: expected a list of GeoJSON Points' % name)
+    limit = settings.GEOAPI_BATCH_LOOKUP_MAX_POINTS
+    if len(items) > limit:
+        raise exceptions.ValidationError(
+            'invalid %s: too many points (max %d)' % (name, limit))
+    points = []
+    for i, item in enumerate(items):
+        try:
+            points.append(geojson_point(item))
+        except (ValueError, KeyError, TypeError) as e:
+            raise exceptions.ValidationError(
+                'invalid %s[%d]: %s' % (name, i, e))
+    return points
+
+
+def parse_lnglat(value, name):
+    """ `lng,lat` -> (x, y) """
+    if value is None:
+        return None
+    try:
+        x, y = (float(v) for v in value.split(','))
+        if not (-180 <= x <= 180 and -90 <= y <= 90):
+            raise ValueError('out of range')
+    except ValueError as e:
+        raise exceptions.ValidationError(
+            'invalid %s: expected lng,lat (%s)' % (name, e))
+    return x, y
+
+
+def point_wkt(point):
+    return 'POINT(%s)' % ' '.join(map(str, point))
+
+
+def pieces_containing(point):
+    """
+    Pieces of the areas which contain `point`. A point on a cut between
+    two pieces is inside neither of them, so when a piece only touches
+    it the parent polygon decides.
+    """
+    wkt = point_wkt(point)
+    return ServiceAreaPiece.objects.filter(poly__intersects=wkt).filter(
+        Q(poly__contains=wkt) | Q(area__poly__contains=wkt))
+
+
+def cells_containing(point):
+    """
+    Cells of the areas which contain `point`: an area covering the whole
+    cell of the point contains it, the others are tested. None outside
+    the grid.
+    """
+    cell = grid_cell(*point)
+    if cell is None:
+        return AreaCell.objects.none()
+    return AreaCell.objects.filter(cell=cell).filter(
+        Q(interior=True) | Q(area__poly__contains=point_wkt(point)))
+
+
+def contains_ids(point, provider_id=None, using=None):
+    """
+    Sorted ids of the areas which contain `point`, read from the `using`
+    database (the routed one by default)
+    """
+    if settings.GEOAPI_LOOKUP_ENGINE == 'index':
+        x, y = point
+        return area_index.query(x, y, provider_id)
+    queryset = filter_contains(ServiceArea.objects.using(using), point,
+                               provider_id, cache=False)
+    if provider_id is not None:
+        queryset = queryset.filter(provider_id=provider_id)
+    return list(queryset.values_list('id', flat=True))
+
+
+def filter_contains(queryset, point, provider_id=None, cache=True):
+    """
+    Restrict `queryset` to the areas which contain `point`
+    using the configured `GEOAPI_LOOKUP_ENGINE`.
+    """
+    if cache and settings.GEOAPI_LOOKUP_CACHE:
+        ids = lookup_cache.get_or_set(
+            point, provider_id,
+            lambda: contains_ids(point, provider_id, using='default'))
+        return queryset.filter(id__in=ids)
+    engine = settings.GEOAPI_LOOKUP_ENGINE
+    if engine == 'sql':
+        return queryset.filter(poly__contains=point_wkt(point))
+    if engine == 'index':
+        x, y = point
+        return queryset.filter(id__in=area_index.query(x, y, provider_id))
+    if engine == 'subdivided':
+        return queryset.filter(id__in=pieces_containing(point).values('area'))
+    if engine == 'grid':
+        return queryset.filter(id__in=cells_containing(point).values('area'))
+    raise ValueError('unknown GEOAPI_LOOKUP_ENGINE: %r' % engine)
+
+
+GRID_BATCH_LOOKUP_SQL = """
+SELECT p.idx, a.id, a.name, pr.name, a.price, a.price_currency
+FROM unnest(%s::float8[], %s::float8[], %s::bigint[])
+  WITH ORDINALITY AS p(x, y, cell, idx)
+JOIN {cell} c ON c.cell = p.cell
+JOIN {area} a ON a.id = c.area_id
+ AND (c.interior OR
+      ST_Contains(a.poly, ST_SetSRID(ST_MakePoint(p.x, p.y), 4326)))
+JOIN {provider} pr ON pr.id = a.provider_id
+{where}
+ORDER BY p.idx, a.id
+"""
+
+SUBDIVIDED_BATCH_LOOKUP_SQL = """
+SELECT DISTINCT p.idx, a.id, a.name, pr.name, a.price, a.price_currency
+FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(x, y, idx)
+CROSS JOIN LATERAL
+  (SELECT ST_SetSRID(ST_MakePoint(p.x, p.y), 4326) AS point) g
+JOIN {piece} s ON ST_Intersects(s.poly, g.point)
+JOIN {area} a ON a.id = s.area_id
+ AND (ST_Contains(s.poly, g.point) OR ST_Contains(a.poly, g.point))
+JOIN {provider} pr ON pr.id = a.provider_id
+{where}
+ORDER BY p.idx, a.id
+"""
+
+BATCH_LOOKUP_SQL = """
+SELECT p.idx, a.id, a.name, pr.name, a.price, a.price_currency
+FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(x, y, idx)
+JOIN {area} a
+  ON ST_Contains(a.poly, ST_SetSRID(ST_MakePoint(p.x, p.y), 4326))
+JOIN {provider} pr ON pr.id = a.provider_id
+{where}
+ORDER BY p.idx, a.id
+"""
+
+
+def batch_lookup(points, provider_id=None):
+    """
+    Resolve many points at once. Returns a list of area lists (one per
+    point, in order), every area is a dict with id, name, provider name
+    and price.
+    """
+    results = [[] for _ in points]
+    if not points:
+        return results
+    if settings.GEOAPI_LOOKUP_ENGINE == 'index':
+        matches = [(i, pk) for i, (x, y) in enumerate(points)
+                   for pk in area_index.query(x, y, provider_id)]
+        ids = set(pk for _, pk in matches)
+        # names and prices come from the index snapshot when it has them
+        areas = area_index.describe(ids)
+        areas.update((row[0], row) for row in ServiceArea.objects.filter(
+            id__in=ids - set(areas)
+        ).values_list('id', 'provider_id', 'name', 'price', 'price_currency'))
+        providers = dict(Provider.objects.filter(
+            id__in=set(x[1] for x in areas.values())
+        ).values_list('id', 'name'))
+        rows = []
+        for i, pk in matches:
+            if pk in areas:
+                _, provider_pk, name, price, currency = areas[pk]
+                rows.append((i + 1, pk, name, providers[provider_pk], price,
+                             currency))
+    else:
+        params = [[x for x, _ in points], [y for _, y in points]]
+        sql = BATCH_LOOKUP_SQL
+        if settings.GEOAPI_LOOKUP_ENGINE == 'subdivided':
+            sql = SUBDIVIDED_BATCH_LOOKUP_SQL
+        if settings.GEOAPI_LOOKUP_ENGINE == 'grid':
+            sql = GRID_BATCH_LOOKUP_SQL
+            params.append([grid_cell(x, y) for x, y in points])
+        where = ''
+        if provider_id is not None:
+            where = 'WHERE a.provider_id = %s'
+            params.append(provider_id)
+        sql = sql.format(
+            area=ServiceArea._meta.db_table,
+            piece=ServiceAreaPiece._meta.db_table,
+            cell=AreaCell._meta.db_table,
+            provider=Provider._meta.db_table, where=where)
+        connection = connections[router.db_for_read(ServiceArea)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    for idx, pk, name, provider_name, price, currency in rows:
+        results[idx - 1].append({
+            'id': pk,
+            'name': name,
+            'provider': provider_name,
+            'price': str(price),
+            'price_currency': currency,
+        })
+    return results
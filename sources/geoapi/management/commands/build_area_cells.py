@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from geoapi.grid import grid_level
+from geoapi.models import AreaCell, ServiceArea
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the grid cells of all service areas ' \
+           '(before switching to GEOAPI_LOOKUP_ENGINE=grid or after ' \
+           'GEOAPI_GRID_LEVEL has changed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(ServiceArea.objects.values_list('id', flat=True))
+        AreaCell.objects.exclude(area_id__in=ids).delete()
+        for start in range(0, len(ids), batch_size):
+            AreaCell.objects.rebuild(ids[start:start + batch_size])
+            self.stdout.write('%d/%d areas' % (
+                min(start + batch_size, len(ids)), len(ids)))
+        self.stdout.write('level %d: %d cells, %d interior' % (
+            grid_level(), AreaCell.objects.count(),
+            AreaCell.objects.filter(interior=True).count()))
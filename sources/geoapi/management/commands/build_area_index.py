@@ -0,0 +1,23 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geoapi.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Compile all service areas into the memory-mapped index snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output', default=settings.GEOAPI_INDEX_SNAPSHOT,
+            help='snapshot path (default: GEOAPI_INDEX_SNAPSHOT)')
+
+    def handle(self, *args, **options):
+        path = options['output']
+        if not path:
+            raise CommandError('GEOAPI_INDEX_SNAPSHOT is not set, use -o')
+        count = write_snapshot(path)
+        self.stdout.write('%d areas, %d bytes written to %s' % (
+            count, os.path.getsize(path), path))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from geoapi.models import ServiceArea, ServiceAreaPiece
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the ST_Subdivide pieces of all service areas ' \
+           '(before switching to GEOAPI_LOOKUP_ENGINE=subdivided or ' \
+           'after GEOAPI_SUBDIVIDE_MAX_VERTICES has changed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(ServiceArea.objects.values_list('id', flat=True))
+        ServiceAreaPiece.objects.exclude(area_id__in=ids).delete()
+        for start in range(0, len(ids), batch_size):
+            ServiceAreaPiece.objects.rebuild(ids[start:start + batch_size])
+            self.stdout.write('%d/%d areas' % (
+                min(start + batch_size, len(ids)), len(ids)))
+        self.stdout.write('%d pieces' % ServiceAreaPiece.objects.count())
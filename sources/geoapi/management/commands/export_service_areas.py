@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from geoapi.export import iter_geojson
+from geoapi.models import ServiceArea
+
+
+class Command(BaseCommand):
+    help = 'Export service areas as a GeoJSON FeatureCollection or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ndjson', action='store_true',
+                            help='write one GeoJSON Feature per line')
+        parser.add_argument('--provider-id', type=int,
+                            help='export only areas of this provider')
+        parser.add_argument('-o', '--output',
+                            help='output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        queryset = ServiceArea.objects.select_related('provider')
+        if options['provider_id'] is not None:
+            queryset = queryset.filter(provider_id=options['provider_id'])
+        chunks = iter_geojson(queryset, ndjson=options['ndjson'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
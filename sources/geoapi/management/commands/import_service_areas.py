@@ -0,0 +1,56 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geoapi.importer import (
+    ServiceAreaImporter, iter_feature_collection, iter_ndjson)
+
+
+class Command(BaseCommand):
+    help = 'Import service areas from a GeoJSON FeatureCollection or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='input file, `-` for stdin')
+        parser.add_argument('--ndjson', action='store_true',
+                            help='one GeoJSON Feature per line '
+                                 '(default for *.ndjson and *.jsonl)')
+        parser.add_argument('--provider-id', type=int,
+                            help='import every feature for this provider '
+                                 'instead of properties.provider_id')
+        parser.add_argument('--upsert', action='store_true',
+                            help='replace areas with the same name '
+                                 'of the same provider')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        ndjson = options['ndjson'] or path.endswith(('.ndjson', '.jsonl'))
+        importer = ServiceAreaImporter(
+            provider_id=options['provider_id'], upsert=options['upsert'],
+            batch_size=options['batch_size'])
+        started = time.time()
+
+        def progress(importer):
+            done = importer.created + importer.updated
+            self.stdout.write(
+                '%d rows (created %d, updated %d, errors %d) %.0f rows/sec' % (
+                    done, importer.created, importer.updated,
+                    len(importer.errors),
+                    done / max(time.time() - started, 1e-6)))
+
+        fp = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            features = iter_ndjson(fp) if ndjson \
+                else iter_feature_collection(fp)
+            importer.run(features, progress)
+        except ValueError as e:
+            raise CommandError('can not read %s: %s' % (path, e))
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+        for i, error in importer.errors[:20]:
+            self.stderr.write('feature #%d: %s' % (i, error))
+        if len(importer.errors) > 20:
+            self.stderr.write('... %d more errors' % (
+                len(importer.errors) - 20))
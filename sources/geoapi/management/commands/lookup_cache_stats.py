@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from geoapi.cache import lookup_cache
+
+
+class Command(BaseCommand):
+    help = 'Show poly__contains lookup cache hit/miss counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = lookup_cache.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0.0
+        self.stdout.write('hits: %(hits)d misses: %(misses)d' % stats)
+        self.stdout.write('hit ratio: %.2f%%' % (ratio * 100))
+        if options['reset']:
+            lookup_cache.reset_stats()
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+
+from geoapi.bulk import save_service_areas
+from geoapi.models import ServiceArea
+
+
+class Command(BaseCommand):
+    help = 'Normalize the polygons of all service areas (see ' \
+           'GEOAPI_NORMALIZE_POLYGONS and GEOAPI_MAX_VERTICES) and ' \
+           'report their size per provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(ServiceArea.objects.values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            areas = list(ServiceArea.objects.filter(
+                id__in=ids[start:start + batch_size]))
+            rejected = []
+            save_service_areas([], areas, ['poly'], batch_size, rejected)
+            for index, message in rejected:
+                self.stderr.write('area %d: %s' % (areas[index].id, message))
+            self.stdout.write('%d/%d areas' % (
+                min(start + batch_size, len(ids)), len(ids)))
+        rows = ServiceArea.objects.order_by('provider_id') \
+            .values_list('provider_id').annotate(
+                Count('id'), Sum('vertex_count'), Max('vertex_count'),
+                Sum('area_m2'))
+        self.stdout.write('provider\tareas\tvertices\tmax\tkm2')
+        for provider_id, areas, vertices, largest, area in rows:
+            self.stdout.write('%d\t%d\t%d\t%d\t%.1f' % (
+                provider_id, areas, vertices, largest, area / 1e6))
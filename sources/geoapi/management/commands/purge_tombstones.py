@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from geoapi.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete the tombstones older than GEOAPI_TOMBSTONE_DAYS, ' \
+           'change feed cursors older than that get a 410 anyway'
+
+    def handle(self, *args, **options):
+        deleted = Tombstone.objects.filter(deleted__lt=timezone.now() - (
+            timedelta(days=settings.GEOAPI_TOMBSTONE_DAYS))).delete()[0]
+        self.stdout.write('%d tombstones deleted' % deleted)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicearea',
+            name='xmin',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='ymin',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='xmax',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='ymax',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            'UPDATE geoapi_servicearea SET '
+            'xmin = ST_XMin(poly), ymin = ST_YMin(poly), '
+            'xmax = ST_XMax(poly), ymax = ST_YMax(poly)',
+            migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='servicearea',
+            name='xmin',
+            field=models.FloatField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='servicearea',
+            name='ymin',
+            field=models.FloatField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='servicearea',
+            name='xmax',
+            field=models.FloatField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='servicearea',
+            name='ymax',
+            field=models.FloatField(editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# GEOAPI_SUBDIVIDE_MAX_VERTICES when this migration was written
+MAX_VERTICES = 256
+
+
+def subdivide_areas(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO geoapi_serviceareapiece (area_id, poly) '
+            'SELECT id, ST_Subdivide(poly, %s) FROM geoapi_servicearea',
+            [MAX_VERTICES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0002_servicearea_bbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceAreaPiece',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('poly', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pieces', to='geoapi.ServiceArea')),
+            ],
+        ),
+        migrations.RunPython(subdivide_areas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# geoapi.grid.COVER_SQL at level 12 (the GEOAPI_GRID_LEVEL default)
+# when this migration was written
+LEVEL = 12
+COVER_SQL = """
+INSERT INTO geoapi_areacell (area_id, cell, interior)
+SELECT a.id, %(base)s + g.y * %(columns)s + g.x,
+       ST_ContainsProperly(a.poly, g.envelope)
+FROM geoapi_servicearea a
+CROSS JOIN LATERAL (
+  SELECT x, y, ST_MakeEnvelope(
+      x * %(width)s - 180, y * %(height)s - 90,
+      (x + 1) * %(width)s - 180, (y + 1) * %(height)s - 90, 4326) AS envelope
+  FROM generate_series(
+         greatest(floor((a.xmin + 180) / %(width)s)::int, 0),
+         least(floor((a.xmax + 180) / %(width)s)::int, %(last)s)) x,
+       generate_series(
+         greatest(floor((a.ymin + 90) / %(height)s)::int, 0),
+         least(floor((a.ymax + 90) / %(height)s)::int, %(last)s)) y
+) g
+WHERE ST_Intersects(a.poly, g.envelope)
+"""
+
+
+def cover_areas(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(COVER_SQL, {
+            'base': LEVEL << 56,
+            'columns': 2 ** LEVEL + 1,
+            'last': 2 ** LEVEL,
+            'width': 360.0 / 2 ** LEVEL,
+            'height': 180.0 / 2 ** LEVEL,
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0003_serviceareapiece'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AreaCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.BigIntegerField()),
+                ('interior', models.BooleanField()),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='geoapi.ServiceArea')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='areacell',
+            index=models.Index(fields=['cell', 'interior'],
+                               name='geoapi_areacell_cell_idx'),
+        ),
+        migrations.RunPython(cover_areas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0004_areacell'),
+    ]
+
+    operations = [
+        # `near=` (see geoapi/functions.py): KNN ordering and ST_DWithin on
+        # the geography, which a GeometryField can not declare
+        migrations.RunSQL(
+            'CREATE INDEX geoapi_area_poly_geog_idx ON geoapi_servicearea '
+            'USING GIST ((poly::geography))',
+            'DROP INDEX geoapi_area_poly_geog_idx'),
+    ]
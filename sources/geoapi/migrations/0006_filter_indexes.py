@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0005_servicearea_poly_geography_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='servicearea',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='servicearea',
+            index=models.Index(fields=['price'],
+                               name='geoapi_area_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicearea',
+            index=models.Index(fields=['price_currency', 'price'],
+                               name='geoapi_area_currency_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicearea',
+            index=models.Index(fields=['updated'],
+                               name='geoapi_area_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['language'],
+                               name='geoapi_provider_language_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['currency'],
+                               name='geoapi_provider_currency_idx'),
+        ),
+        # `provider_id` + `poly__contains` in one GiST index scan
+        BtreeGistExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX geoapi_area_provider_poly_idx ON geoapi_servicearea '
+            'USING GIST (provider_id, poly)',
+            'DROP INDEX geoapi_area_provider_poly_idx'),
+    ]
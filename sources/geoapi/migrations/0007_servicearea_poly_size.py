@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0006_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicearea',
+            name='vertex_count',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicearea',
+            name='area_m2',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        # existing polygons are only measured, `manage.py
+        # normalize_service_areas` normalizes them
+        migrations.RunSQL(
+            'UPDATE geoapi_servicearea SET '
+            'vertex_count = ST_NPoints(poly), '
+            'area_m2 = ST_Area(poly::geography)',
+            migrations.RunSQL.noop),
+    ]
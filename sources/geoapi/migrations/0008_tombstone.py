@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoapi', '0007_servicearea_poly_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['kind', 'deleted', 'id'],
+                               name='geoapi_tombstone_feed_idx'),
+        ),
+        # (updated, id) serves `updated__gte` as well
+        migrations.RemoveIndex(
+            model_name='servicearea',
+            name='geoapi_area_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='servicearea',
+            index=models.Index(fields=['updated', 'id'],
+                               name='geoapi_area_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['updated', 'id'],
+                               name='geoapi_provider_changes_idx'),
+        ),
+    ]
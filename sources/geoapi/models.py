@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.db import connection
 from djmoney.models.fields import MoneyField, CurrencyField
 from phonenumber_field.modelfields import PhoneNumberField
 
 from utils.fields import LanguageField
 from utils.models import Dated
+from .grid import COVER_SQL, grid_params
+from .normalize import normalize_polygons
 
 
 class Provider(Dated):
@@ -18,16 +22,205 @@ class Provider(Dated):
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['language'],
+                         name='geoapi_provider_language_idx'),
+            models.Index(fields=['currency'],
+                         name='geoapi_provider_currency_idx'),
+            # the change feed, see geoapi/changes.py
+            models.Index(fields=['updated', 'id'],
+                         name='geoapi_provider_changes_idx'),
+        ]
 
 
 class ServiceArea(Dated):
     provider = models.ForeignKey(Provider)
-    name = models.CharField(max_length=255)
+    # `db_index` adds the `varchar_pattern_ops` index `name__startswith`
+    # needs
+    name = models.CharField(max_length=255, db_index=True)
     poly = models.PolygonField()
     price = MoneyField(max_digits=19, decimal_places=8)
+    # `poly` envelope for the `bbox` of responses and for tile
+    # invalidation, kept in sync by `save` and `set_bbox`
+    xmin = models.FloatField(editable=False)
+    ymin = models.FloatField(editable=False)
+    xmax = models.FloatField(editable=False)
+    ymax = models.FloatField(editable=False)
+    # `poly` points and square metres, kept in sync by `save` and
+    # `prepare_polys`
+    vertex_count = models.IntegerField(null=True, editable=False)
+    area_m2 = models.FloatField(null=True, editable=False)
+
+    BBOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+    POLY_FIELDS = BBOX_FIELDS + ('vertex_count', 'area_m2')
 
     def __str__(self):
         return self.name
 
+    @property
+    def bbox(self):
+        """ (xmin, ymin, xmax, ymax) of `poly` """
+        if self.xmin is None:
+            return self.poly.extent
+        return self.xmin, self.ymin, self.xmax, self.ymax
+
+    @property
+    def saved_bbox(self):
+        """ bbox as it is in the database, `None` when unknown """
+        return self.__dict__.get('_saved_bbox')
+
+    def set_bbox(self):
+        self.xmin, self.ymin, self.xmax, self.ymax = self.poly.extent
+
+    @classmethod
+    def prepare_polys(cls, areas, errors=None):
+        """
+        Normalize `poly` of `areas` (see geoapi/normalize.py) and set the
+        `POLY_FIELDS` from it, one query for all of them. Raises
+        `InvalidPolygon`, or collects the rejects in `errors` (see
+        `normalize_polygons`).
+        """
+        areas = list(areas)
+        polys = normalize_polygons((x.poly for x in areas), errors)
+        for area, result in zip(areas, polys):
+            if result is None:
+                continue
+            poly, vertex_count, area_m2 = result
+            area.poly = poly
+            area.vertex_count = vertex_count
+            area.area_m2 = area_m2
+            area.set_bbox()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ServiceArea, cls).from_db(db, field_names, values)
+        if instance.__dict__.get('xmin') is not None:
+            instance._saved_bbox = instance.bbox
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'poly' in update_fields:
+            self.prepare_polys([self])
+            if update_fields is not None:
+                kwargs['update_fields'] = \
+                    set(update_fields) | set(self.POLY_FIELDS)
+        super(ServiceArea, self).save(*args, **kwargs)
+        if self.xmin is not None:
+            self._saved_bbox = self.bbox
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # ServiceAreaFilter, (provider_id, poly) is a btree_gist index
+            # (migration 0006) models can not declare
+            models.Index(fields=['price'], name='geoapi_area_price_idx'),
+            models.Index(fields=['price_currency', 'price'],
+                         name='geoapi_area_currency_idx'),
+            # `updated__gte` and the change feed (see geoapi/changes.py)
+            models.Index(fields=['updated', 'id'],
+                         name='geoapi_area_changes_idx'),
+        ]
+
+
+SUBDIVIDE_SQL = """
+INSERT INTO {piece} (area_id, poly)
+SELECT id, ST_Subdivide(poly, %s) FROM {area} WHERE id = ANY(%s)
+"""
+
+
+class ServiceAreaPieceManager(models.Manager):
+    def sync(self, area_ids):
+        """
+        `rebuild` when the `subdivided` engine is in use, the pieces of
+        the other engines are left (`manage.py build_area_pieces` fills
+        them when switching)
+        """
+        if settings.GEOAPI_LOOKUP_ENGINE == 'subdivided':
+            self.rebuild(area_ids)
+
+    def rebuild(self, area_ids):
+        """ Replace the pieces of the given areas """
+        area_ids = list(area_ids)
+        if not area_ids:
+            return
+        self.filter(area_id__in=area_ids).delete()
+        sql = SUBDIVIDE_SQL.format(
+            piece=self.model._meta.db_table,
+            area=ServiceArea._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql, [settings.GEOAPI_SUBDIVIDE_MAX_VERTICES, area_ids])
+
+
+class ServiceAreaPiece(models.Model):
+    """
+    `ST_Subdivide`d part of `ServiceArea.poly` with at most
+    `GEOAPI_SUBDIVIDE_MAX_VERTICES` vertices, kept in sync by signals
+    while `GEOAPI_LOOKUP_ENGINE` is `subdivided`.
+    """
+    area = models.ForeignKey(ServiceArea, related_name='pieces')
+    poly = models.PolygonField()
+
+    objects = ServiceAreaPieceManager()
+
+
+class AreaCellManager(models.Manager):
+    def sync(self, area_ids):
+        """
+        `rebuild` when the `grid` engine is in use, the cells of the
+        other engines are left (`manage.py build_area_cells` fills them
+        when switching)
+        """
+        if settings.GEOAPI_LOOKUP_ENGINE == 'grid':
+            self.rebuild(area_ids)
+
+    def rebuild(self, area_ids):
+        """ Replace the cells of the given areas """
+        area_ids = list(area_ids)
+        if not area_ids:
+            return
+        self.filter(area_id__in=area_ids).delete()
+        sql = COVER_SQL.format(
+            cell=self.model._meta.db_table,
+            area=ServiceArea._meta.db_table)
+        params = grid_params()
+        params['ids'] = area_ids
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class AreaCell(models.Model):
+    """
+    Cell of the `GEOAPI_GRID_LEVEL` grid (see geoapi/grid.py) which
+    `area` touches, `interior` when the area covers all of it. Kept in
+    sync by signals while `GEOAPI_LOOKUP_ENGINE` is `grid`.
+    """
+    area = models.ForeignKey(ServiceArea, related_name='cells')
+    cell = models.BigIntegerField()
+    interior = models.BooleanField()
+
+    objects = AreaCellManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell', 'interior'],
+                         name='geoapi_areacell_cell_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """
+    Deleted `Provider` or `ServiceArea` (`kind` is the model name) for
+    the change feeds, written by signals and kept for
+    `GEOAPI_TOMBSTONE_DAYS`.
+    """
+    kind = models.CharField(max_length=32)
+    object_id = models.IntegerField()
+    deleted = models.DateTimeField(auto_now_add=True)
+
     class Meta:
-        ordering = ['id']
\ No newline at end of file
+        indexes = [
+            models.Index(fields=['kind', 'deleted', 'id'],
+                         name='geoapi_tombstone_feed_idx'),
+        ]
@@ -0,0 +1,104 @@
+"""
+Write-time normalization of `ServiceArea.poly`.
+
+With `GEOAPI_NORMALIZE_POLYGONS` every written polygon goes through
+`ST_MakeValid`, loses its repeated and collinear points and gets its
+exterior ring counter-clockwise and its holes clockwise (RFC 7946). With
+`GEOAPI_MAX_VERTICES` it is then simplified (topology preserving, with a
+tolerance doubled until it fits, up to `MAX_TOLERANCE`) to at most that
+many points; the budget is best-effort, a polygon which does not fit at
+`MAX_TOLERANCE` is kept as simplified at that tolerance and logged. An
+invalid polygon which falls apart into several polygons
+or into lines is rejected, `PolygonField` can not hold the result.
+
+The vertex count and the area in square metres (on the spheroid) of the
+stored polygon are measured by the same query, one for all the polygons
+of a write.
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# degrees, about 0.1 m and 11 km on the equator
+MIN_TOLERANCE = 1e-6
+MAX_TOLERANCE = 0.1
+
+NORMALIZE_SQL = """
+WITH RECURSIVE s(idx, poly, tolerance) AS (
+  SELECT p.idx,
+         CASE WHEN %(normalize)s THEN ST_ForcePolygonCCW(
+           ST_SimplifyPreserveTopology(ST_RemoveRepeatedPoints(
+             ST_CollectionExtract(ST_MakeValid(g.poly), 3)), 0))
+         ELSE g.poly END,
+         %(min_tolerance)s::float8
+  FROM unnest(%(polys)s::bytea[]) WITH ORDINALITY AS p(ewkb, idx)
+  CROSS JOIN LATERAL
+    (SELECT ST_Transform(ST_GeomFromEWKB(p.ewkb), 4326) AS poly) g
+  UNION ALL
+  SELECT idx, ST_SimplifyPreserveTopology(poly, tolerance), tolerance * 2
+  FROM s
+  WHERE %(normalize)s AND %(max_vertices)s > 0
+    AND ST_NPoints(poly) > %(max_vertices)s
+    AND tolerance <= %(max_tolerance)s
+)
+SELECT DISTINCT ON (idx) idx, ST_NumGeometries(poly),
+       ST_AsEWKB(ST_GeometryN(poly, 1)), ST_NPoints(poly),
+       ST_Area(poly::geography)
+FROM s
+ORDER BY idx, tolerance DESC
+"""
+
+
+class InvalidPolygon(ValueError):
+    def __init__(self, message, index=0):
+        super(InvalidPolygon, self).__init__(message)
+        self.index = index
+
+
+def normalize_polygons(polys, errors=None):
+    """
+    -> [(polygon, vertex count, area in m2), ...] in the order of
+    `polys`. Raises `InvalidPolygon` (with the `index` of the polygon)
+    when one can not be normalized into a single polygon; with `errors`
+    (a list) `(index, message)` of every such polygon is appended to it
+    instead and its result is None.
+    """
+    polys = list(polys)
+    if not polys:
+        return []
+    data = []
+    for poly in polys:
+        if poly.srid is None:
+            poly = poly.clone()
+            poly.srid = 4326
+        data.append(bytes(poly.ewkb))
+    with connection.cursor() as cursor:
+        cursor.execute(NORMALIZE_SQL, {
+            'polys': data,
+            'normalize': settings.GEOAPI_NORMALIZE_POLYGONS,
+            'max_vertices': settings.GEOAPI_MAX_VERTICES,
+            'min_tolerance': MIN_TOLERANCE,
+            'max_tolerance': MAX_TOLERANCE,
+        })
+        rows = cursor.fetchall()
+    max_vertices = settings.GEOAPI_MAX_VERTICES
+    results = []
+    for idx, parts, ewkb, vertex_count, area in rows:
+        if parts != 1:
+            message = 'invalid polygon: it has no area' if not parts else \
+                'invalid polygon: it splits into %d polygons' % parts
+            if errors is None:
+                raise InvalidPolygon(message, idx - 1)
+            errors.append((idx - 1, message))
+            results.append(None)
+            continue
+        if settings.GEOAPI_NORMALIZE_POLYGONS and \
+                0 < max_vertices < vertex_count:
+            logger.warning('polygon #%d keeps %d points, more than '
+                           'GEOAPI_MAX_VERTICES', idx - 1, vertex_count)
+        results.append((GEOSGeometry(bytes(ewkb)), vertex_count, area))
+    return results
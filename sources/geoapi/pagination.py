@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from rest_framework import pagination
+from rest_framework.response import Response
+from rest_framework_gis import pagination as gis_pagination
+
+
+class CountedPaginator(Paginator):
+    """
+    Takes the row count from `object_list.known_count` when the view
+    has already counted the rows (see `ConditionalGetMixin`)
+    """
+
+    @cached_property
+    def count(self):
+        known_count = getattr(self.object_list, 'known_count', None)
+        if known_count is not None:
+            return known_count
+        return super(CountedPaginator, self).count
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    django_paginator_class = CountedPaginator
+
+
+class GeoJsonPagination(gis_pagination.GeoJsonPagination):
+    django_paginator_class = CountedPaginator
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination over the primary key: no COUNT(*) and no OFFSET,
+    so every page costs the same as the first one.
+    """
+    ordering = 'id'
+
+
+class GeoJsonCursorPagination(CursorPagination):
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('type', 'FeatureCollection'),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('features', data['features'])
+        ]))
+
+
+class PaginationModeMixin(object):
+    """
+    `?pagination=cursor` (and every link it produces, which carries a
+    `cursor` param) switches the view to `cursor_pagination_class`.
+    """
+    cursor_pagination_class = CursorPagination
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return 'cursor' in params or params.get('pagination') == 'cursor'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super(PaginationModeMixin, self).paginator
@@ -0,0 +1,24 @@
+import json
+
+from django.conf import settings
+from django.utils import six
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline delimited JSON: every non-empty line is a JSON document,
+    the parsed value is the list of those documents.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read().decode(encoding)
+            return [json.loads(line) for line in data.splitlines()
+                    if line.strip()]
+        except ValueError as exc:
+            raise ParseError('NDJSON parse error - %s' % six.text_type(exc))
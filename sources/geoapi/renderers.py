@@ -0,0 +1,68 @@
+"""
+JSON rendering with pre-encoded fragments.
+
+With `GEOAPI_RAW_GEOJSON` geometries are printed by PostGIS
+(`ST_AsGeoJSON(poly, 15)`) and spliced in as they are. The output is the
+same GeoJSON but not the same bytes as the serializer path: PostGIS
+prints integral coordinates as `0` (not `0.0`) and rounds to 15 decimal
+digits instead of printing the shortest representation of the double
+(`0.30000000000000004` comes out as `0.3`). This is on purpose: matching
+Python's float repr in SQL would cost more than the parsing it saves.
+Coordinates that are neither integral nor longer than 15 decimals come
+out byte for byte the same.
+"""
+import uuid
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class RawJSON(object):
+    """ Already encoded JSON (e.g. `ST_AsGeoJSON` output) to splice in """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.value == other.value
+
+    def __repr__(self):
+        return 'RawJSON(%r)' % self.value
+
+
+class RawJSONEncoder(JSONEncoder):
+    """
+    Encodes every `RawJSON` as the same placeholder string and puts the
+    raw values in place of the placeholders, in the order they were
+    encoded, once the document is encoded; pre-encoded fragments are
+    never parsed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RawJSONEncoder, self).__init__(*args, **kwargs)
+        self.token = uuid.uuid4().hex
+        self.fragments = []
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            self.fragments.append(obj.value)
+            return self.token
+        return super(RawJSONEncoder, self).default(obj)
+
+    def encode(self, obj):
+        self.fragments = []
+        text = super(RawJSONEncoder, self).encode(obj)
+        if not self.fragments:
+            return text
+        parts = text.split('"%s"' % self.token)
+        result = [parts[0]]
+        for fragment, part in zip(self.fragments, parts[1:]):
+            result.append(fragment)
+            result.append(part)
+        return ''.join(result)
+
+
+class RawJSONRenderer(JSONRenderer):
+    """ `JSONRenderer` which accepts `RawJSON` values in the data """
+    encoder_class = RawJSONEncoder
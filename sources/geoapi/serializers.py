@@ -1,20 +1,164 @@
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import FloatField
 from rest_framework.relations import PrimaryKeyRelatedField
-from rest_framework.serializers import ModelSerializer
-from rest_framework_gis.serializers import GeoFeatureModelSerializer
+from rest_framework.serializers import ListSerializer, ModelSerializer
+from rest_framework_gis.fields import GeoJsonDict
+from rest_framework_gis.serializers import (
+    GeoFeatureModelListSerializer, GeoFeatureModelSerializer)
+
+from utils.metrics import TimedSerializerMixin
 
+from .bulk import save_service_areas
 from .models import ServiceArea, Provider
+from .normalize import InvalidPolygon
+from .renderers import RawJSON
+
 
+class ProviderListSerializer(TimedSerializerMixin, ListSerializer):
+    pass
 
-class ProviderSerializer(ModelSerializer):
+
+class ProviderSerializer(TimedSerializerMixin, ModelSerializer):
     class Meta:
         model = Provider
         fields = ('id', 'name', 'email', 'phone', 'language', 'currency')
+        list_serializer_class = ProviderListSerializer
+
+
+class ProviderIdField(PrimaryKeyRelatedField):
+    """
+    Takes providers from the `providers` context dict when it is there
+    (filled by `ServiceAreaListSerializer` with a single query).
+    """
+
+    def to_internal_value(self, data):
+        providers = self.context.get('providers')
+        if providers is None:
+            return super(ProviderIdField, self).to_internal_value(data)
+        try:
+            return providers[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class ServiceAreaListSerializer(TimedSerializerMixin,
+                                GeoFeatureModelListSerializer):
+    """
+    Bulk writes: accepts a list of areas or a GeoJSON FeatureCollection
+    (updates need an `id` per item) and saves everything with
+    `bulk_create`/`bulk_update` in one transaction.
+
+    With the `allow_partial` context flag invalid items are left out
+    and reported in `item_errors` as (index, errors) pairs.
+
+    A polygon which can not be normalized (see geoapi/normalize.py) fails
+    the whole write, it is only found when the batch is saved.
+    """
+    item_errors = ()
+    item_indexes = ()
 
+    def get_items(self, data):
+        if isinstance(data, dict) and data.get('type') == 'FeatureCollection':
+            data = data.get('features')
+        if not isinstance(data, list):
+            raise ValidationError({'non_field_errors': [
+                'Expected a list of items or a FeatureCollection.']})
+        limit = settings.GEOAPI_BULK_MAX_ITEMS
+        if len(data) > limit:
+            raise ValidationError({'non_field_errors': [
+                'Too many items (max %d).' % limit]})
+        return [x.get('properties', x) if isinstance(x, dict) else x
+                for x in data], data
 
-class ServiceAreaSerializer(GeoFeatureModelSerializer):
-    """ A class to ServiceArea locations as GeoJSON compatible data """
+    def to_internal_value(self, data):
+        properties, items = self.get_items(data)
+        provider_ids = set()
+        for x in properties:
+            try:
+                provider_ids.add(int(x['provider_id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        self.context['providers'] = Provider.objects.in_bulk(provider_ids)
+        instances = {}
+        if self.instance is not None:
+            instances = dict((x.id, x) for x in self.instance)
+        ret, errors, indexes = [], [], []
+        for i, item in enumerate(items):
+            try:
+                pk = None
+                if self.instance is not None:
+                    if isinstance(item, dict):
+                        pk = properties[i].get('id', item.get('id'))
+                    if pk not in instances:
+                        raise ValidationError({'id': ['Not found.']})
+                validated = self.child.run_validation(item)
+            except ValidationError as exc:
+                errors.append((i, exc.detail))
+            else:
+                if pk is not None:
+                    validated['id'] = pk
+                ret.append(validated)
+                indexes.append(i)
+        if errors and not self.context.get('allow_partial'):
+            detail = [{} for _ in items]
+            for i, error in errors:
+                detail[i] = error
+            raise ValidationError(detail)
+        self.item_errors = errors
+        self.item_indexes = indexes
+        return ret
+
+    def save(self, **kwargs):
+        try:
+            return super(ServiceAreaListSerializer, self).save(**kwargs)
+        except InvalidPolygon as e:
+            raise ValidationError([{'index': self.item_indexes[e.index],
+                                    'errors': {'poly': [str(e)]}}])
+
+    def create(self, validated_data):
+        areas = [ServiceArea(**attrs) for attrs in validated_data]
+        save_service_areas(areas, [], ())
+        return areas
+
+    def update(self, instance, validated_data):
+        instances = dict((x.id, x) for x in instance)
+        areas, fields = [], set()
+        for attrs in validated_data:
+            area = instances[attrs.pop('id')]
+            for name, value in attrs.items():
+                setattr(area, name, value)
+            fields.update(attrs)
+            areas.append(area)
+        if 'price' in fields:
+            fields.add('price_currency')
+        save_service_areas([], areas, sorted(fields))
+        return areas
+
+
+class ServiceAreaSerializer(TimedSerializerMixin, GeoFeatureModelSerializer):
+    """ A class to ServiceArea locations as GeoJSON compatible data
+
+    Context options (see `ServiceAreaViewSet.get_serializer_context`):
+     - `fields` -- a set of readable fields to keep, `None` keeps them all
+     - `geometry` -- `full`, `bbox` (only the bounding box) or `none`
+     - `raw_geojson` -- pass the `geojson` annotation on undecoded, as
+       `RawJSON` for `RawJSONRenderer`
+     - `distance` -- add the `distance` annotation (metres from `near=`)
+       to the properties
+
+    `bbox` comes from the `xmin`/`ymin`/`xmax`/`ymax` columns.
+
+    A `geojson` annotation (geometry rendered by PostGIS) is used instead
+    of `poly` when it is present.
+    """
     provider = ProviderSerializer(read_only=True)
-    provider_id = PrimaryKeyRelatedField(
+    provider_id = ProviderIdField(
         queryset=Provider.objects.all(),
         required=True, write_only=True, source='provider')
 
@@ -22,4 +166,50 @@ class ServiceAreaSerializer(GeoFeatureModelSerializer):
         model = ServiceArea
         geo_field = "poly"
         fields = ('id', 'name', 'provider', 'provider_id', 'price')
-        auto_bbox = True
+        auto_bbox = False
+        list_serializer_class = ServiceAreaListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super(ServiceAreaSerializer, self).__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            keep = set(fields) | {self.Meta.id_field, self.Meta.geo_field}
+            for name, field in list(self.fields.items()):
+                if name not in keep and not field.write_only:
+                    self.fields.pop(name)
+        if self.context.get('distance'):
+            self.fields['distance'] = FloatField(read_only=True)
+
+    def save(self, **kwargs):
+        try:
+            return super(ServiceAreaSerializer, self).save(**kwargs)
+        except InvalidPolygon as e:
+            raise ValidationError({'poly': [str(e)]})
+
+    def to_representation(self, instance):
+        # same layout as GeoFeatureModelSerializer, the bbox is taken
+        # from the stored columns instead of `poly.extent`
+        geometry = self.context.get('geometry', 'full')
+        geojson = getattr(instance, 'geojson', None)
+        fields = [x for x in self.fields.values()
+                  if x.field_name != self.Meta.geo_field]
+        field = self.fields[self.Meta.id_field]
+        fields.remove(field)
+        feature = OrderedDict()
+        feature["id"] = field.to_representation(field.get_attribute(instance))
+        feature["type"] = "Feature"
+        feature["geometry"] = None
+        if geometry == 'full' and geojson is not None and \
+                self.context.get('raw_geojson'):
+            feature["geometry"] = RawJSON(geojson)
+        elif geometry == 'full' and geojson is not None:
+            feature["geometry"] = json.loads(
+                geojson, object_pairs_hook=GeoJsonDict)
+        elif geometry == 'full':
+            field = self.fields[self.Meta.geo_field]
+            feature["geometry"] = field.to_representation(
+                field.get_attribute(instance))
+        if geometry != 'none':
+            feature["bbox"] = instance.bbox
+        feature["properties"] = self.get_properties(instance, fields)
+        return feature
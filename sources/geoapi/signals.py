@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .cache import lookup_cache
+from .index import area_index
+from .models import (
+    AreaCell, Provider, ServiceArea, ServiceAreaPiece, Tombstone)
+from .tiles import tile_cache
+
+# sent by bulk writes which bypass `post_save`/`post_delete`
+service_areas_changed = Signal(providing_args=['provider_ids'])
+
+
+def invalidate_lookups(provider_ids):
+    if settings.GEOAPI_LOOKUP_CACHE:
+        transaction.on_commit(lambda: lookup_cache.bump(provider_ids))
+
+
+def invalidate_tiles(boxes):
+    """ `None` in `boxes` (an unknown bbox) drops every cached tile """
+    if not settings.GEOAPI_TILE_CACHE:
+        return
+    if None in boxes:
+        transaction.on_commit(tile_cache.flush)
+    else:
+        transaction.on_commit(lambda: tile_cache.invalidate(boxes))
+
+
+@receiver(post_save, sender=ServiceArea)
+def subdivide_service_area(sender, instance, update_fields, **kwargs):
+    if update_fields is None or 'poly' in update_fields:
+        ServiceAreaPiece.objects.sync([instance.pk])
+
+
+@receiver(post_save, sender=ServiceArea)
+def cover_service_area(sender, instance, update_fields, **kwargs):
+    if update_fields is None or 'poly' in update_fields:
+        AreaCell.objects.sync([instance.pk])
+
+
+@receiver(post_save, sender=ServiceArea)
+def index_service_area(sender, instance, created, **kwargs):
+    transaction.on_commit(lambda: area_index.update(instance))
+    invalidate_lookups([instance.provider_id])
+    boxes = [instance.bbox]
+    if not created:
+        # `save` has not replaced the loaded bbox yet
+        boxes.append(instance.saved_bbox)
+    invalidate_tiles(boxes)
+
+
+@receiver(post_delete, sender=ServiceArea)
+def unindex_service_area(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: area_index.remove(pk))
+    invalidate_lookups([instance.provider_id])
+    invalidate_tiles([instance.bbox])
+
+
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=Provider)
+def invalidate_provider_lookups(sender, instance, **kwargs):
+    invalidate_lookups([instance.pk])
+
+
+@receiver(post_save, sender=Provider)
+def touch_provider_areas(sender, instance, created, **kwargs):
+    # areas embed their provider, the change feed sends them again
+    if not created:
+        ServiceArea.objects.filter(provider=instance).update(
+            updated=instance.updated)
+
+
+@receiver(post_delete, sender=Provider)
+@receiver(post_delete, sender=ServiceArea)
+def record_deletion(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=sender._meta.model_name,
+                             object_id=instance.pk)
+
+
+@receiver(service_areas_changed)
+def service_areas_bulk_changed(sender, provider_ids, **kwargs):
+    transaction.on_commit(area_index.clear)
+    invalidate_lookups(provider_ids)
+    invalidate_tiles([None])
@@ -0,0 +1,201 @@
+"""
+Precompiled `AreaIndex` snapshot, built by `manage.py build_area_index`.
+
+The file is a header followed by flat arrays of 8-byte items (native byte
+order, the snapshot is built where it is used):
+
+ - the `STRTree` levels (boxes, level 0 holds the area envelopes),
+ - per area, in the STR order of level 0: id, provider id and the offset
+   of its first ring,
+ - the rings as (start, end) offsets into the coordinates,
+ - the coordinates as flat x, y pairs,
+ - ids sorted, with the position of every id,
+ - offsets into a UTF-8 blob of `name \\x1f price \\x1f currency`.
+
+Workers `mmap` the file and query it through memoryviews, so opening a
+snapshot costs the same for ten areas and for a million and the pages
+are shared by every process. Snapshots are replaced with a rename, an
+open one stays valid until the last reference to it is dropped.
+"""
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .index import IndexedArea, STRTree, flatten_polygon
+from .models import ServiceArea
+
+MAGIC = b'GEOAIDX1'
+# magic, node capacity, areas, levels, rings, coordinates, text bytes,
+# last `updated` (microseconds since the epoch), largest id
+HEADER = struct.Struct('=8sqqqqqqqq')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NO_UPDATED = -2 ** 63
+SEPARATOR = '\x1f'
+
+
+def to_microseconds(value):
+    if value is None:
+        return NO_UPDATED
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(value):
+    if value == NO_UPDATED:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+
+def write_snapshot(path, node_capacity=None):
+    """
+    Compile every `ServiceArea` into a snapshot at `path`, returns the
+    number of areas. The file is written next to `path` and renamed.
+    """
+    node_capacity = node_capacity or settings.GEOAPI_INDEX_NODE_CAPACITY
+    areas = []
+    updated = None
+    for row in ServiceArea.objects.values_list(
+            'id', 'provider_id', 'name', 'price', 'price_currency', 'poly',
+            'updated').iterator():
+        pk, provider_id, name, price, currency, poly, area_updated = row
+        coords, rings, extent = flatten_polygon(poly)
+        text = SEPARATOR.join([name, str(price), currency]).encode('utf-8')
+        areas.append((pk, provider_id, coords, rings, extent, text))
+        if updated is None or area_updated > updated:
+            updated = area_updated
+    tree = STRTree([x[4] for x in areas], node_capacity)
+
+    ids = array('q')
+    provider_ids = array('q')
+    area_rings = array('q', [0])
+    rings = array('q')
+    coords = array('d')
+    text_offsets = array('q', [0])
+    text = bytearray()
+    for i in tree.order:
+        pk, provider_id, area_coords, ring_offsets, _, area_text = areas[i]
+        ids.append(pk)
+        provider_ids.append(provider_id)
+        for start, end in ring_offsets:
+            rings.append(len(coords) + start)
+            rings.append(len(coords) + end)
+        area_rings.append(len(rings) // 2)
+        coords.extend(area_coords)
+        text.extend(area_text)
+        text_offsets.append(len(text))
+    by_id = sorted(range(len(ids)), key=ids.__getitem__)
+    sorted_ids = array('q', (ids[i] for i in by_id))
+    sorted_positions = array('q', by_id)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(HEADER.pack(
+                MAGIC, node_capacity, len(ids), len(tree.levels),
+                len(rings) // 2, len(coords), len(text),
+                to_microseconds(updated), max(ids) if ids else 0))
+            fp.write(array('q', [len(x) for x in tree.levels]).tobytes())
+            for part in tree.levels + [
+                    ids, provider_ids, area_rings, rings, coords,
+                    sorted_ids, sorted_positions, text_offsets]:
+                fp.write(part.tobytes())
+            fp.write(text)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(ids)
+
+
+class Snapshot(object):
+    """
+    Read-only view of a snapshot file. It is a sequence of `IndexedArea`
+    (built on access) in the order of `tree`.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.file_id = file_id(os.fstat(fp.fileno()))
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        (magic, node_capacity, count, levels, rings, coords, text,
+         updated, self.max_id) = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError('%s is not an area index snapshot' % path)
+        self.count = count
+        self.updated = from_microseconds(updated)
+        offset = HEADER.size
+
+        def take(fmt, size):
+            nonlocal offset
+            part = buf[offset:offset + 8 * size].cast(fmt)
+            offset += 8 * size
+            return part
+
+        level_sizes = take('q', levels)
+        self.tree = STRTree.from_levels(
+            [take('d', size) for size in level_sizes], range(count),
+            node_capacity)
+        self._boxes = self.tree.levels[0]
+        self._ids = take('q', count)
+        self._provider_ids = take('q', count)
+        self._area_rings = take('q', count + 1)
+        self._rings = take('q', 2 * rings)
+        self._coords = take('d', coords)
+        self._sorted_ids = take('q', count)
+        self._sorted_positions = take('q', count)
+        self._text_offsets = take('q', count + 1)
+        self._text = buf[offset:offset + text]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        rings = self._rings
+        return IndexedArea.from_flat(
+            self._ids[i], self._provider_ids[i], self._coords,
+            tuple((rings[2 * k], rings[2 * k + 1]) for k in range(
+                self._area_rings[i], self._area_rings[i + 1])),
+            tuple(self._boxes[4 * i:4 * i + 4]))
+
+    def position(self, pk):
+        """ -> position of the area with id `pk` or None """
+        i = bisect.bisect_left(self._sorted_ids, pk)
+        if i < self.count and self._sorted_ids[i] == pk:
+            return self._sorted_positions[i]
+        return None
+
+    def describe(self, i):
+        """ -> (id, provider id, name, price, price currency) """
+        text = bytes(self._text[
+            self._text_offsets[i]:self._text_offsets[i + 1]])
+        name, price, currency = text.decode('utf-8').split(SEPARATOR)
+        return (self._ids[i], self._provider_ids[i], name, price, currency)
+
+
+def open_snapshot(path):
+    """ -> `Snapshot` or None when there is no file at `path` """
+    try:
+        return Snapshot(path)
+    except FileNotFoundError:
+        return None
+
+
+def file_id(stat):
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def snapshot_file_id(path):
+    """ Changes whenever the snapshot at `path` is replaced """
+    try:
+        return file_id(os.stat(path))
+    except FileNotFoundError:
+        return None
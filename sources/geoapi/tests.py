@@ -1,27 +1,74 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+from decimal import Decimal
 from collections import OrderedDict
+from datetime import timedelta
+from io import StringIO
 from random import randint
+from unittest import skipIf, skipUnless
 
+import redis
 from django.conf import settings
-from django.contrib.gis.geos import Polygon
-from django.test import TestCase
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.gis.geos import Point, Polygon
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.utils.http import http_date
+from moneyed import Money
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework_gis.fields import GeoJsonDict
 
+from utils.db import STICKY_COOKIE, ReplicaRouter, use_replica
+from utils.metrics import registry
 from utils.testing import AssertionsMixin, ANYTHING
-from .models import Provider, ServiceArea
+from .cache import geohash, get_redis, lookup_cache, quantize
+from .grid import grid_cell
+from .importer import iter_feature_collection
+from .index import STRTree, area_index, flatten_polygon, polygon_contains
+from .lookups import batch_lookup, contains_ids
+from .models import (
+    AreaCell, Provider, ServiceArea, ServiceAreaPiece, Tombstone)
+from .renderers import RawJSON, RawJSONRenderer
 from .serializers import ServiceAreaSerializer
+from .snapshot import Snapshot, write_snapshot
+from .tiles import render_tile, tile_bounds, tile_cache, tile_range
 
+try:
+    # only the asyncio lookup service needs aiohttp and asyncpg
+    from yarl import URL
+    from .aio import feature, page_url
+except ImportError:
+    URL = None
+
+
+def redis_available():
+    try:
+        return get_redis().ping()
+    except redis.RedisError:
+        return False
+
+
+# the lookup and tile cache tests need a live Redis
+REDIS = redis_available()
+
+# counter-clockwise like polygons normalized on write (RFC 7946)
 P1 = Polygon([
     [2.109375, 15.29296875],
-    [16.083984375, 16.34765625],
-    [25.576171875, 0.87890625],
-    [-3.69140625, -8.4375],
-    [-13.623046875, 12.041015625],
-    [-12.568359375, 15.1171875],
-    [-11.25, 16.435546875],
     [-8.876953125, 16.611328125],
+    [-11.25, 16.435546875],
+    [-12.568359375, 15.1171875],
+    [-13.623046875, 12.041015625],
+    [-3.69140625, -8.4375],
+    [25.576171875, 0.87890625],
+    [16.083984375, 16.34765625],
     [2.109375, 15.29296875]
 ])
 
@@ -56,7 +103,7 @@ class ModelFactoryMixin:
                             price=None):
         if not poly:
             poly = Polygon(
-                ((0, 0), (0, 10), (10, 10), (0, 10), (0, 0)),
+                ((0, 0), (10, 0), (10, 10), (0, 10), (0, 0)),
                 ((4, 4), (4, 6), (6, 6), (6, 4), (4, 4)))
         if not provider:
             provider = self.create_provider()
@@ -70,6 +117,7 @@ class ModelFactoryMixin:
 
 
 class TestModels(ModelFactoryMixin, TestCase):
+    @override_settings(GEOAPI_NORMALIZE_POLYGONS=False)
     def test_create_provider_and_two_equal_areas(self):
         provider = self.create_provider()
         poly = Polygon(
@@ -82,6 +130,21 @@ class TestModels(ModelFactoryMixin, TestCase):
         self.assertEqual(area2.provider, provider)
         self.assertEqual(area2.poly, area1.poly)
 
+    def test_service_area_bbox_columns(self):
+        area = self.create_service_area(P1)
+        area.refresh_from_db()
+        self.assertEqual(area.bbox, P1.extent)
+        area.poly = P2
+        area.save(update_fields=['poly'])
+        area.refresh_from_db()
+        self.assertEqual(
+            (area.xmin, area.ymin, area.xmax, area.ymax), P2.extent)
+
+    def test_service_area_contains_ids(self):
+        area = self.create_service_area(P1)
+        self.create_service_area(P2)
+        self.assertEqual(contains_ids((-5, 5)), [area.id])
+
 
 class TestSerializers(ModelFactoryMixin, TestCase):
     def test_serialize_service_area(self):
@@ -100,7 +163,7 @@ class TestSerializers(ModelFactoryMixin, TestCase):
             'geometry': GeoJsonDict([
                 ('type', 'Polygon'),
                 ('coordinates', (
-                    ((0.0, 0.0), (0.0, 10.0), (10.0, 10.0),
+                    ((0.0, 0.0), (10.0, 0.0), (10.0, 10.0),
                      (0.0, 10.0), (0.0, 0.0)),
                     ((4.0, 4.0), (4.0, 6.0), (6.0, 6.0),
                      (6.0, 4.0), (4.0, 4.0))))]),
@@ -157,6 +220,7 @@ class TestAPI(AssertionsMixin, ModelFactoryMixin, TestCase):
         self.assertEqual(Provider.objects.count(), 1)
         self.assertEqual(Provider.objects.get().name, 'test')
 
+    @override_settings(GEOAPI_NORMALIZE_POLYGONS=False)
     def test_api_v1_create_service_areas(self):
         provider = self.create_provider()
         r = self.client.post('/api/v1/service-areas/', {
@@ -222,7 +286,7 @@ class TestAPI(AssertionsMixin, ModelFactoryMixin, TestCase):
                     ('geometry', GeoJsonDict([
                         ('type', 'Polygon'),
                         ('coordinates', (
-                            ((0.0, 0.0), (0.0, 10.0), (10.0, 10.0),
+                            ((0.0, 0.0), (10.0, 0.0), (10.0, 10.0),
                              (0.0, 10.0), (0.0, 0.0)),
                             ((4.0, 4.0), (4.0, 6.0), (6.0, 6.0),
                              (6.0, 4.0), (4.0, 4.0))))])),
@@ -291,3 +355,1439 @@ class TestAPI(AssertionsMixin, ModelFactoryMixin, TestCase):
         self.assertEqual(r.data, [
             "invalid poly__contains: Expecting ',' delimiter: "
             "line 1 column 49 (char 48)"])
+
+
+class TestQueryCounts(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def create_areas(self, count, poly=None):
+        return [self.create_service_area(poly) for _ in range(count)]
+
+    def assertListQueries(self, count, areas, url='/api/v1/service-areas/'):
+        # the version aggregate, whose count the paginator reuses, and
+        # one SELECT for the page
+        with self.assertNumQueries(2):
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['count'], count)
+        self.assertEqual(
+            [x['properties']['provider']['id'] for x in r.data['features']],
+            [x.provider_id for x in areas[:50]])
+
+    def test_list_1_area(self):
+        self.assertListQueries(1, self.create_areas(1))
+
+    def test_list_50_areas(self):
+        self.assertListQueries(50, self.create_areas(50))
+
+    def test_list_500_areas(self):
+        self.assertListQueries(500, self.create_areas(500))
+
+    def test_poly_contains_50_areas(self):
+        areas = self.create_areas(50, P1)
+        self.create_areas(10)
+        self.assertListQueries(
+            50, areas, '/api/v1/service-areas/?poly__contains='
+                       '{"type":"Point","coordinates":[9.26,10.56]}')
+
+    def test_retrieve_area(self):
+        area = self.create_service_area()
+        with self.assertNumQueries(1):
+            r = self.client.get('/api/v1/service-areas/%d/' % area.id)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['properties']['provider']['id'],
+                         area.provider_id)
+
+
+class TestProjection(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return r, queries[-1]['sql']
+
+    def test_api_v1_service_areas_fields_without_geometry(self):
+        area = self.create_service_area(P1, price=10)
+        r, sql = self.get('/api/v1/service-areas/?poly__contains='
+                          '{"type":"Point","coordinates":[9.26,10.56]}'
+                          '&fields=name,price&geometry=none')
+        self.assertNotIn('"poly"', sql.split(' FROM ')[0])
+        self.assertNotIn('geoapi_provider', sql)
+        self.assertEqual(r.data['features'], [OrderedDict([
+            ('id', area.id),
+            ('type', 'Feature'),
+            ('geometry', None),
+            ('properties', OrderedDict([
+                ('name', area.name), ('price', '10.00000000')]))])])
+
+    def test_api_v1_service_areas_geometry_bbox(self):
+        area = self.create_service_area()
+        r, sql = self.get('/api/v1/service-areas/%d/?geometry=bbox'
+                          '&fields=provider' % area.id)
+        self.assertEqual(r.data, OrderedDict([
+            ('id', area.id),
+            ('type', 'Feature'),
+            ('geometry', None),
+            ('bbox', (0.0, 0.0, 10.0, 10.0)),
+            ('properties', OrderedDict([
+                ('provider', OrderedDict([
+                    ('id', area.provider.id), ('name', area.provider.name),
+                    ('email', area.provider.email),
+                    ('phone', area.provider.phone),
+                    ('language', area.provider.language),
+                    ('currency', area.provider.currency)]))]))]))
+
+    def test_api_v1_service_areas_precision(self):
+        area = self.create_service_area(P2)
+        r, sql = self.get('/api/v1/service-areas/%d/?precision=1' % area.id)
+        self.assertNotIn('"poly"', sql.split(' FROM ')[0].replace(
+            'ST_AsGeoJSON("geoapi_servicearea"."poly"', ''))
+        self.assertEqual(r.data['geometry'], {
+            'type': 'Polygon',
+            'coordinates': [[
+                [4.6, 13.6], [2.9, 9.7], [5.9, 4.7], [14.6, 4.7],
+                [15.4, 14.9], [6.4, 15.6], [4.6, 13.6]]]})
+        self.assertEqual(r.data['bbox'], P2.extent)
+
+    def test_api_v1_service_areas_simplify(self):
+        area = self.create_service_area(P1)
+        r, _ = self.get('/api/v1/service-areas/?simplify=5&precision=3')
+        feature = r.data['features'][0]
+        self.assertEqual(feature['id'], area.id)
+        self.assertEqual(feature['geometry']['type'], 'Polygon')
+        self.assertLess(len(feature['geometry']['coordinates'][0]),
+                        len(P1.coords[0]))
+        self.assertEqual(feature['bbox'], P1.extent)
+
+    def test_api_v1_service_areas_projection_errors(self):
+        r = self.client.get('/api/v1/service-areas/?fields=name,poly')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.data, ['invalid fields: poly'])
+        r = self.client.get('/api/v1/service-areas/?geometry=simple')
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get('/api/v1/service-areas/?precision=16')
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get('/api/v1/service-areas/?simplify=-1')
+        self.assertEqual(r.status_code, 400)
+        for value in ('nan', 'inf'):
+            r = self.client.get('/api/v1/service-areas/?simplify=' + value)
+            self.assertEqual(r.status_code, 400)
+
+
+class TestRawGeoJSON(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def get_both(self, url):
+        with override_settings(GEOAPI_RAW_GEOJSON=False):
+            r1 = self.client.get(url)
+        with override_settings(GEOAPI_RAW_GEOJSON=True):
+            r2 = self.client.get(url)
+        self.assertEqual(r1.status_code, 200)
+        self.assertEqual(r2.status_code, 200)
+        return r1, r2
+
+    def test_api_v1_service_areas_raw_geojson(self):
+        area = self.create_service_area(P1)
+        self.create_service_area(P2)
+        r1, r2 = self.get_both('/api/v1/service-areas/')
+        self.assertIsInstance(r2.data['features'][0]['geometry'], RawJSON)
+        self.assertEqual(r2.content, r1.content)
+        r1, r2 = self.get_both('/api/v1/service-areas/%d/' % area.id)
+        self.assertEqual(r2.content, r1.content)
+        r1, r2 = self.get_both('/api/v1/service-areas/?fields=name')
+        self.assertEqual(r2.content, r1.content)
+
+    def test_api_v1_service_areas_raw_geojson_export(self):
+        self.create_service_area(P1)
+        r1, r2 = self.get_both('/api/v1/service-areas/export/')
+        self.assertEqual(b''.join(r2.streaming_content),
+                         b''.join(r1.streaming_content))
+
+    def test_raw_geojson_rounds_coordinates(self):
+        # PostGIS prints 15 decimals and integral values without `.0`
+        poly = Polygon(((0, 0), (1, 0), (1, 0.1 + 0.2), (0, 0)))
+        area = self.create_service_area(poly)
+        r1, r2 = self.get_both('/api/v1/service-areas/%d/' % area.id)
+        self.assertIn(b'0.30000000000000004', r1.content)
+        self.assertIn(b'[1,0.3]', r2.content.replace(b' ', b''))
+        ring1 = json.loads(r1.content.decode())['geometry']['coordinates'][0]
+        ring2 = json.loads(r2.content.decode())['geometry']['coordinates'][0]
+        for a, b in zip(sum(ring1, []), sum(ring2, [])):
+            self.assertAlmostEqual(a, b, places=15)
+
+    def test_raw_json_renderer(self):
+        data = OrderedDict([('a', RawJSON('[1, 2]')), ('b', 'x'),
+                            ('c', [RawJSON('{}'), RawJSON('null')])])
+        self.assertEqual(RawJSONRenderer().render(data),
+                         b'{"a":[1, 2],"b":"x","c":[{},null]}')
+
+
+@skipIf(URL is None, 'aiohttp/asyncpg are not installed')
+class TestAsyncLookup(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_feature_matches_viewset(self):
+        area = self.create_service_area(P2, price=12)
+        point = json.dumps({'type': 'Point', 'coordinates': [8, 8]})
+        with override_settings(GEOAPI_RAW_GEOJSON=True):
+            r = self.client.get('/api/v1/service-areas/',
+                                {'poly__contains': point})
+        self.assertEqual(r.data['count'], 1)
+        geojson = ServiceArea.objects.annotate(
+            geojson=AsGeoJSON('poly', precision=15)).get().geojson
+        provider = area.provider
+        row = (area.id, area.name, Decimal(12), geojson) + area.bbox + (
+            provider.id, provider.name, provider.email, str(provider.phone),
+            provider.language, str(provider.currency), 1)
+        self.assertEqual(
+            RawJSONRenderer().render(feature(row)),
+            RawJSONRenderer().render(r.data['features'][0]))
+
+    def test_page_url(self):
+        url = URL('http://testserver/api/v1/service-areas/'
+                  '?poly__contains=x&page=2')
+        self.assertEqual(
+            page_url(url, 3),
+            'http://testserver/api/v1/service-areas/'
+            '?poly__contains=x&page=3')
+        self.assertEqual(page_url(url, 1),
+                         'http://testserver/api/v1/service-areas/'
+                         '?poly__contains=x')
+
+
+class TestMetrics(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_server_timing_header(self):
+        self.create_service_area()
+        r = self.client.get('/api/v1/service-areas/')
+        timing = dict(x.split(';', 1) for x in
+                      r['Server-Timing'].split(', '))
+        self.assertEqual(sorted(timing),
+                         ['app', 'db', 'render', 'serialize', 'total'])
+        self.assertIn('desc="2 queries"', timing['db'])
+
+    def test_metrics_endpoint(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(GEOAPI_METRICS_DIR=directory):
+            registry._values.clear()
+            self.client.get('/api/v1/providers/')
+            self.client.get('/api/v1/providers/')
+            r = self.client.get('/metrics')
+        self.assertEqual(r.status_code, 200)
+        text = r.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{phase="total",view="provider-list"} 2', text)
+        self.assertIn('http_request_queries_bucket'
+                      '{view="provider-list",le="+Inf"} 2', text)
+
+    def test_metrics_of_exited_workers_are_kept(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(GEOAPI_METRICS_DIR=directory):
+            registry._values.clear()
+            self.client.get('/api/v1/providers/')
+            registry.flush(force=True)
+            os.rename(registry.path, os.path.join(
+                directory, '%d.json' % process.pid))
+            registry._values.clear()
+            r = self.client.get('/metrics')
+            self.assertEqual(sorted(os.listdir(directory)), [
+                '%d.json' % os.getpid(), 'archive.json', 'archive.lock'])
+        self.assertIn('http_request_queries_count'
+                      '{view="provider-list"} 1', r.content.decode())
+
+
+class TestReplicaRouting(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_router(self):
+        router = ReplicaRouter()
+        with override_settings(DATABASE_REPLICAS=['replica1']):
+            self.assertIsNone(router.db_for_read(ServiceArea))
+            use_replica('replica1')
+            try:
+                self.assertEqual(router.db_for_read(ServiceArea), 'replica1')
+                self.assertEqual(router.db_for_write(ServiceArea), 'default')
+            finally:
+                use_replica(None)
+            self.assertTrue(router.allow_migrate('default', 'geoapi'))
+            self.assertFalse(router.allow_migrate('replica1', 'geoapi'))
+
+    @override_settings(DATABASE_REPLICAS=['replica1'],
+                       POSTGRES_REPLICA_STICKY_SECONDS=15)
+    def test_write_makes_reads_sticky(self):
+        r = self.client.post('/api/v1/providers/', {'name': 'test'})
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(r.cookies[STICKY_COOKIE]['max-age'], 15)
+        # `replica1` is not a real database, reads must stay on default
+        r = self.client.get('/api/v1/providers/')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(r.data['results']), 1)
+        self.assertNotIn(STICKY_COOKIE, r.cookies)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_lookup_is_not_a_write(self):
+        self.client.cookies[STICKY_COOKIE] = '1'
+        r = self.client.post('/api/v1/service-areas/lookup/', [
+            {'type': 'Point', 'coordinates': [1, 1]}], format='json')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertNotIn(STICKY_COOKIE, r.cookies)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_failed_write_is_not_sticky(self):
+        r = self.client.post('/api/v1/providers/', {})
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn(STICKY_COOKIE, r.cookies)
+
+
+class TestConditionalGet(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def assertNotModified(self, url, queries=1, **headers):
+        with self.assertNumQueries(queries):
+            r = self.client.get(url, **headers)
+        self.assertEqual(r.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(r.content, b'')
+        return r
+
+    def test_api_v1_service_areas_etag(self):
+        area = self.create_service_area(P1)
+        url = '/api/v1/service-areas/'
+        r = self.client.get(url)
+        etag = r['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+        area.name = 'renamed'
+        area.save()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(r['ETag'], etag)
+        etag = r['ETag']
+
+        area.provider.name = 'renamed'
+        area.provider.save()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        etag = r['ETag']
+        # the provider is not in the response
+        r = self.client.get(url + '?fields=name')
+        provider = area.provider
+        provider.name = 'renamed again'
+        provider.save()
+        self.assertNotModified(url + '?fields=name',
+                               HTTP_IF_NONE_MATCH=r['ETag'])
+
+        area.delete()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data['count'], 0)
+
+    def test_api_v1_service_areas_retrieve_etag(self):
+        area = self.create_service_area(P1)
+        url = '/api/v1/service-areas/%d/' % area.id
+        r = self.client.get(url)
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertNotModified(url, HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+        area.price = 20
+        area.save()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+
+    def test_api_v1_providers_list_has_no_last_modified(self):
+        provider = self.create_provider()
+        other = self.create_provider()
+        url = '/api/v1/providers/'
+        r = self.client.get(url)
+        self.assertNotIn('Last-Modified', r)
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        # a delete leaves the latest `updated` as it was
+        since = http_date(time.time() + 60)
+        provider.delete()
+        r = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data['results'][0]['id'], other.id)
+
+    def test_cursor_pages_are_not_versioned(self):
+        self.create_service_area()
+        r = self.client.get('/api/v1/service-areas/?pagination=cursor')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', r)
+
+
+class TestCursorPagination(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            self.assertNotIn('count', r.data)
+            for query in queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+            ids.extend(x['id'] for x in r.data[key])
+            url = r.data['next']
+        return ids
+
+    def test_api_v1_service_areas_cursor(self):
+        areas = [self.create_service_area() for _ in range(120)]
+        ids = self.walk('/api/v1/service-areas/?pagination=cursor',
+                        'features')
+        self.assertEqual(ids, [x.id for x in areas])
+
+        r = self.client.get('/api/v1/service-areas/?pagination=cursor')
+        self.assertEqual(r.data['type'], 'FeatureCollection')
+        self.assertIsNone(r.data['previous'])
+        r = self.client.get(r.data['next'])
+        r = self.client.get(r.data['previous'])
+        self.assertEqual([x['id'] for x in r.data['features']],
+                         [x.id for x in areas[:50]])
+
+    def test_api_v1_providers_cursor(self):
+        providers = [self.create_provider() for _ in range(60)]
+        ids = self.walk('/api/v1/providers/?pagination=cursor', 'results')
+        self.assertEqual(ids, [x.id for x in providers])
+
+    def test_api_v1_cursor_invalid(self):
+        r = self.client.get('/api/v1/providers/?cursor=broken')
+        self.assertEqual(r.status_code, 404)
+
+
+class TestExport(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def expected_features(self):
+        r = self.client.get('/api/v1/service-areas/')
+        return json.loads(r.content.decode('utf-8'))['features']
+
+    def test_api_v1_service_areas_export(self):
+        [self.create_service_area() for _ in range(10)]
+        r = self.client.get('/api/v1/service-areas/export/')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+        self.assertEqual(r['Content-Type'], 'application/geo+json')
+        data = json.loads(b''.join(r.streaming_content).decode('utf-8'))
+        self.assertEqual(data, {
+            'type': 'FeatureCollection',
+            'features': self.expected_features()})
+
+    def test_api_v1_service_areas_export_ndjson(self):
+        s1 = self.create_service_area(P1)
+        self.create_service_area(P2)
+        r = self.client.get('/api/v1/service-areas/export/?output=ndjson'
+                            '&provider_id=%d' % s1.provider_id)
+        self.assertEqual(r.status_code, 200)
+        lines = b''.join(r.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(x)['id'] for x in lines], [s1.id])
+
+    def test_api_v1_service_areas_export_empty(self):
+        r = self.client.get('/api/v1/service-areas/export/')
+        data = json.loads(b''.join(r.streaming_content).decode('utf-8'))
+        self.assertEqual(data, {'type': 'FeatureCollection', 'features': []})
+
+    def test_export_service_areas_command(self):
+        [self.create_service_area() for _ in range(3)]
+        out = StringIO()
+        call_command('export_service_areas', '--ndjson', stdout=out)
+        features = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(features, self.expected_features())
+
+
+class TestImport(ModelFactoryMixin, TestCase):
+    def feature(self, name, poly=P1, price=10, **properties):
+        properties.update(name=name, price=price)
+        return {'type': 'Feature', 'properties': properties,
+                'geometry': json.loads(poly.geojson)}
+
+    def run_import(self, features, *args, ndjson=False):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.ndjson' if ndjson else '.geojson') as fp:
+            if ndjson:
+                fp.write(''.join(json.dumps(x) + '\n' for x in features))
+            else:
+                json.dump({'type': 'FeatureCollection',
+                           'features': features}, fp)
+            fp.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_service_areas', fp.name, *args,
+                         stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_feature_collection(self):
+        provider = self.create_provider(currency='EUR')
+        features = [self.feature('area %d' % i, provider_id=provider.id)
+                    for i in range(25)]
+        out, err = self.run_import(features, '--batch-size', '10')
+        self.assertIn('25 rows (created 25, updated 0, errors 0)', out)
+        self.assertEqual(err, '')
+        areas = ServiceArea.objects.filter(provider=provider)
+        self.assertEqual(areas.count(), 25)
+        area = areas.get(name='area 7')
+        self.assertEqual(area.poly.coords, P1.coords)
+        self.assertEqual(area.price.amount, 10)
+        self.assertEqual(str(area.price.currency), 'EUR')
+
+    def test_import_ndjson_upsert(self):
+        provider = self.create_provider()
+        old = self.create_service_area(P1, provider=provider, name='same')
+        features = [
+            self.feature('same', P2, price='12.5', price_currency='RUB'),
+            self.feature('new', P2),
+            self.feature('broken', Polygon(
+                ((0, 0), (10, 10), (10, 0), (0, 10), (0, 0)))),
+            self.feature('unknown currency', price_currency='???'),
+        ]
+        out, err = self.run_import(
+            features, '--provider-id', str(provider.id), '--upsert',
+            ndjson=True)
+        self.assertIn('created 1, updated 1, errors 2', out)
+        self.assertIn('feature #2: invalid polygon: it splits into 2 polygons',
+                      err)
+        self.assertIn('feature #3: invalid price_currency', err)
+        old.refresh_from_db()
+        self.assertEqual(old.poly.coords, P2.coords)
+        self.assertEqual(old.price.amount, Decimal('12.5'))
+        self.assertEqual(str(old.price.currency), 'RUB')
+        self.assertEqual(
+            sorted(provider.servicearea_set.values_list('name', flat=True)),
+            ['new', 'same'])
+
+    def test_import_malformed_features(self):
+        provider = self.create_provider()
+        features = [
+            dict(self.feature('x'), properties=['name', 'x']),
+            self.feature(12),
+            self.feature('list currency', price_currency=['USD']),
+            dict(self.feature('bad coordinates'),
+                 geometry={'type': 'Polygon', 'coordinates': 'x'}),
+            self.feature('ok'),
+        ]
+        out, err = self.run_import(
+            features, '--provider-id', str(provider.id))
+        self.assertIn('created 1, updated 0, errors 4', out)
+        self.assertIn('feature #0: invalid properties', err)
+        self.assertIn('feature #1: invalid name', err)
+        self.assertIn('feature #2: invalid price_currency', err)
+        self.assertIn('feature #3: invalid geometry', err)
+
+    def test_import_rejected_polygons(self):
+        provider = self.create_provider()
+        bowtie = Polygon(((0, 0), (10, 10), (10, 0), (0, 10), (0, 0)))
+        features = [self.feature('bowtie 1', bowtie), self.feature('ok'),
+                    self.feature('bowtie 2', bowtie)]
+        out, err = self.run_import(
+            features, '--provider-id', str(provider.id))
+        self.assertIn('created 1, updated 0, errors 2', out)
+        self.assertIn('feature #0: invalid polygon', err)
+        self.assertIn('feature #2: invalid polygon', err)
+        self.assertEqual(
+            list(provider.servicearea_set.values_list('name', flat=True)),
+            ['ok'])
+
+    @override_settings(GEOAPI_NORMALIZE_POLYGONS=False)
+    def test_import_invalid_geometry(self):
+        provider = self.create_provider()
+        features = [self.feature('broken', Polygon(
+            ((0, 0), (10, 10), (10, 0), (0, 10), (0, 0))))]
+        out, err = self.run_import(
+            features, '--provider-id', str(provider.id))
+        self.assertIn('created 0, updated 0, errors 1', out)
+        self.assertIn('feature #0: invalid geometry', err)
+
+    def test_iter_feature_collection(self):
+        features = [self.feature('area %d' % i) for i in range(5)]
+        features[2]['properties']['note'] = 'x' * 1000
+        text = json.dumps({'type': 'FeatureCollection',
+                           'features': features})
+        self.assertEqual(
+            list(iter_feature_collection(StringIO(text), read_size=7)),
+            features)
+        with self.assertRaisesRegex(ValueError, 'longer than 500'):
+            list(iter_feature_collection(
+                StringIO(text), read_size=7, max_size=500))
+        broken = StringIO('{"features": [{"a": 1}, {"a": ]' + ' ' * 5000)
+        with self.assertRaises(ValueError):
+            list(iter_feature_collection(broken, read_size=7))
+
+
+class TestBatchLookup(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_api_v1_service_areas_lookup(self):
+        s1 = self.create_service_area(P1, price=10)
+        s2 = self.create_service_area(P2, price=20)
+        [self.create_service_area() for _ in range(10)]
+
+        r = self.client.post('/api/v1/service-areas/lookup/', [
+            {'type': 'Point',
+             'coordinates': [9.26436996459961, 10.564178042345375]},
+            {'type': 'Point', 'coordinates': [100, 100]},
+            {'type': 'Point', 'coordinates': [0, 0]},
+        ], format='json')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            [[x['id'] for x in res['areas']] for res in r.data['results']],
+            [[s1.id, s2.id], [], [s1.id]])
+        self.assertEqual(r.data['results'][0]['areas'][1], {
+            'id': s2.id, 'name': s2.name, 'provider': s2.provider.name,
+            'price': '20.00000000', 'price_currency': 'XYZ'})
+
+    def test_api_v1_service_areas_lookup_ndjson_with_provider_id(self):
+        self.create_service_area(P1)
+        s2 = self.create_service_area(P2)
+
+        body = '{"type":"Point","coordinates":[9.26,10.56]}\n' \
+               '{"type":"Point","coordinates":[0,0]}\n'
+        r = self.client.post(
+            '/api/v1/service-areas/lookup/?provider_id=%d' % s2.provider_id,
+            body, content_type='application/x-ndjson')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            [[x['id'] for x in res['areas']] for res in r.data['results']],
+            [[s2.id], []])
+
+    def test_api_v1_service_areas_lookup_format_error(self):
+        r = self.client.post('/api/v1/service-areas/lookup/', [
+            {'type': 'Point', 'coordinates': [0, 0]},
+            {'type': 'Polygon', 'coordinates': [0, 0]},
+        ], format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.data, [
+            'invalid points[1]: invalid type! only Point type allowed'])
+
+    @override_settings(GEOAPI_BATCH_LOOKUP_MAX_POINTS=2)
+    def test_api_v1_service_areas_lookup_too_many_points(self):
+        r = self.client.post('/api/v1/service-areas/lookup/', [
+            {'type': 'Point', 'coordinates': [0, 0]}] * 3, format='json')
+        self.assertEqual(r.status_code, 400)
+
+
+class TestBulk(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def item(self, provider, name, poly=P1, **values):
+        values.setdefault('provider_id', provider.id)
+        values.update(name=name, poly=json.loads(poly.geojson))
+        return values
+
+    def test_api_v1_service_areas_bulk_create(self):
+        providers = [self.create_provider() for _ in range(3)]
+        items = [self.item(providers[i % 3], 'area %d' % i, price=i + 1)
+                 for i in range(30)]
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.post('/api/v1/service-areas/bulk/', items,
+                                 format='json')
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(r.data['features']), 30)
+        self.assertEqual(r.data['errors'], [])
+        self.assertLess(len(queries), 10)
+        self.assertEqual(ServiceArea.objects.count(), 30)
+        area = ServiceArea.objects.get(name='area 4')
+        self.assertEqual(area.provider, providers[1])
+        self.assertEqual(area.price.amount, 5)
+
+    def test_api_v1_service_areas_bulk_update(self):
+        s1 = self.create_service_area(P1, name='s1')
+        s2 = self.create_service_area(P1, name='s2')
+        r = self.client.patch('/api/v1/service-areas/bulk/', {
+            'type': 'FeatureCollection',
+            'features': [
+                {'type': 'Feature', 'id': s1.id,
+                 'properties': {'name': 'renamed'}},
+                {'type': 'Feature', 'id': s2.id, 'properties': {},
+                 'geometry': json.loads(P2.geojson)},
+            ]}, format='json')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        s1.refresh_from_db()
+        s2.refresh_from_db()
+        self.assertEqual(s1.name, 'renamed')
+        self.assertEqual(s1.poly.coords, P1.coords)
+        self.assertEqual(s2.name, 's2')
+        self.assertEqual(s2.poly.coords, P2.coords)
+
+    def test_api_v1_service_areas_bulk_partial_errors(self):
+        provider = self.create_provider()
+        items = [self.item(provider, 'ok'),
+                 self.item(provider, ''),
+                 self.item(provider, 'missing provider', provider_id=0)]
+        r = self.client.post('/api/v1/service-areas/bulk/', items,
+                             format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(r.data), 3)
+        self.assertEqual(ServiceArea.objects.count(), 0)
+
+        r = self.client.post(
+            '/api/v1/service-areas/bulk/?allow_partial=true', items,
+            format='json')
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(r.data['features']), 1)
+        self.assertEqual([x['index'] for x in r.data['errors']], [1, 2])
+        self.assertIn('provider_id', r.data['errors'][1]['errors'])
+        self.assertEqual(
+            list(ServiceArea.objects.values_list('name', flat=True)),
+            ['ok'])
+
+    def test_api_v1_service_areas_bulk_delete(self):
+        areas = [self.create_service_area() for _ in range(3)]
+        r = self.client.delete('/api/v1/service-areas/bulk/',
+                               [areas[0].id, areas[2].id], format='json')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data, {'deleted': 2})
+        self.assertEqual(
+            list(ServiceArea.objects.values_list('id', flat=True)),
+            [areas[1].id])
+
+    @override_settings(GEOAPI_BULK_MAX_ITEMS=2)
+    def test_api_v1_service_areas_bulk_too_many_items(self):
+        provider = self.create_provider()
+        r = self.client.post('/api/v1/service-areas/bulk/',
+                             [self.item(provider, 'x')] * 3, format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(GEOAPI_TILE_CACHE=False)
+class TestTiles(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_tile_bounds_and_range(self):
+        self.assertEqual(tile_bounds(0, 0, 0), (
+            -20037508.342789244, -20037508.342789244,
+            20037508.342789244, 20037508.342789244))
+        self.assertEqual(tile_bounds(1, 1, 0), (
+            0.0, 0.0, 20037508.342789244, 20037508.342789244))
+        self.assertEqual(tile_range(0, P1.extent), (0, 0, 0, 0))
+        self.assertEqual(tile_range(2, (1, 1, 2, 2)), (1, 0, 3, 2))
+
+    def test_api_v1_service_areas_tile(self):
+        self.create_service_area(P1, name='area one')
+        s2 = self.create_service_area(P2, name='area two')
+        r = self.client.get('/api/v1/service-areas/tiles/1/1/0.pbf')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r['Content-Type'],
+                         'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'service_areas', r.content)
+        self.assertIn(b'area one', r.content)
+        self.assertIn(b'area two', r.content)
+
+        r = self.client.get('/api/v1/service-areas/tiles/1/1/0.pbf'
+                            '?provider_id=%d' % s2.provider_id)
+        self.assertNotIn(b'area one', r.content)
+        self.assertIn(b'area two', r.content)
+
+        r = self.client.get('/api/v1/service-areas/tiles/3/0/0.pbf')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, b'')
+
+    def test_api_v1_service_areas_tile_errors(self):
+        r = self.client.get('/api/v1/service-areas/tiles/1/2/0.pbf')
+        self.assertEqual(r.status_code, 404)
+        r = self.client.get('/api/v1/service-areas/tiles/30/0/0.pbf')
+        self.assertEqual(r.status_code, 404)
+        r = self.client.get(
+            '/api/v1/service-areas/tiles/0/0/0.pbf?provider_id=x')
+        self.assertEqual(r.status_code, 400)
+
+
+@override_settings(GEOAPI_LOOKUP_ENGINE='subdivided',
+                   GEOAPI_SUBDIVIDE_MAX_VERTICES=32)
+class TestSubdividedLookup(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_pieces_follow_the_area(self):
+        circle = Point(0, 0).buffer(10, quadsegs=200)
+        area = self.create_service_area(circle)
+        pieces = ServiceAreaPiece.objects.filter(area=area)
+        self.assertGreater(pieces.count(), 10)
+        self.assertTrue(all(len(x.poly.coords[0]) <= 32 for x in pieces))
+        self.assertAlmostEqual(sum(x.poly.area for x in pieces),
+                               circle.area, places=6)
+
+        area.poly = P2
+        area.save()
+        self.assertEqual([x.poly.coords for x in pieces.all()], [P2.coords])
+        area.delete()
+        self.assertFalse(ServiceAreaPiece.objects.exists())
+
+    def test_pieces_only_kept_for_their_engine(self):
+        with override_settings(GEOAPI_LOOKUP_ENGINE='sql'):
+            area = self.create_service_area(P1)
+        self.assertFalse(ServiceAreaPiece.objects.exists())
+        call_command('build_area_pieces', stdout=StringIO())
+        self.assertEqual(
+            [x.poly.coords for x in area.pieces.all()], [P1.coords])
+
+    def test_subdivided_lookup_matches_sql(self):
+        circle = self.create_service_area(
+            Point(0, 0).buffer(10, quadsegs=200))
+        ring = self.create_service_area(Polygon(
+            ((-20, -20), (-20, 20), (20, 20), (20, -20), (-20, -20)),
+            ((-5, -5), (-5, 5), (5, 5), (5, -5), (-5, -5))))
+        points = [(x * 0.5, y * 0.5)
+                  for x in range(-44, 45, 4) for y in range(-44, 45, 4)]
+        points.extend([(0, 0), (10, 0), (5, 5), (-5, 0), (0, 9.99)])
+        with override_settings(GEOAPI_LOOKUP_ENGINE='sql'):
+            expected = [contains_ids(x) for x in points]
+            batch = batch_lookup(points)
+        with override_settings(GEOAPI_LOOKUP_ENGINE='subdivided'):
+            self.assertEqual([contains_ids(x) for x in points], expected)
+            self.assertEqual(batch_lookup(points), batch)
+            r = self.client.get(
+                '/api/v1/service-areas/?poly__contains='
+                '{"type":"Point","coordinates":[7,0]}')
+        self.assertEqual([x['id'] for x in r.data['features']],
+                         [circle.id, ring.id])
+
+
+@override_settings(GEOAPI_LOOKUP_ENGINE='grid', GEOAPI_GRID_LEVEL=6)
+class TestGridLookup(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_grid_cell(self):
+        self.assertEqual(grid_cell(-180, -90, level=0), 0)
+        self.assertEqual(grid_cell(179.9, 89.9, level=0), 0)
+        self.assertEqual(grid_cell(180, 90, level=0), 3)
+        self.assertEqual(grid_cell(0, 0, level=1), (1 << 56) + 3 + 1)
+        self.assertNotEqual(grid_cell(0, 0, level=2),
+                            grid_cell(0, 0, level=1))
+        self.assertIsNone(grid_cell(180.1, 0, level=1))
+        self.assertIsNone(grid_cell(0, -91, level=1))
+
+    def test_cells_stop_at_the_edge(self):
+        # crosses the antimeridian: a column past 180 would be the cell
+        # at the west edge of the next row
+        area = self.create_service_area(
+            Polygon.from_bbox((170, -10, 190, 10)))
+        columns = 2 ** 6 + 1
+        for cell in area.cells.values_list('cell', flat=True):
+            self.assertGreaterEqual((cell - (6 << 56)) % columns, 62)
+        with override_settings(GEOAPI_LOOKUP_ENGINE='grid'):
+            for point in [(-179.9, 10.1), (-179.9, 0), (185, 0)]:
+                self.assertEqual(contains_ids(point), [])
+            self.assertEqual(contains_ids((175, 0)), [area.id])
+
+    def test_non_finite_point(self):
+        r = self.client.get('/api/v1/service-areas/', {
+            'poly__contains': '{"type":"Point","coordinates":["nan",0]}'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_cells_follow_the_area(self):
+        area = self.create_service_area(Point(0, 0).buffer(10, quadsegs=64))
+        cells = AreaCell.objects.filter(area=area)
+        self.assertIn(grid_cell(0, 0), [x.cell for x in cells])
+        self.assertTrue(cells.get(cell=grid_cell(0.1, 0.1)).interior)
+        self.assertFalse(cells.get(cell=grid_cell(9.9, 0.1)).interior)
+        self.assertFalse(cells.filter(cell=grid_cell(20, 0)).exists())
+
+        area.poly = P2
+        area.save()
+        other = self.create_service_area(P2)
+        self.assertEqual(
+            sorted(cells.values_list('cell', 'interior')),
+            sorted(other.cells.values_list('cell', 'interior')))
+        area.delete()
+        other.delete()
+        self.assertFalse(AreaCell.objects.exists())
+
+    def test_cells_only_kept_for_their_engine(self):
+        with override_settings(GEOAPI_LOOKUP_ENGINE='sql'):
+            area = self.create_service_area(P1)
+        self.assertFalse(AreaCell.objects.exists())
+        call_command('build_area_cells', stdout=StringIO())
+        self.assertTrue(area.cells.exists())
+
+    def test_grid_lookup_matches_sql(self):
+        circle = self.create_service_area(
+            Point(0, 0).buffer(10, quadsegs=200))
+        ring = self.create_service_area(Polygon(
+            ((-20, -20), (-20, 20), (20, 20), (20, -20), (-20, -20)),
+            ((-5, -5), (-5, 5), (5, 5), (5, -5), (-5, -5))))
+        points = [(x * 0.5, y * 0.5)
+                  for x in range(-44, 45, 4) for y in range(-44, 45, 4)]
+        points.extend([(0, 0), (10, 0), (5, 5), (-5, 0), (0, 9.99)])
+        with override_settings(GEOAPI_LOOKUP_ENGINE='sql'):
+            expected = [contains_ids(x) for x in points]
+            batch = batch_lookup(points)
+        with override_settings(GEOAPI_LOOKUP_ENGINE='grid'):
+            self.assertEqual([contains_ids(x) for x in points], expected)
+            self.assertEqual(batch_lookup(points), batch)
+            r = self.client.get(
+                '/api/v1/service-areas/?poly__contains='
+                '{"type":"Point","coordinates":[7,0]}')
+        self.assertEqual([x['id'] for x in r.data['features']],
+                         [circle.id, ring.id])
+
+
+class TestNearLookup(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def square(self, x, size=1):
+        return self.create_service_area(Polygon(
+            ((x, 0), (x, size), (x + size, size), (x + size, 0), (x, 0))))
+
+    def test_api_v1_areas_near(self):
+        far = self.square(3)
+        inside = self.square(-0.5)
+        near = self.square(1)
+        r = self.client.get('/api/v1/service-areas/?near=0,0.5')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.data['type'], 'FeatureCollection')
+        features = r.data['features']
+        self.assertEqual([x['id'] for x in features],
+                         [inside.id, near.id, far.id])
+        distances = [x['properties']['distance'] for x in features]
+        self.assertEqual(distances[0], 0)
+        # one degree of longitude on the equator, on the sphere
+        self.assertAlmostEqual(distances[1], 111195, delta=200)
+        self.assertAlmostEqual(distances[2], 3 * 111195, delta=600)
+
+        r = self.client.get(
+            '/api/v1/service-areas/?near=0,0.5&radius=200000&fields=name')
+        self.assertEqual([x['id'] for x in r.data['features']],
+                         [inside.id, near.id])
+        self.assertEqual(set(r.data['features'][0]['properties']),
+                         {'name', 'distance'})
+        r = self.client.get('/api/v1/service-areas/?near=0,0.5&limit=1')
+        self.assertEqual([x['id'] for x in r.data['features']], [inside.id])
+        r = self.client.get(
+            '/api/v1/service-areas/?near=0,0.5&provider_id=%d'
+            % far.provider_id)
+        self.assertEqual([x['id'] for x in r.data['features']], [far.id])
+
+    def test_api_v1_areas_near_errors(self):
+        for query in ('near=0', 'near=x,y', 'near=200,0',
+                      'near=0,0&radius=-1', 'near=0,0&limit=0',
+                      'near=0,0&limit=1000'):
+            r = self.client.get('/api/v1/service-areas/?' + query)
+            self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST,
+                             query)
+
+
+class TestFilters(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def ids(self, url):
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        items = r.data['features'] if 'features' in r.data \
+            else r.data['results']
+        return [x['id'] for x in items]
+
+    def test_api_v1_areas_filters(self):
+        cheap = self.create_service_area(P1, name='Cheap', price=5)
+        usd = self.create_service_area(P1, name='Dollar',
+                                       price=Money(50, 'USD'))
+        dear = self.create_service_area(P2, name='Dear', price=500)
+        url = '/api/v1/service-areas/?'
+        self.assertEqual(self.ids(url + 'price__gte=10'), [usd.id, dear.id])
+        self.assertEqual(self.ids(url + 'price__gte=10&price__lte=100'),
+                         [usd.id])
+        self.assertEqual(self.ids(url + 'price_currency=USD'), [usd.id])
+        self.assertEqual(self.ids(url + 'name__startswith=De'), [dear.id])
+        self.assertEqual(
+            self.ids(url + 'updated__gte=' + usd.updated.isoformat()
+                     .replace('+', '%2B')), [usd.id, dear.id])
+        self.assertEqual(
+            self.ids(url + 'price__lte=100&poly__contains='
+                     '{"type":"Point","coordinates":[9.26,10.56]}'),
+            [cheap.id, usd.id])
+        for query in ('price__gte=x', 'price_currency=???',
+                      'updated__gte=yesterday'):
+            r = self.client.get(url + query)
+            self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST,
+                             query)
+
+    def test_api_v1_providers_filters(self):
+        en = self.create_provider(language='en', currency='USD')
+        ru = self.create_provider(language='ru', currency='EUR')
+        url = '/api/v1/providers/?'
+        self.assertEqual(self.ids(url + 'language=en'), [en.id])
+        self.assertEqual(self.ids(url + 'currency=EUR'), [ru.id])
+        self.assertEqual(self.ids(url + 'language=en&currency=EUR'), [])
+
+    @override_settings(GEOAPI_LOOKUP_ENGINE='sql',
+                       GEOAPI_LOOKUP_CACHE=False)
+    def test_filters_use_indexes(self):
+        # enough rows for a seq scan to cost more than the index, every
+        # area contains (5, 5) so only (provider_id, poly) is selective
+        providers = Provider.objects.bulk_create(
+            Provider(name='provider %d' % i,
+                     language='en' if i % 50 == 0 else 'de',
+                     currency='EUR' if i % 50 == 0 else 'USD')
+            for i in range(2000))
+        ServiceArea.objects.bulk_create(
+            ServiceArea(provider=providers[i % len(providers)],
+                        name='area %d' % i,
+                        poly=Polygon.from_bbox((0, 0, 10, 10)),
+                        xmin=0, ymin=0, xmax=10, ymax=10,
+                        price=Money(i + 1, 'USD' if i % 50 else 'EUR'))
+            for i in range(5000))
+        provider_id = providers[0].id
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE geoapi_provider')
+            cursor.execute('ANALYZE geoapi_servicearea')
+        contains = '&poly__contains={"type":"Point","coordinates":[5,5]}'
+        urls = [
+            ('/api/v1/service-areas/?price__gte=10&price__lte=20',
+             'geoapi_area_price_idx'),
+            ('/api/v1/service-areas/?price_currency=EUR&price__lte=200',
+             'geoapi_area_currency_idx'),
+            ('/api/v1/service-areas/?name__startswith=area%2042',
+             'geoapi_servicearea_name_'),
+            ('/api/v1/service-areas/?updated__gte=2030-01-01T00:00:00Z',
+             'geoapi_area_changes_idx'),
+            ('/api/v1/service-areas/?provider_id=%d' % provider_id +
+             contains, 'geoapi_area_provider_poly_idx'),
+            ('/api/v1/service-areas/?price__lte=20' + contains,
+             'geoapi_area_price_idx'),
+            ('/api/v1/providers/?language=en',
+             'geoapi_provider_language_idx'),
+            ('/api/v1/providers/?currency=EUR',
+             'geoapi_provider_currency_idx'),
+        ]
+        for url, index in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code,
+                                 status.HTTP_200_OK)
+            plans = []
+            with connection.cursor() as cursor:
+                for query in queries:
+                    if not query['sql'].startswith('SELECT'):
+                        continue
+                    cursor.execute('EXPLAIN ' + query['sql'])
+                    plans.extend(x[0] for x in cursor.fetchall())
+            self.assertIn(index, '\n'.join(plans), url)
+
+
+def ring_area(ring):
+    """ Signed area of a ring, > 0 when it is counter-clockwise """
+    return sum(x1 * y2 - x2 * y1
+               for (x1, y1), (x2, y2) in zip(ring, ring[1:])) / 2
+
+
+class TestNormalize(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def test_normalized_on_save(self):
+        # clockwise, a repeated point, a collinear point and a spike
+        area = self.create_service_area(Polygon(
+            ((0, 0), (0, 1), (0, 1), (0.5, 1), (0.5, 1.5), (0.5, 1),
+             (1, 1), (1, 0.5), (1, 0), (0, 0))))
+        area.refresh_from_db()
+        self.assertTrue(area.poly.valid)
+        self.assertEqual(sorted(area.poly.coords[0][:-1]),
+                         [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertGreater(ring_area(area.poly.coords[0]), 0)
+        self.assertEqual(area.vertex_count, 5)
+        # one square degree on the equator
+        self.assertAlmostEqual(area.area_m2, 1.23088e10, delta=1e7)
+        self.assertEqual(area.bbox, (0, 0, 1, 1))
+
+        area.poly = P1
+        area.save(update_fields=['poly'])
+        area.refresh_from_db()
+        self.assertEqual(area.poly.coords, P1.coords)
+        self.assertEqual(area.vertex_count, len(P1.coords[0]))
+
+    @override_settings(GEOAPI_NORMALIZE_POLYGONS=False)
+    def test_normalize_disabled(self):
+        poly = Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
+        area = self.create_service_area(poly)
+        area.refresh_from_db()
+        self.assertEqual(area.poly.coords, poly.coords)
+        self.assertEqual(area.vertex_count, 5)
+
+    @override_settings(GEOAPI_MAX_VERTICES=64)
+    def test_vertex_budget(self):
+        circle = Point(0, 0).buffer(10, quadsegs=200)
+        area = self.create_service_area(circle)
+        area.refresh_from_db()
+        self.assertLessEqual(area.vertex_count, 64)
+        self.assertEqual(area.vertex_count, area.poly.num_points)
+        self.assertTrue(area.poly.valid)
+        self.assertAlmostEqual(area.poly.area, circle.area, delta=3)
+
+    @override_settings(GEOAPI_MAX_VERTICES=8)
+    def test_vertex_budget_is_best_effort(self):
+        circle = Point(0, 0).buffer(10, quadsegs=200)
+        with self.assertLogs('geoapi.normalize', 'WARNING'):
+            area = self.create_service_area(circle)
+        self.assertGreater(area.vertex_count, 8)
+        self.assertLess(area.vertex_count, circle.num_points)
+
+    def test_api_v1_service_areas_invalid_polygon(self):
+        provider = self.create_provider()
+        bowtie = {'type': 'Polygon', 'coordinates': [
+            [[0, 0], [10, 10], [10, 0], [0, 10], [0, 0]]]}
+        r = self.client.post('/api/v1/service-areas/', {
+            'poly': bowtie, 'provider_id': provider.id, 'name': 'bowtie',
+            'price': 1}, format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('splits into 2 polygons', r.data['poly'][0])
+
+        items = [{'poly': json.loads(poly.geojson), 'name': str(i),
+                  'price': 1, 'provider_id': provider.id}
+                 for i, poly in enumerate([P1, P2])]
+        items.insert(1, dict(items[0], poly=bowtie))
+        r = self.client.post('/api/v1/service-areas/bulk/', items,
+                             format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(r.data[0]['index'], 1)
+        self.assertFalse(ServiceArea.objects.exists())
+
+
+@override_settings(GEOAPI_CHANGES_LAG=0)
+class TestChangeFeed(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def changes(self, url, **params):
+        r = self.client.get(url, params)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        return r.data
+
+    @override_settings(GEOAPI_CHANGES_PAGE_SIZE=2)
+    def test_api_v1_providers_changes(self):
+        url = '/api/v1/providers/changes/'
+        providers = [self.create_provider() for _ in range(3)]
+        with self.assertNumQueries(2):
+            data = self.changes(url)
+        self.assertEqual([x['id'] for x in data['changed']],
+                         [x.id for x in providers[:2]])
+        self.assertEqual(data['deleted'], [])
+        self.assertTrue(data['more'])
+        data = self.changes(url, cursor=data['next'])
+        self.assertEqual([x['id'] for x in data['changed']],
+                         [providers[2].id])
+        self.assertFalse(data['more'])
+        cursor = data['next']
+        data = self.changes(url, cursor=cursor)
+        self.assertEqual((data['changed'], data['deleted']), ([], []))
+        self.assertEqual(data['next'], cursor)
+
+        providers[0].name = 'renamed'
+        providers[0].save()
+        deleted = providers[1].id
+        providers[1].delete()
+        data = self.changes(url, cursor=cursor)
+        self.assertEqual([(x['id'], x['name']) for x in data['changed']],
+                         [(providers[0].id, 'renamed')])
+        self.assertEqual(data['deleted'], [deleted])
+        data = self.changes(url, cursor=data['next'])
+        self.assertEqual((data['changed'], data['deleted']), ([], []))
+
+    def test_api_v1_service_areas_changes(self):
+        url = '/api/v1/service-areas/changes/'
+        since = timezone.now()
+        area = self.create_service_area(P1)
+        data = self.changes(url, updated_since=since.isoformat())
+        self.assertEqual([x['id'] for x in data['changed']['features']],
+                         [area.id])
+        self.assertEqual(data['changed']['features'][0]['geometry'],
+                         GeoJsonDict(json.loads(P1.geojson)))
+        data = self.changes(url, cursor=data['next'], fields='name',
+                            geometry='none')
+        self.assertEqual(data['changed']['features'], [])
+
+        other = self.create_service_area(P2, provider=area.provider)
+        area.provider.delete()
+        data = self.changes(url, cursor=data['next'])
+        self.assertEqual(data['changed']['features'], [])
+        self.assertEqual(sorted(data['deleted']), sorted([area.id, other.id]))
+        self.assertEqual(Tombstone.objects.filter(kind='provider').count(), 1)
+
+    def test_api_v1_service_areas_changes_follow_providers(self):
+        url = '/api/v1/service-areas/changes/'
+        area = self.create_service_area(P1)
+        other = self.create_service_area(P2)
+        data = self.changes(url)
+        self.assertEqual([x['id'] for x in data['changed']['features']],
+                         [area.id, other.id])
+        area.provider.name = 'renamed'
+        area.provider.save()
+        data = self.changes(url, cursor=data['next'])
+        features = data['changed']['features']
+        self.assertEqual([x['id'] for x in features], [area.id])
+        self.assertEqual(features[0]['properties']['provider']['name'],
+                         'renamed')
+        data = self.changes(url, cursor=data['next'])
+        self.assertEqual(data['changed']['features'], [])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_changes_read_from_the_primary(self):
+        # `replica1` is not a real database, reads must stay on default
+        provider = self.create_provider()
+        for url in ['/api/v1/providers/changes/',
+                    '/api/v1/service-areas/changes/']:
+            self.changes(url)
+        data = self.changes('/api/v1/providers/changes/')
+        self.assertEqual([x['id'] for x in data['changed']], [provider.id])
+
+    @override_settings(GEOAPI_CHANGES_LAG=60)
+    def test_recent_changes_wait(self):
+        self.create_provider()
+        data = self.changes('/api/v1/providers/changes/')
+        self.assertEqual(data['changed'], [])
+
+    @override_settings(GEOAPI_TOMBSTONE_DAYS=1)
+    def test_invalid_cursors(self):
+        url = '/api/v1/providers/changes/'
+        for params in [{'cursor': 'x'}, {'cursor': 'MS4y'},
+                       {'updated_since': 'yesterday'}]:
+            r = self.client.get(url, params)
+            self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        r = self.client.get(url, {'updated_since': '2017-01-01T00:00:00Z'})
+        self.assertEqual(r.status_code, status.HTTP_410_GONE)
+
+        old = Tombstone.objects.create(kind='provider', object_id=1)
+        Tombstone.objects.filter(id=old.id).update(
+            deleted=timezone.now() - timedelta(days=2))
+        Tombstone.objects.create(kind='provider', object_id=2)
+        call_command('purge_tombstones', stdout=StringIO())
+        self.assertEqual(
+            list(Tombstone.objects.values_list('object_id', flat=True)), [2])
+
+
+class TestAreaIndex(ModelFactoryMixin, TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        area_index.clear()
+
+    def test_polygon_contains_respects_holes_and_boundary(self):
+        coords, rings, _ = flatten_polygon(Polygon(
+            ((0, 0), (0, 10), (10, 10), (10, 0), (0, 0)),
+            ((4, 4), (4, 6), (6, 6), (6, 4), (4, 4))))
+        self.assertTrue(polygon_contains(coords, rings, 1, 1))
+        self.assertFalse(polygon_contains(coords, rings, 5, 5))
+        self.assertFalse(polygon_contains(coords, rings, 0, 5))
+        self.assertFalse(polygon_contains(coords, rings, 4, 5))
+        self.assertFalse(polygon_contains(coords, rings, 11, 5))
+
+    def test_str_tree_query(self):
+        boxes = [(x, y, x + 1.5, y + 1.5)
+                 for x in range(40) for y in range(40)]
+        tree = STRTree(boxes, node_capacity=4)
+        self.assertGreater(len(tree.levels), 2)
+        found = sorted(boxes[i] for i in tree.query(10.25, 20.25))
+        self.assertEqual(found, [
+            (9, 19, 10.5, 20.5), (9, 20, 10.5, 21.5),
+            (10, 19, 11.5, 20.5), (10, 20, 11.5, 21.5)])
+        self.assertEqual(list(tree.query(-5, -5)), [])
+
+    def test_query_matches_sql(self):
+        s1 = self.create_service_area(P1)
+        s2 = self.create_service_area(P2)
+        [self.create_service_area() for _ in range(10)]
+        for x, y in [(9.26436996459961, 10.564178042345375), (5, 5),
+                     (20, 5), (-10, 14), (100, 100)]:
+            expected = list(ServiceArea.objects.filter(
+                poly__contains='POINT(%s %s)' % (x, y)
+            ).values_list('id', flat=True))
+            self.assertEqual(area_index.query(x, y), expected)
+        self.assertEqual(area_index.query(
+            9.26436996459961, 10.564178042345375, s2.provider_id), [s2.id])
+        self.assertEqual(area_index.query(
+            9.26436996459961, 10.564178042345375, s1.provider_id), [s1.id])
+
+    def test_update_and_remove(self):
+        s1 = self.create_service_area(P1)
+        self.assertEqual(area_index.query(0, 0), [s1.id])
+        s1.poly = P2
+        area_index.update(s1)
+        self.assertEqual(area_index.query(0, 0), [])
+        self.assertEqual(area_index.query(10, 10), [s1.id])
+        area_index.remove(s1.id)
+        self.assertEqual(area_index.query(10, 10), [])
+
+    def test_snapshot(self):
+        s1 = self.create_service_area(P1, price=12)
+        s2 = self.create_service_area(P2)
+        point = (9.26436996459961, 10.564178042345375)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.bin')
+            self.assertEqual(write_snapshot(path, node_capacity=4), 2)
+            snapshot = Snapshot(path)
+            self.assertEqual(snapshot.updated,
+                             ServiceArea.objects.get(id=s2.id).updated)
+            currency = ServiceArea.objects.values_list(
+                'price_currency', flat=True).get(id=s1.id)
+            self.assertEqual(snapshot.describe(snapshot.position(s1.id)),
+                             (s1.id, s1.provider_id, s1.name, '12.00000000',
+                              currency))
+            self.assertIsNone(snapshot.position(s2.id + 1))
+
+            with override_settings(GEOAPI_INDEX_SNAPSHOT=path):
+                self.assertEqual(area_index.query(*point), [s1.id, s2.id])
+                self.assertIsInstance(area_index._tree_areas, Snapshot)
+                # saved after the snapshot: loaded from the database
+                s3 = self.create_service_area(P2)
+                area_index.clear()
+                self.assertEqual(area_index.query(*point),
+                                 [s1.id, s2.id, s3.id])
+                self.assertIsNotNone(area_index._snapshot)
+                with override_settings(GEOAPI_LOOKUP_ENGINE='index'):
+                    batch = batch_lookup([point])
+                with override_settings(GEOAPI_LOOKUP_ENGINE='sql'):
+                    self.assertEqual(batch_lookup([point]), batch)
+                # deleted after the snapshot: masked by its tombstone
+                s1.delete()
+                area_index.clear()
+                self.assertEqual(area_index.query(*point), [s2.id, s3.id])
+                self.assertIsNotNone(area_index._snapshot)
+
+    def test_snapshot_with_late_row_and_delete(self):
+        s1 = self.create_service_area(P1)
+        s2 = self.create_service_area(P2)
+        point = (9.26436996459961, 10.564178042345375)
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(GEOAPI_INDEX_SNAPSHOT=directory + '/i'):
+            write_snapshot(settings.GEOAPI_INDEX_SNAPSHOT)
+            # committed during the build with an older `updated`...
+            late = self.create_service_area(P2)
+            ServiceArea.objects.filter(id=late.id).update(
+                updated=s2.updated - timedelta(seconds=30))
+            # ...and a delete
+            s1.delete()
+            area_index.clear()
+            self.assertEqual(area_index.query(*point), [s2.id, late.id])
+            self.assertIsNotNone(area_index._snapshot)
+
+    @override_settings(GEOAPI_TOMBSTONE_DAYS=1)
+    def test_snapshot_older_than_tombstones(self):
+        area = self.create_service_area(P1)
+        ServiceArea.objects.filter(id=area.id).update(
+            updated=timezone.now() - timedelta(days=2))
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(GEOAPI_INDEX_SNAPSHOT=directory + '/i'):
+            write_snapshot(settings.GEOAPI_INDEX_SNAPSHOT)
+            self.assertEqual(area_index.query(0, 0), [area.id])
+            self.assertIsNone(area_index._snapshot)
+
+    @override_settings(GEOAPI_INDEX_CHECK_INTERVAL=0)
+    def test_changes_of_other_processes(self):
+        s1 = self.create_service_area(P1)
+        self.assertEqual(area_index.query(0, 0), [s1.id])
+        tree = area_index._tree
+        # written by another process: no `update`/`remove` here
+        ServiceArea.objects.filter(id=s1.id).update(
+            poly=P2, updated=timezone.now())
+        s2 = self.create_service_area(P1)
+        self.assertEqual(area_index.query(0, 0), [s2.id])
+        self.assertEqual(area_index.query(10, 10), [s1.id])
+        ServiceArea.objects.filter(id=s1.id).delete()
+        self.assertEqual(area_index.query(10, 10), [])
+        self.assertIs(area_index._tree, tree)
+
+    @override_settings(GEOAPI_LOOKUP_ENGINE='index')
+    def test_api_v1_areas_filter_by_poly_contains_with_index(self):
+        s1 = self.create_service_area(P1)
+        s2 = self.create_service_area(P2)
+        [self.create_service_area() for _ in range(10)]
+
+        filters = 'poly__contains={"type":"Point","coordinates":' \
+                  '[9.26436996459961,10.564178042345375]}'
+        r = self.client.get('/api/v1/service-areas/?' + filters)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(set([x['id'] for x in r.data['features']]), {
+            s1.id, s2.id
+        })
+
+        r = self.client.get('/api/v1/service-areas/?' + filters +
+                            '&provider_id=' + str(s2.provider_id))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([x['id'] for x in r.data['features']], [s2.id])
+
+
+class TestLookupCache(ModelFactoryMixin, TransactionTestCase):
+    client_class = APIClient
+
+    def test_geohash(self):
+        self.assertEqual(geohash(-5.6, 42.6, 5), 'ezs42')
+        self.assertEqual(geohash(10.40744, 57.64911, 11), 'u4pruydqqvj')
+
+    @override_settings(GEOAPI_LOOKUP_CACHE_KEY='decimal',
+                       GEOAPI_LOOKUP_CACHE_PRECISION=3)
+    def test_quantize(self):
+        self.assertEqual(quantize((9.26436996459961, 10.564178042345375)),
+                         '9.264,10.564')
+
+    @skipUnless(REDIS, 'Redis is not running')
+    @override_settings(GEOAPI_LOOKUP_CACHE=True)
+    def test_api_v1_areas_filter_by_poly_contains_cached(self):
+        s1 = self.create_service_area(P1)
+        filters = 'poly__contains={"type":"Point","coordinates":' \
+                  '[9.26436996459961,10.564178042345375]}'
+
+        before = lookup_cache.stats()
+        r = self.client.get('/api/v1/service-areas/?' + filters)
+        self.assertEqual([x['id'] for x in r.data['features']], [s1.id])
+        r = self.client.get('/api/v1/service-areas/?' + filters)
+        self.assertEqual([x['id'] for x in r.data['features']], [s1.id])
+        after = lookup_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+        s2 = self.create_service_area(P2)
+        r = self.client.get('/api/v1/service-areas/?' + filters)
+        self.assertEqual([x['id'] for x in r.data['features']],
+                         [s1.id, s2.id])
+
+    @skipUnless(REDIS, 'Redis is not running')
+    @override_settings(GEOAPI_LOOKUP_CACHE=True)
+    def test_write_keeps_other_providers_lookups(self):
+        s1 = self.create_service_area(P1)
+        s2 = self.create_service_area(P2)
+        filters = 'poly__contains={"type":"Point","coordinates":' \
+                  '[9.26436996459961,10.564178042345375]}&provider_id=%d'
+        url = '/api/v1/service-areas/?' + filters % s1.provider_id
+        self.client.get(url)
+        s2.name = 'renamed'
+        s2.save()
+        before = lookup_cache.stats()
+        r = self.client.get(url)
+        self.assertEqual([x['id'] for x in r.data['features']], [s1.id])
+        after = lookup_cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+
+@skipUnless(REDIS, 'Redis is not running')
+@override_settings(GEOAPI_TILE_CACHE=True)
+class TestTileCache(ModelFactoryMixin, TransactionTestCase):
+    client_class = APIClient
+
+    def test_api_v1_service_areas_tile_invalidation(self):
+        tile_cache.flush()
+        area = self.create_service_area(P1, name='before')
+        url = '/api/v1/service-areas/tiles/4/8/7.pbf'
+        self.assertIn(b'before', self.client.get(url).content)
+        with self.assertNumQueries(0):
+            self.assertIn(b'before', self.client.get(url).content)
+
+        area.name = 'after'
+        area.save()
+        self.assertIn(b'after', self.client.get(url).content)
+
+        area.poly = Polygon.from_bbox((100, 40, 101, 41))
+        area.save()
+        self.assertEqual(self.client.get(url).content, b'')
+
+    def test_tile_rendered_before_invalidation_is_not_served(self):
+        tile_cache.flush()
+        area = self.create_service_area(P1, name='before')
+        client = get_redis()
+        # a request which missed the cache and rendered `before`...
+        key, tile = tile_cache._lookup(client, 4, 8, 7, '')
+        self.assertIsNone(tile)
+        stale = render_tile(4, 8, 7)
+        area.name = 'after'
+        area.save()
+        # ...stores it only after the change was invalidated
+        client.hset(key, '', stale)
+        self.assertIn(b'after', tile_cache.get_or_render(4, 8, 7))
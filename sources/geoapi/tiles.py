@@ -0,0 +1,193 @@
+"""
+Mapbox Vector Tiles of service areas rendered by PostGIS
+(`ST_AsMVT`/`ST_AsMVTGeom`, PostGIS 2.4+) and cached in Redis.
+
+Every cached tile is a Redis hash (one field per `provider_id` filter)
+under a key which includes the generation of its zoom level and the
+version of the tile. A changed area bumps the versions of the tiles its
+old and new bboxes touch; when that is more than
+`GEOAPI_TILE_INVALIDATE_MAX_TILES` tiles of a zoom level the whole level
+is dropped by bumping its generation. A tile rendered from data read
+before the bump is written under the old key, which is never read again
+and expires. Cached tiles are rendered from the primary, a lagging
+replica could still show the area as it was before the bump.
+"""
+import logging
+import math
+
+import redis
+from django.conf import settings
+from django.db import connections, router
+
+from .cache import get_redis
+from .models import ServiceArea
+
+logger = logging.getLogger(__name__)
+
+LAYER_NAME = 'service_areas'
+# half of the EPSG:3857 world width
+WORLD_SIZE = 20037508.342789244
+MAX_LATITUDE = 85.0511287798066
+
+TILE_SQL = """
+SELECT ST_AsMVT(t, %s, %s, 'geom') FROM (
+  SELECT a.id, a.name, a.provider_id, a.price::float8 AS price,
+         a.price_currency,
+         ST_AsMVTGeom(ST_Transform(a.poly, 3857),
+                      ST_MakeEnvelope(%s, %s, %s, %s, 3857),
+                      %s, %s, true) AS geom
+  FROM {area} a
+  WHERE a.poly && ST_Transform(
+    ST_MakeEnvelope(%s, %s, %s, %s, 3857), 4326)
+  {where}
+) t
+WHERE t.geom IS NOT NULL
+"""
+
+# Resolve the key of the zoom level generation and the tile version
+# and read the tile in a single round trip.
+LOOKUP_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+local version = redis.call('GET', KEYS[2]) or '0'
+local key = ARGV[1] .. ':' .. generation .. ':' .. version
+return {key, redis.call('HGET', key, ARGV[2])}
+"""
+
+
+def tile_bounds(z, x, y):
+    """ Tile -> EPSG:3857 (minx, miny, maxx, maxy) """
+    size = 2 * WORLD_SIZE / 2 ** z
+    minx = -WORLD_SIZE + x * size
+    maxy = WORLD_SIZE - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_at(z, lng, lat):
+    """ WGS84 point -> (x, y) of the tile at zoom `z` which contains it """
+    n = 2 ** z
+    lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi)
+            / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_range(z, bbox):
+    """
+    WGS84 bbox -> (minx, miny, maxx, maxy) tile range at zoom `z`, grown
+    by one tile on every side for the tile buffer
+    """
+    n = 2 ** z
+    minx, maxy = tile_at(z, bbox[0], bbox[1])
+    maxx, miny = tile_at(z, bbox[2], bbox[3])
+    return (max(minx - 1, 0), max(miny - 1, 0),
+            min(maxx + 1, n - 1), min(maxy + 1, n - 1))
+
+
+def render_tile(z, x, y, provider_id=None, using=None):
+    """ Render a tile as MVT bytes (empty when no area touches it) """
+    extent = settings.GEOAPI_TILE_EXTENT
+    buffer = settings.GEOAPI_TILE_BUFFER
+    bounds = tile_bounds(z, x, y)
+    margin = (bounds[2] - bounds[0]) * buffer / extent
+    query_bounds = (bounds[0] - margin, bounds[1] - margin,
+                    bounds[2] + margin, bounds[3] + margin)
+    params = [LAYER_NAME, extent] + list(bounds) + [extent, buffer] + \
+        list(query_bounds)
+    where = ''
+    if provider_id is not None:
+        where = 'AND a.provider_id = %s'
+        params.append(provider_id)
+    sql = TILE_SQL.format(area=ServiceArea._meta.db_table, where=where)
+    connection = connections[using or router.db_for_read(ServiceArea)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return bytes(row[0] or b'')
+
+
+class TileCache(object):
+    prefix = 'geoapi:tile:'
+
+    def __init__(self):
+        self._script = None
+
+    def generation_key(self, z):
+        return self.prefix + 'generation:%d' % z
+
+    def tile_key(self, z, x, y):
+        return self.prefix + '%d:%d:%d' % (z, x, y)
+
+    def version_key(self, z, x, y):
+        return self.prefix + 'version:%d:%d:%d' % (z, x, y)
+
+    def _lookup(self, client, z, x, y, field):
+        if self._script is None:
+            self._script = client.register_script(LOOKUP_SCRIPT)
+        result = self._script(
+            keys=[self.generation_key(z), self.version_key(z, x, y)],
+            args=[self.tile_key(z, x, y), field], client=client)
+        # a nil value truncates the returned Lua table
+        return result[0], result[1] if len(result) > 1 else None
+
+    def get_or_render(self, z, x, y, provider_id=None):
+        """ Cached `render_tile(z, x, y, provider_id)` """
+        field = '' if provider_id is None else str(provider_id)
+        try:
+            client = get_redis()
+            key, tile = self._lookup(client, z, x, y, field)
+        except redis.RedisError as e:
+            logger.warning('tile cache is unavailable: %s', e)
+            return render_tile(z, x, y, provider_id)
+        if tile is not None:
+            return tile
+        tile = render_tile(z, x, y, provider_id, using='default')
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.hset(key, field, tile)
+            pipe.expire(key, settings.GEOAPI_TILE_CACHE_TIMEOUT)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning('tile cache is unavailable: %s', e)
+        return tile
+
+    def invalidate(self, boxes):
+        """ Drop the cached tiles which touch any of the WGS84 `boxes` """
+        if not boxes:
+            return
+        limit = settings.GEOAPI_TILE_INVALIDATE_MAX_TILES
+        # outlives every tile written under the old version, a version
+        # which expired would address such a tile again
+        timeout = 2 * settings.GEOAPI_TILE_CACHE_TIMEOUT
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for z in range(settings.GEOAPI_TILE_MAX_ZOOM + 1):
+                ranges = [tile_range(z, bbox) for bbox in boxes]
+                count = sum((r[2] - r[0] + 1) * (r[3] - r[1] + 1)
+                            for r in ranges)
+                if count > limit:
+                    pipe.incr(self.generation_key(z))
+                    continue
+                for key in set(
+                        self.version_key(z, x, y)
+                        for minx, miny, maxx, maxy in ranges
+                        for x in range(minx, maxx + 1)
+                        for y in range(miny, maxy + 1)):
+                    pipe.incr(key)
+                    pipe.expire(key, timeout)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error('can not invalidate tile cache: %s', e)
+
+    def flush(self):
+        """ Drop every cached tile """
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for z in range(settings.GEOAPI_TILE_MAX_ZOOM + 1):
+                pipe.incr(self.generation_key(z))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error('can not invalidate tile cache: %s', e)
+
+
+tile_cache = TileCache()
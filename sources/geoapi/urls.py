@@ -1,7 +1,7 @@
 from django.conf.urls import url, include
 from rest_framework.routers import DefaultRouter
 
-from .views import ServiceAreaViewSet, ProviderViewSet
+from .views import ServiceAreaTileView, ServiceAreaViewSet, ProviderViewSet
 
 
 router = DefaultRouter()
@@ -10,5 +10,7 @@ router.register('service-areas', ServiceAreaViewSet)
 
 
 urlpatterns = [
+    url(r'^api/v1/service-areas/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)'
+        r'\.pbf$', ServiceAreaTileView.as_view(), name='servicearea-tile'),
     url(r'^api/v1/', include(router.urls)),
 ]
@@ -1,43 +1,307 @@
-import json
+from collections import OrderedDict
 
-from rest_framework import exceptions
-from rest_framework import viewsets
-from rest_framework_gis.pagination import GeoJsonPagination
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.http import HttpResponse, StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import exceptions, status, viewsets
+from rest_framework.decorators import list_route
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from utils.db import ReplicaReadMixin
+
+from .changes import ChangeFeedMixin
+from .conditional import ConditionalGetMixin
+from .lookups import (
+    batch_lookup, filter_contains, parse_choice, parse_fields, parse_lnglat,
+    parse_number, parse_point, parse_points, parse_provider_id)
+from .export import iter_geojson
+from .filters import ProviderFilter, ServiceAreaFilter
+from .functions import (
+    GeographyDistance, GeographyDWithin, SimplifyPreserveTopology)
 from .models import ServiceArea, Provider
+from .pagination import (
+    GeoJsonCursorPagination, GeoJsonPagination, PageNumberPagination,
+    PaginationModeMixin)
+from .parsers import NDJSONParser
+from .renderers import RawJSONRenderer
 from .serializers import ServiceAreaSerializer, ProviderSerializer
+from .tiles import render_tile, tile_cache
+
+SERVICE_AREA_FIELDS = ('id', 'name', 'provider', 'price')
+GEOMETRY_MODES = ('full', 'bbox', 'none')
 
 
-class ServiceAreaViewSet(viewsets.ModelViewSet):
+class ServiceAreaViewSet(ReplicaReadMixin, ChangeFeedMixin,
+                         ConditionalGetMixin, PaginationModeMixin,
+                         viewsets.ModelViewSet):
     serializer_class = ServiceAreaSerializer
-    queryset = ServiceArea.objects.all()
+    queryset = ServiceArea.objects.select_related('provider')
     pagination_class = GeoJsonPagination
+    cursor_pagination_class = GeoJsonCursorPagination
+    renderer_classes = (RawJSONRenderer, BrowsableAPIRenderer)
+    filter_backends = (DjangoFilterBackend,)
+    filter_class = ServiceAreaFilter
+    read_only_actions = ('lookup',)
 
     def get_queryset(self):
-        queryset = ServiceArea.objects.all()
-        provider_id = self.request.query_params.get('provider_id', None)
+        queryset = self.get_version_queryset()
+        if self.request.method == 'GET':
+            queryset = self.project(queryset)
+        return queryset
+
+    def get_version_queryset(self):
+        # kept, so the point is looked up once per request
+        if hasattr(self, '_filtered_queryset'):
+            return self._filtered_queryset
+        queryset = ServiceArea.objects.select_related('provider')
+        provider_id = parse_provider_id(
+            self.request.query_params.get('provider_id', None))
         if provider_id is not None:
-            if not provider_id.isdigit():
-                raise exceptions.ValidationError('invalid provider_id')
-            queryset = queryset.filter(provider_id=int(provider_id))
-        poly_contains = self.request.query_params.get('poly__contains', None)
-        if poly_contains is not None:
-            try:
-                data = json.loads(poly_contains)
-                data_coordinates = [float(x) for x in data['coordinates']]
-                data_type = data['type']
-                if data_type != "Point":
-                    raise ValueError('invalid type! only Point type allowed')
-                if len(data_coordinates) != 2:
-                    raise ValueError('wrong coordinates length')
-                pnt_wkt = 'POINT(%s)' % ' '.join(map(str, data_coordinates))
-            except (ValueError, KeyError, TypeError) as e:
-                raise exceptions.ValidationError(
-                    'invalid poly__contains: %s' % e)
-            queryset = queryset.filter(poly__contains=pnt_wkt)
+            queryset = queryset.filter(provider_id=provider_id)
+        point = parse_point(
+            self.request.query_params.get('poly__contains', None))
+        if point is not None:
+            queryset = filter_contains(queryset, point, provider_id)
+        near, radius = self.get_near()[:2]
+        if near is not None:
+            queryset = queryset.annotate(
+                distance=GeographyDistance('poly', near))
+            if radius is not None:
+                queryset = queryset.annotate(
+                    within=GeographyDWithin('poly', near, radius)
+                ).filter(within=True)
+            # nearest first, straight from the index
+            queryset = queryset.order_by('distance')
+        self._filtered_queryset = queryset
         return queryset
 
+    def get_changes_queryset(self):
+        return self.project(ServiceArea.objects.select_related('provider'))
+
+    def get_near(self):
+        """
+        `near=lng,lat`, `radius=` (metres) and `limit=` query params
+        -> (point, radius, limit), point is `None` without `near`
+        """
+        if not hasattr(self, '_near'):
+            params = self.request.query_params
+            self._near = (
+                parse_lnglat(params.get('near', None), 'near'),
+                parse_number(params.get('radius', None), 'radius',
+                             minimum=0),
+                parse_number(params.get('limit', None), 'limit', cast=int,
+                             minimum=1,
+                             maximum=settings.GEOAPI_NEAR_MAX_LIMIT) or
+                settings.GEOAPI_NEAR_LIMIT)
+        return self._near
+
+    def list(self, request, *args, **kwargs):
+        if self.get_near()[0] is None:
+            return super(ServiceAreaViewSet, self).list(
+                request, *args, **kwargs)
+        # the `limit` nearest areas are the whole response, they are
+        # neither paginated nor versioned
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(
+            queryset[:self.get_near()[2]], many=True)
+        return Response(serializer.data)
+
+    def get_version_fields(self):
+        fields = self.get_projection()[0]
+        if fields is None or 'provider' in fields:
+            return ('updated', 'provider__updated')
+        return ('updated',)
+
+    def get_projection(self):
+        """
+        `fields=`, `geometry=`, `simplify=` and `precision=` query params
+        -> (fields, geometry, simplify, precision)
+        """
+        if not hasattr(self, '_projection'):
+            params = self.request.query_params
+            self._projection = (
+                parse_fields(params.get('fields', None), SERVICE_AREA_FIELDS),
+                parse_choice(params.get('geometry', None), 'geometry',
+                             GEOMETRY_MODES),
+                parse_number(params.get('simplify', None), 'simplify',
+                             minimum=0),
+                parse_number(params.get('precision', None), 'precision',
+                             cast=int, minimum=0, maximum=15))
+        return self._projection
+
+    def use_raw_geojson(self):
+        """
+        Splice geometries rendered by PostGIS into the response instead of
+        building them from `poly` (see `GEOAPI_RAW_GEOJSON`)
+        """
+        return settings.GEOAPI_RAW_GEOJSON and \
+            self.action in ('list', 'retrieve', 'export', 'changes')
+
+    def project(self, queryset):
+        """ Load only the columns the response is going to use """
+        fields, geometry, simplify, precision = self.get_projection()
+        compute_geometry = simplify is not None or precision is not None
+        if self.use_raw_geojson():
+            compute_geometry = True
+            if precision is None:
+                precision = 15
+        if fields is None and geometry == 'full' and not compute_geometry:
+            return queryset
+        if fields is None:
+            fields = SERVICE_AREA_FIELDS
+        columns = ['id', 'updated']
+        if 'name' in fields:
+            columns.append('name')
+        if 'price' in fields:
+            columns.extend(['price', 'price_currency'])
+        if 'provider' in fields:
+            columns.extend(['provider', 'provider__updated'])
+            columns.extend('provider__' + x
+                           for x in ProviderSerializer.Meta.fields)
+        else:
+            queryset = queryset.select_related(None)
+        if geometry == 'full' and compute_geometry:
+            # GeoJSON is rendered by PostGIS, see ServiceAreaSerializer
+            geom = 'poly'
+            if simplify:
+                geom = SimplifyPreserveTopology('poly', simplify)
+            queryset = queryset.annotate(
+                geojson=AsGeoJSON(geom, precision=precision))
+        elif geometry == 'full':
+            columns.append('poly')
+        if geometry != 'none':
+            columns.extend(ServiceArea.BBOX_FIELDS)
+        return queryset.only(*columns)
 
-class ProviderViewSet(viewsets.ModelViewSet):
+    def get_serializer_context(self):
+        context = super(ServiceAreaViewSet, self).get_serializer_context()
+        if self.request is not None and self.request.method == 'GET':
+            context['fields'], context['geometry'] = \
+                self.get_projection()[:2]
+            context['raw_geojson'] = self.use_raw_geojson()
+            context['distance'] = self.get_near()[0] is not None
+        if self.request is not None and self.action == 'bulk':
+            context['allow_partial'] = parse_choice(
+                self.request.query_params.get('allow_partial', None),
+                'allow_partial', ('false', 'true')) == 'true'
+        return context
+
+    @list_route(methods=['post', 'put', 'patch', 'delete'])
+    def bulk(self, request):
+        """
+        Bulk writes in one transaction. POST creates and PUT/PATCH update
+        a list of areas or a FeatureCollection (updates need an `id` per
+        item), DELETE takes a list of ids. With `allow_partial=true` the
+        valid items are saved and the invalid ones reported in `errors`.
+        """
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+        instances = None
+        if request.method != 'POST':
+            instances = ServiceArea.objects.select_related('provider') \
+                .filter(id__in=self.get_bulk_ids(request.data))
+        serializer = self.get_serializer(
+            instances, data=request.data, many=True,
+            partial=request.method == 'PATCH')
+        serializer.is_valid(raise_exception=True)
+        errors = [{'index': i, 'errors': detail}
+                  for i, detail in serializer.item_errors]
+        if errors and not serializer.validated_data:
+            raise exceptions.ValidationError(errors)
+        serializer.save()
+        data = OrderedDict(serializer.data)
+        data['errors'] = errors
+        return Response(data, status=status.HTTP_201_CREATED
+                        if request.method == 'POST' else status.HTTP_200_OK)
+
+    def get_bulk_ids(self, data):
+        if isinstance(data, dict):
+            data = data.get('features')
+        ids = set()
+        for item in data if isinstance(data, list) else ():
+            if isinstance(item, dict):
+                pk = (item.get('properties') or item).get('id', item.get('id'))
+                if isinstance(pk, int):
+                    ids.add(pk)
+        return ids
+
+    def bulk_destroy(self, request):
+        ids = request.data
+        if isinstance(ids, dict):
+            ids = ids.get('ids')
+        if not isinstance(ids, list) or \
+                not all(isinstance(x, int) for x in ids):
+            raise exceptions.ValidationError('expected a list of ids')
+        if len(ids) > settings.GEOAPI_BULK_MAX_ITEMS:
+            raise exceptions.ValidationError(
+                'too many ids (max %d)' % settings.GEOAPI_BULK_MAX_ITEMS)
+        deleted = ServiceArea.objects.filter(id__in=ids).delete()[0]
+        return Response({'deleted': deleted})
+
+    @list_route()
+    def export(self, request):
+        """
+        Stream every (filtered) area in one response:
+        a GeoJSON FeatureCollection or, with `output=ndjson`, one Feature
+        per line.
+        """
+        output = parse_choice(request.query_params.get('output', None),
+                              'output', ('geojson', 'ndjson'))
+        queryset = self.filter_queryset(self.get_queryset())
+        ndjson = output == 'ndjson'
+        response = StreamingHttpResponse(
+            iter_geojson(queryset, ndjson, self.get_serializer_context()),
+            content_type='application/x-ndjson' if ndjson
+            else 'application/geo+json')
+        response['Content-Disposition'] = \
+            'attachment; filename="service-areas.%s"' % output
+        return response
+
+    @list_route(methods=['post'], parser_classes=(JSONParser, NDJSONParser))
+    def lookup(self, request):
+        """
+        Batch `poly__contains`: POST a JSON array (or NDJSON lines) of
+        GeoJSON Points, get the matching areas for every point.
+        """
+        provider_id = parse_provider_id(
+            request.query_params.get('provider_id', None))
+        points = parse_points(request.data)
+        areas = batch_lookup(points, provider_id)
+        return Response({'results': [
+            {'point': {'type': 'Point', 'coordinates': list(point)},
+             'areas': point_areas}
+            for point, point_areas in zip(points, areas)]})
+
+
+class ProviderViewSet(ReplicaReadMixin, ChangeFeedMixin, ConditionalGetMixin,
+                      PaginationModeMixin, viewsets.ModelViewSet):
     serializer_class = ProviderSerializer
     queryset = Provider.objects.all()
+    pagination_class = PageNumberPagination
+    filter_backends = (DjangoFilterBackend,)
+    filter_class = ProviderFilter
+
+
+class ServiceAreaTileView(ReplicaReadMixin, APIView):
+    """
+    Service areas as a Mapbox Vector Tile (layer `service_areas` with
+    `id`, `name`, `provider_id`, `price` and `price_currency`),
+    `provider_id` filters the areas.
+    """
+
+    def get(self, request, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if z > settings.GEOAPI_TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise exceptions.NotFound('tile does not exist')
+        provider_id = parse_provider_id(
+            request.query_params.get('provider_id', None))
+        if settings.GEOAPI_TILE_CACHE:
+            tile = tile_cache.get_or_render(z, x, y, provider_id)
+        else:
+            tile = render_tile(z, x, y, provider_id)
+        return HttpResponse(
+            tile, content_type='application/vnd.mapbox-vector-tile')
@@ -0,0 +1,127 @@
+"""
+Read replicas and persistent connections.
+
+Replicas are the `replicaN` aliases built from `POSTGRES_REPLICA_HOSTS`
+(see `DATABASE_REPLICAS`). `ReplicaRouter` sends reads to one of them only
+while a view marked with `ReplicaReadMixin` handles a read-only request;
+everything else, including reads inside a write request, stays on
+`default`. After a write the client gets a `STICKY_COOKIE` for
+`POSTGRES_REPLICA_STICKY_SECONDS` and reads from `default` until it
+expires, so it sees its own writes whatever the replication lag.
+
+Connections live for `POSTGRES_CONN_MAX_AGE` seconds. A connection idle
+for longer than `POSTGRES_CONN_HEALTH_CHECK` seconds is pinged at the
+start of the next request and reopened if the server went away; a
+replica which does not accept connections is skipped for as long.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+STICKY_COOKIE = 'geoapi_primary'
+
+_local = threading.local()
+
+
+def replica_alias():
+    """ -> replica the current request reads from or None """
+    return getattr(_local, 'replica', None)
+
+
+def use_replica(alias):
+    _local.replica = alias
+
+
+# replica alias -> time.monotonic() until which it is skipped
+_down = {}
+
+
+def choose_replica():
+    """ -> a random replica which accepts connections or None """
+    now = time.monotonic()
+    replicas = [alias for alias in settings.DATABASE_REPLICAS
+                if _down.get(alias, 0) <= now]
+    random.shuffle(replicas)
+    for alias in replicas:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            _down[alias] = now + settings.POSTGRES_CONN_HEALTH_CHECK
+        else:
+            return alias
+    return None
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas mirror `default`
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaReadMixin(object):
+    """
+    Read from a replica for safe methods and for `read_only_actions`
+    (POST actions which do not write), unless the client wrote recently
+    or the action is one of `primary_read_actions` (looked up with
+    `getattr`, a mixin after this one in the bases may define it).
+    """
+    read_only_actions = ()
+
+    def is_read_only(self, request):
+        return (request.method in SAFE_METHODS or
+                getattr(self, 'action', None) in self.read_only_actions)
+
+    def initial(self, request, *args, **kwargs):
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+        if not self.is_read_only(request):
+            return
+        # the middleware must not make a read-only POST sticky
+        request._request.read_only = True
+        if STICKY_COOKIE not in request.COOKIES and getattr(
+                self, 'action', None) not in getattr(
+                    self, 'primary_read_actions', ()):
+            use_replica(choose_replica())
+
+
+def check_connections(**kwargs):
+    """
+    Close persistent connections which stopped working while idle, so
+    the request reconnects instead of failing on the first query.
+    """
+    now = time.monotonic()
+    interval = settings.POSTGRES_CONN_HEALTH_CHECK
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        last_used = getattr(connection, 'last_used', None)
+        if last_used is None or now - last_used < interval:
+            continue
+        if connection.is_usable():
+            connection.last_used = now
+            continue
+        connection.close()
+
+
+def mark_used(**kwargs):
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used = now
+
+
+request_started.connect(check_connections)
+request_finished.connect(mark_used)
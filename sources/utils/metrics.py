@@ -0,0 +1,290 @@
+"""
+Request metrics aggregated per process and exported in the Prometheus
+text format.
+
+Every worker keeps its histograms in memory and dumps them to
+`GEOAPI_METRICS_DIR/<pid>.json` at most every
+`GEOAPI_METRICS_FLUSH_INTERVAL` seconds (write + rename, so readers never
+see a partial file). `/metrics` sums the files of all workers, so it is
+correct whichever gunicorn worker serves it; the files of workers which
+exited are folded into `archive.json` first, so the sums never go down.
+"""
+import bisect
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Time spent per request and phase '
+        '(db, serialize, app, render, total)',
+        DURATION_BUCKETS),
+    'http_request_queries': (
+        'SQL queries per request', QUERY_BUCKETS),
+}
+
+_local = threading.local()
+
+
+def current_timing():
+    return getattr(_local, 'timing', None)
+
+
+class RequestTiming(object):
+    """
+    Per-request counters filled by the middleware, `TimedCursorMixin` and
+    `TimedSerializerMixin`
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.render_started = None
+        self.render_finished = None
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+
+    def activate(self):
+        _local.timing = self
+
+    def deactivate(self):
+        if current_timing() is self:
+            _local.timing = None
+
+    def phases(self):
+        """ -> dict of phase durations in seconds """
+        now = time.perf_counter()
+        total = now - self.started
+        render = 0.0
+        if self.render_started is not None:
+            render = (self.render_finished or now) - self.render_started
+        return {
+            'db': self.db,
+            'serialize': self.serialize,
+            'app': max(total - render - self.db - self.serialize, 0.0),
+            'render': render,
+            'total': total,
+        }
+
+
+class TimedCursorMixin(object):
+    """
+    Adds the time of every query to the current `RequestTiming`, mixed
+    into the cursor wrappers of the `utils.postgis` database backend
+    """
+
+    def _timed(self, method, *args):
+        timing = current_timing()
+        if timing is None:
+            return method(*args)
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            timing.db += time.perf_counter() - started
+            timing.queries += 1
+
+    def execute(self, sql, params=None):
+        return self._timed(
+            super(TimedCursorMixin, self).execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(
+            super(TimedCursorMixin, self).executemany, sql, param_list)
+
+    def callproc(self, procname, params=None):
+        return self._timed(
+            super(TimedCursorMixin, self).callproc, procname, params)
+
+
+class TimedSerializerMixin(object):
+    """
+    Adds the time spent building `data` (without the queries it runs) to
+    the current `RequestTiming` as `serialize`
+    """
+
+    @property
+    def data(self):
+        timing = current_timing()
+        if timing is None or timing.serializing:
+            return super(TimedSerializerMixin, self).data
+        timing.serializing = True
+        started = time.perf_counter()
+        db = timing.db
+        try:
+            return super(TimedSerializerMixin, self).data
+        finally:
+            timing.serializing = False
+            timing.serialize += \
+                time.perf_counter() - started - (timing.db - db)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_values(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def merge_values(total, values):
+    for key, counts in values.items():
+        if key in total:
+            total[key] = [a + b for a, b in zip(total[key], counts)]
+        else:
+            total[key] = counts
+
+
+def write_atomic(path, text):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(text)
+    os.rename(tmp, path)
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._flushed_at = 0.0
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = json.dumps([name, sorted(labels.items())])
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # bucket counts, then sum and count
+                counts = self._values[key] = [0] * (len(buckets) + 3)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @property
+    def path(self):
+        return os.path.join(
+            settings.GEOAPI_METRICS_DIR, '%d.json' % os.getpid())
+
+    def flush(self, force=False):
+        now = time.time()
+        interval = settings.GEOAPI_METRICS_FLUSH_INTERVAL
+        if not force and now - self._flushed_at < interval:
+            return
+        self._flushed_at = now
+        with self._lock:
+            data = json.dumps(self._values)
+        os.makedirs(settings.GEOAPI_METRICS_DIR, exist_ok=True)
+        write_atomic(self.path, data)
+
+    def _locked(self, operation):
+        """ `archive.lock` held with `operation` (fcntl.LOCK_SH/LOCK_EX) """
+        directory = settings.GEOAPI_METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        lock = open(os.path.join(directory, 'archive.lock'), 'a')
+        fcntl.flock(lock, operation)
+        return lock
+
+    def prune(self):
+        """ Fold the dumps of workers which exited into `archive.json` """
+        directory = settings.GEOAPI_METRICS_DIR
+        dead = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            name = os.path.basename(path)[:-len('.json')]
+            if name.isdigit() and not pid_alive(int(name)):
+                dead.append(path)
+        if not dead:
+            return
+        archive = os.path.join(directory, 'archive.json')
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                total = read_values(archive)
+            except FileNotFoundError:
+                total = {}
+            merged = []
+            for path in dead:
+                try:
+                    merge_values(total, read_values(path))
+                except FileNotFoundError:
+                    # folded by another worker
+                    continue
+                except ValueError:
+                    pass
+                merged.append(path)
+            if not merged:
+                return
+            write_atomic(archive, json.dumps(total))
+            for path in merged:
+                os.unlink(path)
+
+    def collect(self):
+        """ Sum the dumps of every worker """
+        total = {}
+        with self._locked(fcntl.LOCK_SH):
+            for path in glob.glob(
+                    os.path.join(settings.GEOAPI_METRICS_DIR, '*.json')):
+                try:
+                    merge_values(total, read_values(path))
+                except (OSError, ValueError):
+                    continue
+        return total
+
+    def render(self):
+        """ Prometheus text exposition format """
+        series = {}
+        for key, counts in self.collect().items():
+            name, labels = json.loads(key)
+            series.setdefault(name, []).append((labels, counts))
+        lines = []
+        for name, (help_text, buckets) in sorted(HISTOGRAMS.items()):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, counts in sorted(series.get(name, ())):
+                cumulative = 0
+                for bound, count in zip(
+                        [repr(float(x)) for x in buckets] + ['+Inf'],
+                        counts[:-2]):
+                    cumulative += count
+                    lines.append('%s_bucket{%s} %d' % (
+                        name, format_labels(labels + [['le', bound]]),
+                        cumulative))
+                lines.append('%s_sum{%s} %r' % (
+                    name, format_labels(labels), float(counts[-2])))
+                lines.append('%s_count{%s} %d' % (
+                    name, format_labels(labels), counts[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    registry.flush(force=True)
+    registry.prune()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,80 @@
+import time
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+from .db import STICKY_COOKIE, use_replica
+from .metrics import RequestTiming, registry
+
+PHASES = ('db', 'serialize', 'app', 'render', 'total')
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    """
+    Measure SQL (query count and time, see the `utils.postgis` database
+    backend), serializers, the rest of the view code and response
+    rendering per request. The numbers go to the `Server-Timing` response
+    header and to the `/metrics` histograms, labeled with the URL name of
+    the view. `serialize` is the time serializers spend building `data`
+    outside SQL, `app` the rest of the view outside SQL.
+    """
+
+    def process_request(self, request):
+        request.timing = RequestTiming()
+        request.timing.activate()
+
+    def process_template_response(self, request, response):
+        # the view is done, DRF/template responses are rendered next
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            timing.render_started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: setattr(
+                    timing, 'render_finished', time.perf_counter()))
+        return response
+
+    def process_response(self, request, response):
+        timing = getattr(request, 'timing', None)
+        if timing is None:
+            return response
+        timing.deactivate()
+        phases = timing.phases()
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f' % (name, phases[name] * 1000) +
+            (';desc="%d queries"' % timing.queries if name == 'db' else '')
+            for name in PHASES)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        if not settings.GEOAPI_METRICS or view == 'metrics':
+            return response
+        for name in PHASES:
+            registry.observe('http_request_duration_seconds',
+                             {'view': view, 'phase': name}, phases[name])
+        registry.observe('http_request_queries', {'view': view},
+                         timing.queries)
+        registry.flush()
+        return response
+
+
+class ReplicaStickinessMiddleware(MiddlewareMixin):
+    """
+    Drop the replica chosen by `utils.db.ReplicaReadMixin` at the end of
+    the request and send clients which wrote the `STICKY_COOKIE`, which
+    keeps their reads on the primary until replicas have caught up.
+    """
+
+    def process_request(self, request):
+        use_replica(None)
+
+    def process_response(self, request, response):
+        use_replica(None)
+        if (settings.DATABASE_REPLICAS and
+                request.method not in SAFE_METHODS and
+                not getattr(request, 'read_only', False) and
+                response.status_code < 400):
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=settings.POSTGRES_REPLICA_STICKY_SECONDS,
+                httponly=True)
+        return response
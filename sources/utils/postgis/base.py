@@ -0,0 +1,24 @@
+"""
+PostGIS backend whose cursors add their queries to the current request
+timing (see utils/metrics.py).
+"""
+from django.contrib.gis.db.backends.postgis import base
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+from utils.metrics import TimedCursorMixin
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def make_cursor(self, cursor):
+        return TimedCursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        return TimedCursorDebugWrapper(cursor, self)